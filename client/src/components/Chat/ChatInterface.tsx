@@ -18,6 +18,10 @@ interface ChatInterfaceProps {
   setShowEmojiPicker: (show: boolean) => void;
   onCustomizationToggle: () => void;
   onMarkRead: (playerId: string) => void;
+  /** בן השיחה מקליד עכשיו (פריים typing מהשרת) */
+  partnerTyping?: boolean;
+  /** נקרא בכל הקשה; ה-hook מווסת את השליחה לשרת */
+  onTyping?: () => void;
 }
 
 const SCROLL_STICKY_THRESHOLD = 28;
@@ -73,6 +77,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
   setShowEmojiPicker,
   onCustomizationToggle,
   onMarkRead,
+  partnerTyping = false,
+  onTyping,
 }) => {
   const [messageText, setMessageText] = useState('');
   const [quotedMessage, setQuotedMessage] = useState<Message | null>(null);
@@ -214,6 +220,7 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
     if (!isTyping) setIsTyping(true);
     if (typingTimeoutRef.current) clearTimeout(typingTimeoutRef.current);
     typingTimeoutRef.current = setTimeout(() => setIsTyping(false), 1000);
+    if (selectedPlayer && e.target.value) onTyping?.();
     if (selectedPlayer && isAtBottom) markReadAndStick();
   };
 
@@ -439,6 +446,9 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
           </button>
         </div>
 
+        {partnerTyping && selectedPlayer && (
+          <div className="text-[11px] text-cyan-300 mt-2">{selectedPlayer.username} is typing...</div>
+        )}
         {isTyping && selectedPlayer && (
           <div className="text-[11px] text-slate-400 mt-2">You are typing...</div>
         )}
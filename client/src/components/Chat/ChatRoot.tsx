@@ -26,6 +26,8 @@ const ChatRoot: React.FC<ChatRootProps> = ({ onClose, playerId, currentChunkId }
         currentPlayerId,
         unreadCounts,
         markRead,
+        typingPeers,
+        notifyTyping,
     } = useWebSocket();
 
 
@@ -111,6 +113,8 @@ const ChatRoot: React.FC<ChatRootProps> = ({ onClose, playerId, currentChunkId }
                 setShowEmojiPicker={setShowEmojiPicker}
                 onCustomizationToggle={() => setShowCustomization(true)}
                 onMarkRead={markRead}
+                partnerTyping={!!selectedPlayer && typingPeers.includes(selectedPlayer.id)}
+                onTyping={notifyTyping}
             />
 
             {/* ---- Top-right buttons ---- */}
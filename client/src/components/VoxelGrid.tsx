@@ -20,6 +20,7 @@ interface GameState {
   h: number;
   data: number[];
   chunk_id?: string;
+  version?: number;
 }
 
 interface VoxelGridProps {
@@ -37,6 +38,9 @@ const VoxelGrid: React.FC<VoxelGridProps> = ({ serverUrl }) => {
   const wsRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const reconnectingRef = useRef<boolean>(false);
+  // resume token from the server + the last board we applied, for delta catch-up after a drop
+  const resumeTokenRef = useRef<string | null>(null);
+  const lastMatrixRef = useRef<GameState | null>(null);
 
   const [showMessageInput, setShowMessageInput] = useState(false);
   const [currentMessage, setCurrentMessage] = useState<any>(null);
@@ -67,12 +71,22 @@ const VoxelGrid: React.FC<VoxelGridProps> = ({ serverUrl }) => {
         authStorage.getToken?.() ?? localStorage.getItem("token") ?? "";
       if (!token) return;
 
-      const url = `${base}?token=${encodeURIComponent(token)}`;
+      let url = `${base}?token=${encodeURIComponent(token)}`;
+      const resuming = resumeTokenRef.current !== null;
+      const last = lastMatrixRef.current;
+      if (resuming) {
+        url += `&resume=${encodeURIComponent(resumeTokenRef.current!)}`;
+        if (last?.chunk_id && typeof last.version === "number") {
+          url += `&chunk=${encodeURIComponent(last.chunk_id)}&version=${last.version}`;
+        }
+      }
       const ws = new WebSocket(url);
       wsRef.current = ws;
 
       ws.onopen = () => {
         setConnected(true);
+        // a resumed session is sent its catch-up (delta or matrix) without asking
+        if (resuming) return;
         try {
           ws.send(JSON.stringify({ k: "whereami" }));
         } catch {}
@@ -87,13 +101,32 @@ const VoxelGrid: React.FC<VoxelGridProps> = ({ serverUrl }) => {
             setPlayerCount(data.total_players);
           }
 
-          if (data.type === "matrix") {
-            setGameState({
+          if (data.type === "ping") {
+            // the server paces its updates to our round-trip time
+            ws.send(JSON.stringify({ k: "pong", t: data.t }));
+          } else if (data.type === "session" && data.resume) {
+            resumeTokenRef.current = String(data.resume);
+          } else if (data.type === "delta") {
+            const prev = lastMatrixRef.current;
+            if (prev && prev.chunk_id === data.chunk_id && prev.version === data.since) {
+              const cells = prev.data.slice();
+              for (const [i, v] of data.cells as [number, number][]) cells[i] = v;
+              const next = { ...prev, data: cells, version: data.version };
+              lastMatrixRef.current = next;
+              setGameState(next);
+            } else {
+              ws.send(JSON.stringify({ k: "whereami" }));
+            }
+          } else if (data.type === "matrix") {
+            const next = {
               w: data.w,
               h: data.h,
               data: data.data,
               chunk_id: data.chunk_id,
-            });
+              version: data.version,
+            };
+            lastMatrixRef.current = next;
+            setGameState(next);
             if (data.chunk_id) {
               sessionStorage.setItem("current_chunk_id", String(data.chunk_id));
             }
@@ -223,6 +256,15 @@ const VoxelGrid: React.FC<VoxelGridProps> = ({ serverUrl }) => {
     return () => window.removeEventListener("keydown", onKeyDown);
   }, [handleKeyPress]);
 
+  // the server stops sending updates to a tab idle for a while; coming back wakes it with a fresh snapshot
+  useEffect(() => {
+    const onVisible = () => {
+      if (document.visibilityState === "visible") sendMessage({ k: "wake" });
+    };
+    document.addEventListener("visibilitychange", onVisible);
+    return () => document.removeEventListener("visibilitychange", onVisible);
+  }, [sendMessage]);
+
   const renderGrid = () => {
     if (!gameState) return null;
     const cells: JSX.Element[] = [];
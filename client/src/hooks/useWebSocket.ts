@@ -406,6 +406,9 @@ type UseWS = {
   currentPlayerId?: string
   unreadCounts: Record<string, number>
   markRead: (playerId: string) => void
+  /** מי מקליד אליי עכשיו (השרת שולח start/stop פעם אחת לרצף) */
+  typingPeers: string[]
+  notifyTyping: () => void
 }
 
 export function useWebSocket(): UseWS {
@@ -417,10 +420,12 @@ export function useWebSocket(): UseWS {
   const [selectedPlayer, _setSelectedPlayer] = useState<Player | null>(null)
   const [currentPlayerId, _setCurrentPlayerId] = useState<string>()
   const [unreadCounts, setUnreadCounts] = useState<Record<string, number>>({})
+  const [typingPeers, setTypingPeers] = useState<string[]>([])
 
   const selectedPlayerRef = useRef<Player | null>(null)
   const currentPlayerIdRef = useRef<string | undefined>(undefined)
   const seenIdsRef = useRef<Set<string>>(new Set())
+  const lastTypingSentRef = useRef(0)
 
   const messageIndexRef = useRef<Map<string, ChatMessage>>(new Map())
 
@@ -591,7 +596,30 @@ export function useWebSocket(): UseWS {
         return
       }
 
-      if (data.type === 'typing' || data.type === 'sent') return
+      if (data.type === 'typing') {
+        const from = (data as any).from as string | undefined
+        if (!from) return
+        const started = (data as any).state === 'start'
+        setTypingPeers(prev => (
+          started ? (prev.includes(from) ? prev : [...prev, from]) : prev.filter(id => id !== from)
+        ))
+        return
+      }
+
+      if (data.type === 'presence') {
+        // diff מקובץ: רק שחקנים שמעניינים אותי (בן השיחה / רשימת השיחות)
+        const online = new Set<string>((data as any).online || [])
+        const offline = new Set<string>((data as any).offline || [])
+        setActivePlayers(prev => prev.map(p => (
+          online.has(p.id) ? { ...p, is_connected: true }
+            : offline.has(p.id) ? { ...p, is_connected: false }
+            : p
+        )))
+        if (offline.size) setTypingPeers(prev => prev.filter(id => !offline.has(id)))
+        return
+      }
+
+      if (data.type === 'sent') return
       console.warn('Unhandled WS message:', data)
     }
 
@@ -647,6 +675,16 @@ export function useWebSocket(): UseWS {
     setUnreadCounts(prev => ({ ...prev, [p.id]: 0 }))
   }, [setSelectedPlayer])
 
+  const notifyTyping = useCallback(() => {
+    const ws = socketRef.current
+    if (!ws || ws.readyState !== WebSocket.OPEN || !selectedPlayerRef.current) return
+    // השרת מאחד רצף ממילא; פריים אחד בשנייה מספיק כדי להאריך אותו
+    const now = Date.now()
+    if (now - lastTypingSentRef.current < 1000) return
+    lastTypingSentRef.current = now
+    ws.send(JSON.stringify({ type: 'typing' }))
+  }, [])
+
   const markRead = useCallback((playerId: string) => {
     const ws = socketRef.current
     if (!ws || ws.readyState !== WebSocket.OPEN) return
@@ -735,8 +773,10 @@ export function useWebSocket(): UseWS {
     currentPlayerId,
     unreadCounts,
     markRead,
+    typingPeers,
+    notifyTyping,
   }), [
     isConnected, messages, selectedPlayer, sendMessage, selectPlayer, reactToMessage,
-    deleteMessage, activePlayers, currentPlayerId, unreadCounts, markRead
+    deleteMessage, activePlayers, currentPlayerId, unreadCounts, markRead, typingPeers, notifyTyping
   ])
 }
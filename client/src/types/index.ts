@@ -7,6 +7,7 @@ export interface Player {
   email: string
   avatar?: string
   is_active: boolean            // לשימוש /active-players
+  is_connected?: boolean        // מחובר לצ'אט (/players, מתעדכן מפריימי presence)
   level?: number
   status?: 'online' | 'in-game' | 'away'
 }
@@ -56,7 +57,8 @@ export type WSMessageType =
   | 'select'
   | 'message'
   | 'react'          // תגובה פרטית ל-msg (up/down/null)
-  | 'typing'
+  | 'typing'         // שרת -> לקוח: state 'start' | 'stop' פעם אחת לרצף; לקוח -> שרת: אני מקליד
+  | 'presence'       // שרת -> לקוח: diff מקובץ של online/offline
   | 'history'
   | 'sent'
   | 'error'
@@ -93,6 +95,13 @@ export interface WebSocketMessage {
   // --- error ---
   message_error?: string         // תיאור שגיאה אם type==='error'
 
+  // --- typing (server -> client) ---
+  state?: 'start' | 'stop'       // תחילת/סיום רצף הקלדה של from
+
+  // --- presence (server -> client) ---
+  online?: string[]              // התחברו מאז ה-diff הקודם
+  offline?: string[]             // התנתקו מאז ה-diff הקודם
+
   // --- message_updated (server -> client) ---
   // תכולת ההודעה המעודכנת כפי שהשרת משדר בעת מחיקה רכה.
   updated_message?: {
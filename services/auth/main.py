@@ -1,9 +1,9 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, EmailStr
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Iterable, Optional, Tuple, Union
 from pathlib import Path
 from jose import jwt
-import os, json, time, re
+import os, json, time, re, heapq, threading
 
 app = FastAPI()
 from fastapi.middleware.cors import CORSMiddleware
@@ -25,7 +25,13 @@ if not DATA.exists():
 JWT_SECRET = os.getenv("AUTH_JWT_SECRET", "CHANGE_ME_123456789")
 JWT_ALG = "HS256"
 
-BIN8_RE = re.compile(r"^[01]{8}$")
+# מדיניות מרחב המזהים: מזהה הוא מחרוזת בינארית ברוחב ID_BITS (ברירת מחדל 8 => 0–255)
+ID_BITS = int(os.getenv("AUTH_ID_BITS", "8"))
+ID_SPACE = 1 << ID_BITS
+ID_RE = re.compile(rf"^[01]{{{ID_BITS}}}$")
+LEGACY_ID_RE = re.compile(r"^[01]{8}$")
+# הרשמות נכתבות כשורה ליומן; users.json נכתב מחדש רק פעם ב-COMPACT_EVERY הרשמות
+COMPACT_EVERY = int(os.getenv("AUTH_COMPACT_EVERY", "1000"))
 
 class RegisterIn(BaseModel):
     username: str
@@ -36,63 +42,221 @@ class LoginIn(BaseModel):
     email: Optional[EmailStr] = None
     user_id: Optional[Union[int, str]] = None
 
-def to_bin8(n: int) -> str:
-    return f"{(n & 0xFF):08b}"
+def format_id(n: int, bits: int = ID_BITS) -> str:
+    if not 0 <= n < (1 << bits):
+        raise ValueError(f"user id {n} outside 0_{(1 << bits) - 1}")
+    return f"{n:0{bits}b}"
 
-def normalize_users(users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def normalize_users(users: List[Dict[str, Any]], bits: int = ID_BITS) -> List[Dict[str, Any]]:
+    id_re = ID_RE if bits == ID_BITS else re.compile(rf"^[01]{{{bits}}}$")
     for u in users:
         uid = u.get("id")
-        if isinstance(uid, int):
-            u["id"] = to_bin8(uid)
-        elif isinstance(uid, str) and BIN8_RE.fullmatch(uid):
-            pass
-        else:
-            try:
-                n = int(uid)
-                u["id"] = to_bin8(n)
-            except Exception:
-                raise HTTPException(500, f"bad_user_id_format: {uid!r}")
+        try:
+            if isinstance(uid, int):
+                u["id"] = format_id(uid, bits)
+            elif isinstance(uid, str) and id_re.fullmatch(uid):
+                pass
+            elif isinstance(uid, str) and LEGACY_ID_RE.fullmatch(uid):
+                # מזהה 8 ביט מלפני שינוי ID_BITS; מזהה שלא נכנס לרוחב החדש הוא שגיאה ולא נחתך
+                u["id"] = format_id(int(uid, 2), bits)
+            else:
+                u["id"] = format_id(int(uid), bits)
+        except (TypeError, ValueError):
+            raise HTTPException(500, f"bad_user_id_format: {uid!r} (AUTH_ID_BITS={bits})")
     return users
 
-def load_db() -> Dict[str, Any]:
-    with open(DATA, "r", encoding="utf-8") as f:
-        db = json.load(f)
-    db["users"] = normalize_users(db.get("users", []))
-    return db
+class IdAllocator:
+    """
+    מקצה את המזהה הפנוי הנמוך ביותר בלי להחזיק את כל מרחב המזהים בזיכרון:
+    מונה next (כל מה שמעליו פנוי) ו-heap של טווחים פנויים [lo, hi) מתחתיו –
+    חורים בין מזהים קיימים ומזהים ששוחררו. הזיכרון הוא O(מספר המשתמשים)
+    גם כש-AUTH_ID_BITS=32.
+    """
 
-def save_db(obj: Dict[str, Any]):
-    with open(DATA, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    def __init__(self, used: Iterable[int], space: int):
+        self.space = space
+        self._gaps: List[Tuple[int, int]] = []
+        prev = -1
+        for n in sorted(used):
+            if n > prev + 1:
+                self._gaps.append((prev + 1, n))  # ממוין => heap תקין
+            prev = n
+        self._next = prev + 1
 
-def next_free_id(users: List[Dict[str, Any]]) -> str:
-    used_nums = set()
-    for u in users:
-        uid = u.get("id")
-        if isinstance(uid, str) and BIN8_RE.fullmatch(uid):
-            used_nums.add(int(uid, 2))
-        elif isinstance(uid, int):
-            used_nums.add(uid & 0xFF)
+    def free_count(self) -> int:
+        return self.space - self._next + sum(hi - lo for lo, hi in self._gaps)
+
+    def take(self) -> Optional[int]:
+        if self._gaps:
+            lo, hi = self._gaps[0]
+            if lo + 1 < hi:
+                heapq.heapreplace(self._gaps, (lo + 1, hi))
+            else:
+                heapq.heappop(self._gaps)
+            return lo
+        if self._next >= self.space:
+            return None
+        self._next += 1
+        return self._next - 1
+
+    def release(self, n: int) -> None:
+        if n == self._next - 1:
+            self._next = n
         else:
-            raise HTTPException(500, "corrupted_user_id")
-    for n in range(256):
-        if n not in used_nums:
-            return to_bin8(n)
-    raise HTTPException(409, "id_space_exhausted_0_255")
+            heapq.heappush(self._gaps, (n, n + 1))
+
+class UserStore:
+    """
+    users.json בזיכרון עם אינדקסים ייחודיים (id, username ו-email באותיות קטנות)
+    ומקצה מזהים פנויים (IdAllocator). חיפוש הוא O(1) והרשמה O(log n): המשתמש
+    החדש נכתב כשורה אחת ליומן (append + fsync), ו-users.json נכתב מחדש רק פעם
+    ב-compact_every הרשמות או בטעינה. כל הכתיבות עוברות דרך נעילה אחת, כך
+    שהרשמות מקבילות (ה-endpoints רצים ב-threadpool) לא יכולות לקבל אותו מזהה/שם.
+    """
+
+    def __init__(self, path: Path, journal_path: Optional[Path] = None,
+                 id_bits: int = ID_BITS, compact_every: int = COMPACT_EVERY):
+        self.path = path
+        self.journal_path = journal_path or path.with_suffix(".journal")
+        self.id_bits = id_bits
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._mtime_ns: Optional[int] = None
+        self._users: List[Dict[str, Any]] = []
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_username: Dict[str, Dict[str, Any]] = {}
+        self._by_email: Dict[str, Dict[str, Any]] = {}
+        self._ids = IdAllocator((), 1 << id_bits)
+        self._journal = None
+        self._journaled = 0
+        self.load()
+
+    def load(self) -> None:
+        with self._lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                db = json.load(f)
+            users = db.get("users", [])
+            journaled = self._read_journal()
+            users.extend(journaled)
+            users = normalize_users(users, self.id_bits)
+            by_id: Dict[str, Dict[str, Any]] = {}
+            by_username: Dict[str, Dict[str, Any]] = {}
+            by_email: Dict[str, Dict[str, Any]] = {}
+            for u in users:
+                if u["id"] in by_id:
+                    raise HTTPException(500, f"duplicate_user_id: {u['id']}")
+                by_id[u["id"]] = u
+                by_username.setdefault(u["username"].lower(), u)
+                by_email.setdefault(u["email"].lower(), u)
+            self._users = users
+            self._by_id, self._by_username, self._by_email = by_id, by_username, by_email
+            self._ids = IdAllocator((int(uid, 2) for uid in by_id), 1 << self.id_bits)
+            if journaled:
+                self._compact()
+            else:
+                self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def _read_journal(self) -> List[Dict[str, Any]]:
+        users: List[Dict[str, Any]] = []
+        try:
+            f = open(self.journal_path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return users
+        with f:
+            for line in f:
+                try:
+                    users.append(json.loads(line))
+                except ValueError:
+                    break  # שורה אחרונה חצויה מקריסה באמצע כתיבה – ההרשמה הזו לא אושרה
+        return users
+
+    def _refresh(self) -> None:
+        # אם הקובץ נערך ידנית מבחוץ – טוענים מחדש (stat אחד לבקשה)
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns != self._mtime_ns:
+            self.load()
+
+    def _append(self, user: Dict[str, Any]) -> None:
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal.write(json.dumps(user, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journaled += 1
+
+    def _compact(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"users": self._users}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        # רק אחרי ש-users.json החדש במקום: קריסה לפני כן משאירה יומן שמוחל שוב (בלי כפילויות)
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._journaled = 0
+
+    def by_id(self, uid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return self._by_id.get(uid)
+
+    def by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return self._by_username.get(username.lower())
+
+    def by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return self._by_email.get(email.lower())
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return list(self._users)
+
+    def create(self, username: str, email: str) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            if username.lower() in self._by_username:
+                raise HTTPException(409, "username_taken")
+            if email.lower() in self._by_email:
+                raise HTTPException(409, "email_taken")
+            n = self._ids.take()
+            if n is None:
+                raise HTTPException(409, f"id_space_exhausted_0_{(1 << self.id_bits) - 1}")
+            user = {"id": format_id(n, self.id_bits), "username": username, "email": email}
+            try:
+                self._append(user)
+            except Exception:
+                self._ids.release(n)
+                raise
+            self._users.append(user)
+            self._by_id[user["id"]] = user
+            self._by_username[username.lower()] = user
+            self._by_email[email.lower()] = user
+            if self._journaled >= self.compact_every:
+                try:
+                    self._compact()
+                except Exception as e:
+                    # ההרשמה כבר ביומן; ננסה לדחוס שוב בהרשמה הבאה
+                    print(f"[AUTH] compact failed: {e!r}")
+            return user
+
+store = UserStore(DATA, DATA.with_suffix(".journal"))
 
 @app.post("/register")
 def register(inp: RegisterIn):
-    db = load_db()
-    users = db.get("users", [])
-    if any(u["username"].lower() == inp.username.lower() for u in users):
-        raise HTTPException(409, "username_taken")
-    if any(u["email"].lower() == inp.email.lower() for u in users):
-        raise HTTPException(409, "email_taken")
-
-    uid = next_free_id(users)
-    user = {"id": uid, "username": inp.username, "email": inp.email}
-    users.append(user)
-    db["users"] = users
-    save_db(db)
+    user = store.create(inp.username, inp.email)
     
     now = int(time.time())
     token = jwt.encode(
@@ -106,31 +270,32 @@ def register(inp: RegisterIn):
 @app.post("/login")
 def login(inp: LoginIn):
     print(f"[AUTH] /login called with: username={inp.username}, email={inp.email}, user_id={inp.user_id}")
-    db = load_db()
-    users = db.get("users", [])
-    print(f"[AUTH] loaded {len(users)} users")
 
     user = None
 
     if inp.user_id is not None:
         print(f"[AUTH] searching by user_id={inp.user_id}")
 
-        if isinstance(inp.user_id, int):
-            wanted = to_bin8(inp.user_id)
-        elif isinstance(inp.user_id, str):
-            wanted = inp.user_id if BIN8_RE.fullmatch(inp.user_id) else to_bin8(int(inp.user_id))
-        else:
-            raise HTTPException(400, "bad_user_id_type")
-        user = next((u for u in users if u["id"] == wanted), None)
+        try:
+            if isinstance(inp.user_id, int):
+                wanted = format_id(inp.user_id)
+            elif isinstance(inp.user_id, str):
+                wanted = inp.user_id if ID_RE.fullmatch(inp.user_id) else format_id(int(inp.user_id))
+            else:
+                raise HTTPException(400, "bad_user_id_type")
+        except ValueError:
+            wanted = None  # מחוץ למרחב המזהים – אין משתמש כזה
+        if wanted is not None:
+            user = store.by_id(wanted)
 
     if not user and inp.username:
         print(f"[AUTH] searching by username={inp.username}")
-        user = next((u for u in users if u["username"].lower() == inp.username.lower()), None)
+        user = store.by_username(inp.username)
 
     if not user and inp.email:
         print(f"[AUTH] searching by email={inp.email}")
 
-        user = next((u for u in users if u["email"].lower() == inp.email.lower()), None)
+        user = store.by_email(inp.email)
 
     if not user:
         print("[AUTH] user not found ❌")
@@ -153,15 +318,7 @@ def health():
 @app.get("/players")
 async def get_players():
     try:
-        if not DATA.exists():
-            print(f"[AUTH] users.json not found at {DATA}")
-            return {"players": []}
-
-        with open(DATA, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        print("in the get players the data is: ", data)
-        return {"players": data.get("users", [])}
+        return {"players": store.all()}
     except Exception as e:
         print(f"[AUTH] Error reading players:", e)
         return {"players": []}
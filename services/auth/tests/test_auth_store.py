@@ -0,0 +1,97 @@
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from services.auth.main import IdAllocator, UserStore
+
+
+def _users_file(tmp_path, ids):
+    path = tmp_path / "users.json"
+    users = [{"id": uid, "username": f"u{i}", "email": f"u{i}@x.io"} for i, uid in enumerate(ids)]
+    path.write_text(json.dumps({"users": users}), encoding="utf-8")
+    return path
+
+
+def test_allocator_fills_gaps_lowest_first():
+    ids = IdAllocator([0, 1, 4, 7], space=16)
+    assert [ids.take() for _ in range(5)] == [2, 3, 5, 6, 8]
+    ids.release(3)
+    assert ids.take() == 3
+    assert ids.free_count() == 16 - 9
+
+
+def test_allocator_memory_does_not_depend_on_id_space():
+    start = time.perf_counter()
+    ids = IdAllocator([5, 1 << 31], space=1 << 32)
+    assert time.perf_counter() - start < 0.1
+    assert ids.take() == 0
+    assert len(ids._gaps) == 2
+
+
+def test_lookups_are_case_insensitive_and_ids_lowest_free(tmp_path):
+    store = UserStore(_users_file(tmp_path, ["00000000", "00000010"]))
+    assert store.by_username("U1")["id"] == "00000010"
+    assert store.by_email("U0@X.IO")["id"] == "00000000"
+    assert store.create("new", "new@x.io")["id"] == "00000001"
+    with pytest.raises(HTTPException) as e:
+        store.create("NEW", "other@x.io")
+    assert e.value.detail == "username_taken"
+
+
+def test_registration_appends_to_journal_and_survives_reload(tmp_path):
+    path = _users_file(tmp_path, ["00000000"])
+    before = path.read_bytes()
+    store = UserStore(path, compact_every=1000)
+    store.create("a", "a@x.io")
+    store.create("b", "b@x.io")
+    # users.json is untouched; the two registrations are two journal lines
+    assert path.read_bytes() == before
+    assert len(store.journal_path.read_text(encoding="utf-8").splitlines()) == 2
+
+    reloaded = UserStore(path)
+    assert reloaded.by_username("b")["id"] == "00000010"
+    # loading folds the journal into users.json
+    assert len(json.loads(path.read_text(encoding="utf-8"))["users"]) == 3
+    assert store.journal_path.read_text(encoding="utf-8") == ""
+
+
+def test_torn_journal_line_is_ignored(tmp_path):
+    path = _users_file(tmp_path, ["00000000"])
+    store = UserStore(path)
+    store.create("a", "a@x.io")
+    with open(store.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"id": "000000')
+    reloaded = UserStore(path)
+    assert [u["username"] for u in reloaded.all()] == ["u0", "a"]
+
+
+def test_compacts_every_n_registrations(tmp_path):
+    path = _users_file(tmp_path, [])
+    store = UserStore(path, compact_every=3)
+    for i in range(3):
+        store.create(f"n{i}", f"n{i}@x.io")
+    assert len(json.loads(path.read_text(encoding="utf-8"))["users"]) == 3
+    assert store.journal_path.read_text(encoding="utf-8") == ""
+
+
+def test_wide_id_space_loads_and_repads_legacy_ids(tmp_path):
+    store = UserStore(_users_file(tmp_path, ["00000011"]), id_bits=32)
+    assert store.by_username("u0")["id"] == f"{3:032b}"
+    assert store.create("a", "a@x.io")["id"] == f"{0:032b}"
+
+
+def test_narrow_id_space_rejects_ids_that_do_not_fit(tmp_path):
+    # 200 does not fit in 4 bits; it must not be masked onto another user's id
+    with pytest.raises(HTTPException) as e:
+        UserStore(_users_file(tmp_path, ["00000001", f"{200:08b}"]), id_bits=4)
+    assert "bad_user_id_format" in e.value.detail
+
+
+def test_exhausted_id_space(tmp_path):
+    store = UserStore(_users_file(tmp_path, ["00", "01", "10"]), id_bits=2)
+    store.create("a", "a@x.io")
+    with pytest.raises(HTTPException) as e:
+        store.create("b", "b@x.io")
+    assert e.value.detail == "id_space_exhausted_0_3"
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+SNAPSHOT_ATTEMPTS = 3  # קידוד שנקטע בגלל שינוי מקביל ב-loop מנוסה שוב עד כמה פעמים
+
+
+def atomic_write_json(path: str, data: dict) -> None:
+    """כתיבה אטומית: קובץ זמני + fsync + os.replace, כך שקריסה לא משאירה קובץ חצוי."""
+    _atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+def _atomic_write_text(path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _cut(data: dict) -> dict:
+    """עותק רדוד עד רמת רשימת ההודעות: הודעות שיתווספו מעכשיו לא ייכנסו אליו."""
+    cut = dict(data)
+    cut["chats"] = [dict(c, messages=list(c.get("messages", []))) for c in data.get("chats", [])]
+    return cut
+
+
+def _messages(data: dict) -> List[dict]:
+    chats = data.setdefault("chats", [{"chat_id": "chat1", "messages": []}])
+    if not chats:
+        chats.append({"chat_id": "chat1", "messages": []})
+    return chats[0].setdefault("messages", [])
+
+
+class _Batch:
+    __slots__ = ("lines", "waiters")
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.waiters: List[asyncio.Future] = []
+
+
+class ChatJournal:
+    """
+    Write-ahead journal ל-chats.json עם group commit.
+
+    כל שינוי נרשם כשורת JSON ({"op": "put", "msg": {...}}) – העתק מלא של ההודעה
+    אחרי השינוי, כך שהפעלה חוזרת של אותה רשומה היא אידמפוטנטית. משימת רקע אוספת
+    את כל הרשומות שהצטברו במשך commit_interval, כותבת אותן ב-write + fsync אחד
+    ומשחררת את כל הממתינים ב-sync(). מדי פעם נכתב snapshot מלא (אטומי) והיומן מתאפס.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str,
+        journal_path: str,
+        data: dict,
+        commit_interval: float = 0.005,
+        snapshot_every: int = 1000,
+        snapshot_interval: float = 300.0,
+    ):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.data = data
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self._pending = _Batch()
+        self._flushing: Optional[_Batch] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._fh = None
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+        self._closing = False
+
+    # ---------- שחזור ----------
+    def replay(self) -> int:
+        """מחיל את היומן על self.data (אחרי טעינת ה-snapshot). מחזיר כמה רשומות הוחלו."""
+        if not os.path.exists(self.journal_path):
+            return 0
+        msgs = _messages(self.data)
+        index: Dict[Any, int] = {m.get("id"): i for i, m in enumerate(msgs)}
+        applied = 0
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # שורה אחרונה חצויה מקריסה באמצע כתיבה – כל מה שלפניה כבר עבר fsync
+                    break
+                if rec.get("op") != "put" or not isinstance(rec.get("msg"), dict):
+                    continue
+                msg = rec["msg"]
+                pos = index.get(msg.get("id"))
+                if pos is None:
+                    index[msg.get("id")] = len(msgs)
+                    msgs.append(msg)
+                else:
+                    msgs[pos] = msg
+                applied += 1
+        return applied
+
+    def compact(self) -> None:
+        """snapshot סינכרוני + איפוס היומן (לשימוש בעלייה, לפני שיש event loop)."""
+        atomic_write_json(self.snapshot_path, self.data)
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+
+    # ---------- כתיבה ----------
+    def record(self, msgs: Iterable[dict]) -> None:
+        """רושם את המצב הנוכחי של ההודעות שהשתנו. העמידות מובטחת רק אחרי await sync()."""
+        for m in msgs:
+            self._pending.lines.append(json.dumps({"op": "put", "msg": m}, ensure_ascii=False))
+        if self._pending.lines:
+            self._ensure_running()
+            if self._wake is not None:
+                self._wake.set()
+
+    async def sync(self) -> None:
+        """ממתין עד שכל מה שנרשם עד עכשיו נכתב ליומן ועבר fsync."""
+        batch = self._pending if self._pending.lines else self._flushing
+        if batch is None:
+            return
+        self._ensure_running()
+        fut = asyncio.get_running_loop().create_future()
+        batch.waiters.append(fut)
+        await fut
+
+    async def close(self) -> None:
+        """מרוקן את מה שממתין, כותב snapshot אחרון ועוצר את משימת הרקע."""
+        # לא מבטלים את המשימה: snapshot שכבר רץ ב-thread ימשיך לכתוב גם אחרי cancel,
+        # ושני כותבים על אותו .tmp ידרסו זה את זה. מבקשים ממנה לסיים וממתינים לה.
+        self._closing = True
+        if self._pending.lines:
+            self._ensure_running()
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self._snapshot()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _ensure_running(self) -> None:
+        if self._task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # אין loop (למשל בזמן import) – הרשומות ימתינו ל-sync הבא
+        self._wake = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            if not self._pending.lines:
+                if self._closing:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            await asyncio.sleep(self.commit_interval)
+            batch, self._pending = self._pending, _Batch()
+            self._flushing = batch
+            try:
+                await asyncio.to_thread(self._append, batch.lines)
+            except Exception as e:
+                print(f"[CHAT] journal commit failed: {e!r}")
+                for w in batch.waiters:
+                    if not w.done():
+                        w.set_exception(e)
+            else:
+                for w in batch.waiters:
+                    if not w.done():
+                        w.set_result(None)
+            finally:
+                self._flushing = None
+            self._since_snapshot += len(batch.lines)
+            if (
+                self._since_snapshot >= self.snapshot_every
+                or time.monotonic() - self._last_snapshot >= self.snapshot_interval
+            ):
+                try:
+                    await self._snapshot()
+                except Exception as e:
+                    print(f"[CHAT] snapshot failed: {e!r}")
+
+    def _append(self, lines: List[str]) -> None:
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self._fh = open(self.journal_path, "a", encoding="utf-8")
+        self._fh.write("\n".join(lines) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    async def _snapshot(self) -> None:
+        # על ה-loop רק נחתך העותק (רשימות בלבד, O(n) מצביעים); הסריאליזציה והכתיבה רצות
+        # ב-thread, כך שזמן הדחיסה לא תלוי בגודל הצ'אט. הודעה שמשתנה בזמן הכתיבה נרשמת
+        # ליומן ונשארת ב-_pending – היא נכתבת רק אחרי האיפוס, כך ששום דבר לא הולך לאיבוד.
+        if self._since_snapshot == 0:
+            return
+        await asyncio.to_thread(self._write_snapshot, _cut(self.data))
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+
+    def _write_snapshot(self, data: dict) -> None:
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            try:
+                text = json.dumps(data, ensure_ascii=False, indent=2)
+                break
+            except RuntimeError:
+                # ה-loop שינה הודעה באמצע הקידוד ("dictionary changed size"); מנסים שוב
+                if attempt == SNAPSHOT_ATTEMPTS - 1:
+                    raise
+        _atomic_write_text(self.snapshot_path, text)
+        if self._fh is None:
+            self._fh = open(self.journal_path, "a", encoding="utf-8")
+        self._fh.truncate(0)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
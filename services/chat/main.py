@@ -2,20 +2,32 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from typing import Dict, Optional, Set, List
+from typing import Dict, Optional, Set, List, Tuple
 from datetime import datetime
 import asyncio
 import json
 import os
+import time
 import httpx
 from services.game.db_history import append_player_action, TOKEN_DM
+from services.chat.journal import ChatJournal, atomic_write_json
 
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://127.0.0.1:7001")
+TYPING_IDLE_SECONDS    = float(os.getenv("CHAT_TYPING_IDLE_SECONDS", "3"))
+TYPING_SWEEP_SECONDS   = float(os.getenv("CHAT_TYPING_SWEEP_SECONDS", "0.25"))
+PRESENCE_FLUSH_SECONDS = float(os.getenv("CHAT_PRESENCE_FLUSH_SECONDS", "1"))
+SEND_TIMEOUT_SECONDS   = float(os.getenv("CHAT_SEND_TIMEOUT_SECONDS", "5"))
+OUTBOX_MAX             = int(os.getenv("CHAT_OUTBOX_MAX", "256"))
+COMMIT_INTERVAL_MS     = float(os.getenv("CHAT_COMMIT_INTERVAL_MS", "5"))
+SNAPSHOT_EVERY         = int(os.getenv("CHAT_SNAPSHOT_EVERY", "1000"))
+SNAPSHOT_SECONDS       = float(os.getenv("CHAT_SNAPSHOT_SECONDS", "300"))
 
 # ---------- נתיבי קבצים (מוחלטים) ----------
 BASE_DIR     = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR     = os.path.join(BASE_DIR, "data")
+# CHAT_DATA_DIR מעביר את chats.json והיומן לתיקייה אחרת (בדיקות ו-benchmarks)
+DATA_DIR     = os.getenv("CHAT_DATA_DIR") or os.path.join(BASE_DIR, "data")
 CHATS_PATH   = os.path.join(DATA_DIR, "chats.json")
+JOURNAL_PATH = os.path.join(DATA_DIR, "chats.journal")
 
 
 # os.makedirs(DATA_DIR, exist_ok=True)
@@ -31,9 +43,7 @@ def load_json(path: str) -> dict:
         return json.load(f)
 
 def save_json(path: str, data: dict) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    atomic_write_json(path, data)
 
 # ---------- שליפת טוקן מהבקשה ----------
 # def get_token_from_ws(ws: WebSocket) -> Optional[str]:
@@ -47,6 +57,15 @@ def save_json(path: str, data: dict) -> None:
 # players_data = load_json(PLAYERS_PATH)
 DEFAULT_CHATS = {"chats": [{"chat_id": "chat1", "messages": []}]}
 chats_data = load_json(CHATS_PATH) or DEFAULT_CHATS
+# כל שינוי נרשם ביומן ומאושר אחרי fsync קבוצתי; chats.json הוא snapshot תקופתי
+chat_journal = ChatJournal(
+    CHATS_PATH, JOURNAL_PATH, chats_data,
+    commit_interval=COMMIT_INTERVAL_MS / 1000.0,
+    snapshot_every=SNAPSHOT_EVERY,
+    snapshot_interval=SNAPSHOT_SECONDS,
+)
+if chat_journal.replay():
+    chat_journal.compact()
 # tokens_data = load_json(TOKENS_PATH)
 
 # ---------- עזר מזהה ----------
@@ -120,6 +139,21 @@ _retrofit_messages()
 # ---------- מצבי ריצה ----------
 active_players: Dict[str, Set[WebSocket]] = {}   # לכל שחקן: סט WebSockets (כמה טאבים)
 selected_partner: Dict[str, Optional[str]] = {}  # מי הנמען שנבחר בכל רגע
+typing_until: Dict[Tuple[str, str], float] = {}  # (מקליד, נמען) -> מועד סיום רצף ההקלדה הנוכחי
+presence_dirty: Dict[str, bool] = {}             # שחקנים שמצב החיבור שלהם השתנה מאז השידור האחרון -> המצב ששודר
+outboxes: Dict[WebSocket, "Outbox"] = {}         # תור יציאה לכל טאב
+
+def _index_peers(messages: List[dict]) -> Dict[str, Set[str]]:
+    """לכל שחקן: עם מי הוא התכתב אי פעם (רשימת השיחות שלו) – רק להם משודרת הנוכחות שלו."""
+    peers: Dict[str, Set[str]] = {}
+    for m in messages:
+        fr, to = m.get("from"), m.get("to")
+        if fr and to and fr != to:
+            peers.setdefault(fr, set()).add(to)
+            peers.setdefault(to, set()).add(fr)
+    return peers
+
+conversation_peers: Dict[str, Set[str]] = _index_peers(chats_data.get("chats", [{}])[0].get("messages", []))
 
 # ---------- אפליקציה ----------
 app = FastAPI()
@@ -160,7 +194,10 @@ def append_message(fr: str, to: str, text: str, ts: Optional[str] = None, quoted
         "deleted": False,
     }
     chats_data["chats"][0]["messages"].append(msg)
-    save_json(CHATS_PATH, chats_data)
+    chat_journal.record([msg])
+    if fr and to and fr != to:
+        conversation_peers.setdefault(fr, set()).add(to)
+        conversation_peers.setdefault(to, set()).add(fr)
     return msg
 
 def _minimal_view(m: dict, viewer: Optional[str] = None) -> dict:
@@ -211,20 +248,128 @@ def unread_count_for(me: str, from_id: str) -> int:
 
 def mark_read_pair(me: str, with_id: str) -> int:
     msgs = chats_data.get("chats", [{}])[0].get("messages", [])
-    updated = 0
+    updated: List[dict] = []
     for m in msgs:
         if m.get("from") == with_id and m.get("to") == me:
             rb = m.setdefault("read_by", [])
             if me not in rb:
                 rb.append(me)
-                updated += 1
+                updated.append(m)
     if updated:
-        save_json(CHATS_PATH, chats_data)
-    return updated
+        chat_journal.record(updated)
+    return len(updated)
+
+# ---------- שליחה לטאבים ----------
+class Outbox:
+    """תור יציאה לטאב בודד: כל טאב נכתב במשימה משלו, כך שטאב איטי/סגור לא מעכב אף אחד אחר."""
+
+    def __init__(self, player_id: str, ws: WebSocket):
+        self.player_id = player_id
+        self.ws = ws
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_MAX)
+        self.task = asyncio.create_task(self._pump())
+
+    def offer(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _pump(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.ws.send_text(text), SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[CHAT] dropping dead socket of {self.player_id}: {e!r}")
+            drop_socket(self.player_id, self.ws)
+
+async def _close_quietly(ws: WebSocket):
+    try:
+        await ws.close()
+    except Exception:
+        pass
+
+def drop_socket(player_id: str, ws: WebSocket) -> None:
+    """מסיר טאב מ-active_players ומשחרר את התור שלו (בטוח לקריאה חוזרת)."""
+    bucket = active_players.get(player_id)
+    if bucket and ws in bucket:
+        bucket.discard(ws)
+        if not bucket:
+            active_players.pop(player_id, None)
+            note_presence(player_id, was_online=True)
+            # הטאב האחרון נעלם – ה-"stop" נשלח עכשיו ולא מחכה ל-sweeper
+            for sender, partner in [k for k in typing_until if k[0] == player_id]:
+                asyncio.ensure_future(stop_typing(sender, partner))
+    box = outboxes.pop(ws, None)
+    if box is not None:
+        if box.task is not asyncio.current_task():
+            box.task.cancel()
+        asyncio.ensure_future(_close_quietly(ws))
+
+def _offer(player_id: str, ws: WebSocket, text: str) -> None:
+    box = outboxes.get(ws)
+    if box is None or not box.offer(text):
+        # אין תור או שהתור מלא – הטאב לא עומד בקצב, מנתקים אותו
+        drop_socket(player_id, ws)
+
+async def _send(ws: WebSocket, payload: dict):
+    """שליחה לטאב אחד דרך התור שלו, כדי לשמור על סדר מול הודעות ה-fan-out."""
+    box = outboxes.get(ws)
+    if box is not None:
+        _offer(box.player_id, ws, json.dumps(payload))
 
 async def _send_to_all(player_id: str, payload: dict):
+    text = json.dumps(payload)
     for s in list(active_players.get(player_id, set())):
-        await s.send_text(json.dumps(payload))
+        _offer(player_id, s, text)
+
+# ---------- הקלדה ונוכחות ----------
+async def note_typing(player_id: str, partner: str) -> None:
+    """רק הפריים הראשון ברצף נשלח לנמען; השאר רק מאריכים את מועד הסיום."""
+    key = (player_id, partner)
+    started = key not in typing_until
+    typing_until[key] = time.monotonic() + TYPING_IDLE_SECONDS
+    if started:
+        await _send_to_all(partner, {"type": "typing", "typing": [player_id], "state": "start", "from": player_id})
+
+async def stop_typing(player_id: str, partner: Optional[str]) -> None:
+    if partner and typing_until.pop((player_id, partner), None) is not None:
+        await _send_to_all(partner, {"type": "typing", "typing": [], "state": "stop", "from": player_id})
+
+def note_presence(player_id: str, was_online: bool) -> None:
+    # שומרים את המצב שלפני השינוי הראשון – התנתקות וחזרה בתוך אותו חלון מתבטלות
+    presence_dirty.setdefault(player_id, was_online)
+
+async def flush_presence() -> None:
+    """
+    משדר diff אחד של מי התחבר/התנתק מאז השידור הקודם, ולכל מחובר רק את מי שמעניין
+    אותו: בן השיחה שבחר ומי שברשימת השיחות שלו (conversation_peers).
+    """
+    if not presence_dirty:
+        return
+    changed: Dict[str, bool] = {}
+    for pid, was_online in presence_dirty.items():
+        is_online = bool(active_players.get(pid))
+        if is_online != was_online:
+            changed[pid] = is_online
+    presence_dirty.clear()
+    if not changed:
+        return
+    for watcher in list(active_players):
+        peers = conversation_peers.get(watcher, set())
+        partner = selected_partner.get(watcher)
+        seen = [pid for pid in changed if pid != watcher and (pid in peers or pid == partner)]
+        if not seen:
+            continue
+        await _send_to_all(watcher, {
+            "type": "presence",
+            "online": sorted(pid for pid in seen if changed[pid]),
+            "offline": sorted(pid for pid in seen if not changed[pid]),
+        })
 
 # ---------- NEW: מחיקה רכה ----------
 def soft_delete_message_by_id(message_id: str, requester_id: str) -> Optional[dict]:
@@ -242,7 +387,7 @@ def soft_delete_message_by_id(message_id: str, requester_id: str) -> Optional[di
                 m["deleted"] = True
                 m["message"] = ""  # לא שומרים תוכן אחרי מחיקה רכה
                 m["updated_at"] = datetime.utcnow().isoformat() + "Z"
-                save_json(CHATS_PATH, chats_data)
+                chat_journal.record([m])
             return m
     return None
 
@@ -321,7 +466,10 @@ async def chat_endpoint(websocket: WebSocket):
     except Exception:
         await websocket.close(code=4401)
         return 
+    if not active_players.get(player_id):
+        note_presence(player_id, was_online=False)
     active_players.setdefault(player_id, set()).add(websocket)
+    outboxes[websocket] = Outbox(player_id, websocket)
     selected_partner[player_id] = None
     print(f"[WS] {player_id} connected")
     try:
@@ -331,18 +479,21 @@ async def chat_endpoint(websocket: WebSocket):
             typ = (data.get("type") or "").lower()
             # בחירת בן-שיחה -> נחזיר היסטוריה + נאפס unread מולו
             if typ == "select":
+                if selected_partner.get(player_id) != data.get("selectedPlayer"):
+                    await stop_typing(player_id, selected_partner.get(player_id))
                 selected_partner[player_id] = data.get("selectedPlayer")
                 partner = selected_partner[player_id]
                 if partner:
                     msgs = history_between(player_id, partner, viewer=player_id)
-                    await websocket.send_text(json.dumps({
+                    await _send(websocket, {
                         "type": "history",
                         "with": partner,
                         "messages": msgs
-                    }))
+                    })
                     # אחרי הצגת היסטוריה – נסמן כנקראו
                     changed = mark_read_pair(player_id, partner)
                     if changed:
+                        await chat_journal.sync()
                         count_now = unread_count_for(player_id, partner)
                         await _send_to_all(player_id, {
                             "type": "unread", "from": partner, "to": player_id, "count": count_now
@@ -354,17 +505,18 @@ async def chat_endpoint(websocket: WebSocket):
                 partner = data.get("with")
                 if partner:
                     mark_read_pair(player_id, partner)
+                    await chat_journal.sync()
                     count_now = unread_count_for(player_id, partner)
                     await _send_to_all(player_id, {
                         "type": "unread", "from": partner, "to": player_id, "count": count_now
                     })
                 continue
 
-            # אינדיקציית הקלדה
+            # אינדיקציית הקלדה – תחילת רצף נשלחת מיד, הסיום נשלח ע"י typing_sweeper
             if typ == "typing":
                 partner = selected_partner[player_id]
                 if partner:
-                    await _send_to_all(partner, {"type": "typing", "typing": [player_id]})
+                    await note_typing(player_id, partner)
                 continue
 
             # תגובה פרטית (ACK רק למגיב)
@@ -373,17 +525,17 @@ async def chat_endpoint(websocket: WebSocket):
                 msg_id = data.get("messageId")
                 reaction = data.get("reaction")  # "up" | "down" | None
                 if not msg_id:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "missing messageId"}))
+                    await _send(websocket, {"type": "error", "message": "missing messageId"})
                     continue
 
                 msg_obj = get_message_by_id(msg_id)
                 if not msg_obj:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "message not found"}))
+                    await _send(websocket, {"type": "error", "message": "message not found"})
                     continue
 
                 # לא מגיבים להודעה שלי
                 if msg_obj.get("from") == player_id:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "cannot react to own message"}))
+                    await _send(websocket, {"type": "error", "message": "cannot react to own message"})
                     continue
 
                 msg_obj.setdefault("reactions", {})
@@ -393,14 +545,15 @@ async def chat_endpoint(websocket: WebSocket):
                     # ביטול
                     msg_obj["reactions"].pop(player_id, None)
 
-                save_json(CHATS_PATH, chats_data)
+                chat_journal.record([msg_obj])
+                await chat_journal.sync()
 
                 # ACK פרטי – כולל my_reaction
-                await websocket.send_text(json.dumps({
+                await _send(websocket, {
                     "type": "react",
                     "messageId": msg_id,
                     "my_reaction": reaction
-                }))
+                })
                 continue
 
             # שליחת הודעה (עם quotedId אופציונלי)
@@ -409,10 +562,11 @@ async def chat_endpoint(websocket: WebSocket):
                 partner = data.get("selectedPlayer") or selected_partner.get(player_id)
                 quoted_id = data.get("quotedId") or data.get("quoted_id")
                 if not partner:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "No partner selected"}))
+                    await _send(websocket, {"type": "error", "message": "No partner selected"})
                     continue
 
                 saved = append_message(player_id, partner, text, data.get("timestamp"), quoted_id=quoted_id)
+                await chat_journal.sync()
 
 
                 chunk_id = data.get("chunkId")  # ← מגיע מהקליינט בצ'אט הפרטי
@@ -435,17 +589,18 @@ async def chat_endpoint(websocket: WebSocket):
                 })
 
                 # שידור לכל הטאבים של השולח והנמען
+                await stop_typing(player_id, partner)
                 await _send_to_all(player_id, msg_payload)
                 await _send_to_all(partner,   msg_payload)
 
                 # אישור ספציפי לשולח (לא חובה)
-                await websocket.send_text(json.dumps({
+                await _send(websocket, {
                     "type": "sent",
                     "to": partner,
                     "id": saved["id"],
                     "message": text,
                     "timestamp": saved["timestamp"]
-                }))
+                })
 
                 # עדכון מונה לנמען
                 new_count = unread_count_for(partner, player_id)
@@ -457,12 +612,13 @@ async def chat_endpoint(websocket: WebSocket):
                 # payload: { type: "delete", messageId: "<id>" }
                 msg_id = data.get("messageId") or data.get("message_id")
                 if not msg_id:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "missing messageId"}))
+                    await _send(websocket, {"type": "error", "message": "missing messageId"})
                     continue
 
                 updated = soft_delete_message_by_id(msg_id, requester_id=player_id)
+                await chat_journal.sync()
                 if not updated:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "delete_not_allowed_or_not_found", "messageId": msg_id}))
+                    await _send(websocket, {"type": "error", "message": "delete_not_allowed_or_not_found", "messageId": msg_id})
                     continue
 
                 # שידור עדכון לשני הצדדים
@@ -485,18 +641,14 @@ async def chat_endpoint(websocket: WebSocket):
                 continue
 
             # לא מזוהה
-            await websocket.send_text(json.dumps({"type": "error", "message": f"unknown type: {typ}"}))
+            await _send(websocket, {"type": "error", "message": f"unknown type: {typ}"})
 
     except WebSocketDisconnect:
         pass
     finally:
         # ניקוי חיבורים
         try:
-            bucket = active_players.get(player_id)
-            if bucket:
-                bucket.discard(websocket)
-                if not bucket:
-                    active_players.pop(player_id, None)
+            drop_socket(player_id, websocket)
         except Exception:
             pass
 
@@ -510,6 +662,30 @@ async def heartbeat():
         if active_players:
             print("[HEARTBEAT] active:", list(active_players.keys()))
 
+async def typing_sweeper():
+    while True:
+        await asyncio.sleep(TYPING_SWEEP_SECONDS)
+        now = time.monotonic()
+        for sender, partner in [k for k, t in typing_until.items() if t <= now]:
+            try:
+                await stop_typing(sender, partner)
+            except Exception as e:
+                print(f"[CHAT] typing stop failed for {sender}->{partner}: {e}")
+
+async def presence_flusher():
+    while True:
+        await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+        try:
+            await flush_presence()
+        except Exception as e:
+            print(f"[CHAT] presence flush failed: {e}")
+
 @app.on_event("startup")
 async def on_startup():
     asyncio.create_task(heartbeat())
+    asyncio.create_task(typing_sweeper())
+    asyncio.create_task(presence_flusher())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await chat_journal.close()
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import pytest
+
+# chats.json and the journal of the imported module go to a scratch dir, never to services/chat/data
+os.environ.setdefault("CHAT_DATA_DIR", tempfile.mkdtemp(prefix="chat-test-"))
+
+from services.chat import main as cm  # noqa: E402
+
+pytest_plugins = "pytest_asyncio"
+
+
+class Socket:
+    def __init__(self, hang: bool = False, fail: bool = False):
+        self.sent = []
+        self.hang = hang
+        self.fail = fail
+        self.closed = False
+
+    async def send_text(self, text: str):
+        if self.fail:
+            raise ConnectionError("gone")
+        if self.hang:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    for name in ("active_players", "selected_partner", "typing_until", "presence_dirty", "outboxes",
+                 "conversation_peers"):
+        monkeypatch.setattr(cm, name, {})
+    yield
+    for box in list(cm.outboxes.values()):
+        box.task.cancel()
+
+
+def connect(player_id: str, ws: Socket) -> Socket:
+    cm.active_players.setdefault(player_id, set()).add(ws)
+    cm.outboxes[ws] = cm.Outbox(player_id, ws)
+    return ws
+
+
+async def settle():
+    await asyncio.sleep(0.02)
+
+
+@pytest.mark.asyncio
+async def test_stalled_socket_times_out_and_is_dropped(monkeypatch):
+    monkeypatch.setattr(cm, "SEND_TIMEOUT_SECONDS", 0.05)
+    stalled = connect("a", Socket(hang=True))
+    other = connect("a", Socket())
+
+    await cm._send_to_all("a", {"type": "x"})
+    await asyncio.sleep(0.1)
+
+    assert stalled not in cm.outboxes and stalled.closed
+    assert cm.active_players["a"] == {other}  # the other tab is untouched
+    assert other.sent == [{"type": "x"}]
+
+
+@pytest.mark.asyncio
+async def test_full_outbox_drops_the_tab(monkeypatch):
+    monkeypatch.setattr(cm, "OUTBOX_MAX", 2)
+    slow = connect("a", Socket(hang=True))
+    for i in range(4):
+        await cm._send_to_all("a", {"type": "x", "i": i})
+    await settle()
+
+    assert slow not in cm.outboxes and slow.closed
+    assert "a" not in cm.active_players
+    assert cm.presence_dirty == {"a": True}
+
+
+@pytest.mark.asyncio
+async def test_typing_frames_are_debounced_to_start_and_stop():
+    peer = connect("b", Socket())
+    for _ in range(5):
+        await cm.note_typing("a", "b")
+    await cm.stop_typing("a", "b")
+    await cm.stop_typing("a", "b")  # the sweeper and a disconnect may both try
+    await settle()
+
+    assert [m["state"] for m in peer.sent] == ["start", "stop"]
+    assert not cm.typing_until
+
+
+@pytest.mark.asyncio
+async def test_losing_the_last_tab_stops_typing_at_once():
+    peer = connect("b", Socket())
+    dead = connect("a", Socket(fail=True))
+    await cm.note_typing("a", "b")
+
+    await cm._send_to_all("a", {"type": "x"})  # the pump finds the socket dead
+    await settle()
+
+    assert dead not in cm.outboxes
+    assert [m["state"] for m in peer.sent] == ["start", "stop"]
+    assert not cm.typing_until
+
+
+@pytest.mark.asyncio
+async def test_presence_changes_go_out_as_one_diff_to_interested_peers():
+    cm.conversation_peers.update(cm._index_peers([
+        {"from": "w", "to": "a"}, {"from": "c", "to": "w"}, {"from": "d", "to": "w"},
+    ]))
+    watcher = connect("w", Socket())
+    stranger = connect("s", Socket())
+    picker = connect("p", Socket())
+    cm.selected_partner["p"] = "c"  # never wrote to c, but has the conversation open
+    cm.presence_dirty.clear()
+    connect("a", Socket())
+    cm.note_presence("a", was_online=False)
+    gone = connect("c", Socket())
+    cm.note_presence("c", was_online=False)
+    await cm.flush_presence()
+    await settle()
+    assert watcher.sent == [{"type": "presence", "online": ["a", "c"], "offline": []}]
+    watcher.sent.clear()
+
+    # c leaves; d comes and goes within the window, so nobody hears about d
+    cm.drop_socket("c", gone)
+    flicker = connect("d", Socket())
+    cm.note_presence("d", was_online=False)
+    cm.drop_socket("d", flicker)
+    await cm.flush_presence()
+    await settle()
+
+    assert watcher.sent == [{"type": "presence", "online": [], "offline": ["c"]}]
+    assert picker.sent == [{"type": "presence", "online": ["c"], "offline": []},
+                           {"type": "presence", "online": [], "offline": ["c"]}]
+    assert stranger.sent == []
+    await cm.flush_presence()
+    await settle()
+    assert len(watcher.sent) == 1  # nothing changed since
+
+
+def test_a_new_message_adds_both_sides_to_each_others_conversations(monkeypatch):
+    monkeypatch.setattr(cm, "chats_data", {"chats": [{"chat_id": "chat1", "messages": []}]})
+    monkeypatch.setattr(cm.chat_journal, "record", lambda msgs: None)
+    cm.append_message("a", "b", "hi")
+    assert cm.conversation_peers == {"a": {"b"}, "b": {"a"}}
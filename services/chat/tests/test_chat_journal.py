@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from services.chat.journal import ChatJournal, atomic_write_json
+
+pytest_plugins = "pytest_asyncio"
+
+
+def _msg(i, **extra):
+    return {"id": f"m{i}", "from": "a", "to": "b", "message": f"hi {i}", **extra}
+
+
+def _journal(tmp_path, data=None, **kw):
+    data = data if data is not None else {"chats": [{"chat_id": "chat1", "messages": []}]}
+    return ChatJournal(str(tmp_path / "chats.json"), str(tmp_path / "chats.journal"), data, **kw)
+
+
+def _on_disk(tmp_path):
+    """What a restart would see: the snapshot with the journal replayed over it."""
+    with open(tmp_path / "chats.json", encoding="utf-8") as f:
+        data = json.load(f)
+    _journal(tmp_path, data).replay()
+    return data["chats"][0]["messages"]
+
+
+def test_replay_applies_puts_over_the_snapshot(tmp_path):
+    atomic_write_json(str(tmp_path / "chats.json"), {"chats": [{"chat_id": "chat1", "messages": [_msg(1)]}]})
+    with open(tmp_path / "chats.journal", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "put", "msg": _msg(1, read_by=["b"])}) + "\n")
+        f.write(json.dumps({"op": "put", "msg": _msg(2)}) + "\n")
+    messages = _on_disk(tmp_path)
+    assert [m["id"] for m in messages] == ["m1", "m2"]
+    assert messages[0]["read_by"] == ["b"]
+
+
+def test_replay_stops_at_a_torn_last_line(tmp_path):
+    with open(tmp_path / "chats.journal", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "put", "msg": _msg(1)}) + "\n")
+        f.write('{"op": "put", "msg": {"id": "m2", "fr')
+    journal = _journal(tmp_path)
+    assert journal.replay() == 1
+    assert [m["id"] for m in journal.data["chats"][0]["messages"]] == ["m1"]
+
+
+@pytest.mark.asyncio
+async def test_records_in_one_window_share_one_write_and_fsync(tmp_path):
+    journal = _journal(tmp_path, commit_interval=0.02)
+    appends = []
+    real_append = journal._append
+    journal._append = lambda lines: (appends.append(len(lines)), real_append(lines))
+
+    async def writer(i):
+        journal.record([_msg(i)])
+        await journal.sync()
+
+    await asyncio.gather(*(writer(i) for i in range(20)))
+    assert appends == [20]
+    with open(tmp_path / "chats.journal", encoding="utf-8") as f:
+        assert len(f.readlines()) == 20
+    await journal.close()
+
+
+@pytest.mark.asyncio
+async def test_snapshot_runs_off_the_loop_and_close_waits_for_it(tmp_path):
+    data = {"chats": [{"chat_id": "chat1", "messages": [_msg(i) for i in range(100)]}]}
+    journal = _journal(tmp_path, data, commit_interval=0, snapshot_every=1)
+    writers, overlaps, loop_thread = [], [], threading.get_ident()
+    real_write = journal._write_snapshot
+
+    def slow_write(cut):
+        assert threading.get_ident() != loop_thread
+        writers.append(1)
+        overlaps.append(len(writers))
+        time.sleep(0.1)
+        real_write(cut)
+        writers.pop()
+    journal._write_snapshot = slow_write
+
+    msgs = data["chats"][0]["messages"]
+    msgs.append(_msg(100))
+    journal.record([msgs[-1]])
+    await journal.sync()
+    await asyncio.sleep(0.02)  # the snapshot is now being written in its thread
+    msgs.append(_msg(101))  # after the cut: must reach disk through the journal
+    journal.record([msgs[-1]])
+    await journal.close()
+
+    assert max(overlaps) == 1
+    assert [m["id"] for m in _on_disk(tmp_path)] == [f"m{i}" for i in range(102)]
@@ -0,0 +1,136 @@
+"""
+Admission queue in front of ``Hub.connect_batch``.
+
+Sockets are accepted straight away and queued here. A single worker drains the queue
+in batches: it waits ``window`` seconds for a burst to gather, takes up to ``batch``
+sockets (fewer when the ``rate`` budget of connects per second is spent) and places
+them with one hub lock hold, one save and one broadcast per chunk. Sockets still
+waiting are told their place in line (``{"type": "queue", "position": n, "waiting": m}``)
+at most every ``feedback_interval`` seconds.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, List, Optional
+
+from fastapi import WebSocket
+
+from .hub import Connecting, ResumeRequest
+from .sharding import HandoffTicket
+from .tokens import Claims
+from .metrics import ADMISSION_WAIT_SECONDS, ADMISSION_BATCH_SIZE
+
+LOGGER = logging.getLogger("voxel-admission")
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+ConnectBatch = Callable[[List[Connecting]], Awaitable[List[Optional[Exception]]]]
+
+
+@dataclass
+class _Waiting:
+    entry: Connecting
+    done: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class AdmissionController:
+    def __init__(self, connect_batch: ConnectBatch, rate: float = 200.0, batch: int = 50,
+                 window: float = 0.02, feedback_interval: float = 0.5) -> None:
+        self._connect_batch = connect_batch
+        self.rate = rate  # connects per second; <= 0 means unlimited
+        self.batch = max(1, batch)
+        self.window = window
+        self.feedback_interval = feedback_interval
+        self._waiting: Deque[_Waiting] = deque()
+        self._ready = asyncio.Event()
+        self._tokens = float(self.batch)
+        self._refilled_at = time.monotonic()
+        self._fed_back_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._waiting:
+            self._waiting.popleft().done.cancel()
+
+    async def admit(self, ws: WebSocket, claims: Optional[Claims] = None, handoff: Optional[HandoffTicket] = None,
+                    resume: Optional[ResumeRequest] = None) -> None:
+        """Returns once the hub has placed ``ws``; raises whatever kept it out."""
+        waiting = _Waiting((ws, claims, handoff, resume), asyncio.get_running_loop().create_future())
+        self._waiting.append(waiting)
+        self._ready.set()
+        if len(self._waiting) > self.batch:
+            await self._send_position(ws, len(self._waiting))
+        await waiting.done
+
+    async def _run(self) -> None:
+        while True:
+            if not self._waiting:
+                self._ready.clear()
+                await self._ready.wait()
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            n = min(len(self._waiting), self.batch, self._available_tokens())
+            if n == 0:
+                await asyncio.sleep(1 / self.rate)
+                continue
+            # only what this batch uses: a lone connect must not drain the burst budget
+            if self.rate > 0:
+                self._tokens -= n
+            taken = [self._waiting.popleft() for _ in range(n)]
+            ADMISSION_BATCH_SIZE.observe(n)
+            now = time.monotonic()
+            for w in taken:
+                ADMISSION_WAIT_SECONDS.observe(now - w.queued_at)
+            try:
+                errors = await self._connect_batch([w.entry for w in taken])
+            except Exception as e:
+                LOGGER.exception("connect batch failed: %r", e)
+                errors = [e] * len(taken)
+            for w, error in zip(taken, errors):
+                if w.done.done():
+                    continue
+                if error is None:
+                    w.done.set_result(None)
+                else:
+                    w.done.set_exception(error)
+            await self._feed_back()
+
+    def _available_tokens(self) -> int:
+        if self.rate <= 0:
+            return self.batch
+        now = time.monotonic()
+        self._tokens = min(float(self.batch), self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        return int(self._tokens)
+
+    async def _feed_back(self) -> None:
+        now = time.monotonic()
+        if not self._waiting or now - self._fed_back_at < self.feedback_interval:
+            return
+        self._fed_back_at = now
+        for position, w in enumerate(list(self._waiting), start=1):
+            await self._send_position(w.entry[0], position)
+
+    async def _send_position(self, ws: WebSocket, position: int) -> None:
+        try:
+            await ws.send_text(json.dumps({"type": "queue", "position": position, "waiting": len(self._waiting)}))
+        except Exception as e:
+            LOGGER.debug("send queue position failed: %r", e)
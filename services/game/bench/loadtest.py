@@ -0,0 +1,335 @@
+"""
+Load test for the game WebSocket endpoint::
+
+    python -m services.game.bench.loadtest --players 1000 --duration 30 --out bench.json
+    python -m services.game.bench.loadtest --url ws://127.0.0.1:7002 --players 200
+    python -m services.game.bench.loadtest --replay data/history.json --speed 60
+    python -m services.game.bench.loadtest --players 500 --baseline bench.json
+
+Without --url a server is started on a free loopback port with GAME_DATA_DIR pointing at
+a scratch directory, so the real world/players/history files are never touched. Every
+synthetic player signs its own token with AUTH_JWT_SECRET and either random-walks at
+--rate moves/sec or replays one recorded history.json action stream.
+
+"latency" is the time from sending a move to the next matrix frame that player
+receives. Frames caused by other players in the same chunk can end a sample early, so
+read it as a lower bound on broadcast delay.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import websockets
+from jose import jwt
+
+from ..db_history import (
+    TOKEN_RIGHT, TOKEN_LEFT, TOKEN_UP, TOKEN_DOWN, TOKEN_COLOR,
+    TOKEN_SLEEP_1S, TOKEN_SLEEP_1M, TOKEN_SLEEP_1H,
+)
+
+REPO_ROOT = Path(__file__).resolve().parents[3]
+MOVE_KEYS = ("up", "down", "left", "right")
+TOKEN_KEYS = {TOKEN_RIGHT: "right", TOKEN_LEFT: "left", TOKEN_UP: "up", TOKEN_DOWN: "down", TOKEN_COLOR: "c"}
+SLEEP_SECONDS = {TOKEN_SLEEP_1S: 1.0, TOKEN_SLEEP_1M: 60.0, TOKEN_SLEEP_1H: 3600.0}
+
+# one scripted step: wait this many seconds, then send this key
+Step = Tuple[float, str]
+
+
+@dataclass
+class Stats:
+    connected: int = 0
+    connect_errors: int = 0
+    moves_sent: int = 0
+    frames: int = 0
+    bytes_received: int = 0
+    disconnects: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+
+def percentiles(samples: Sequence[float], ps: Sequence[int] = (50, 90, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles in milliseconds, plus max and count."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    out: Dict[str, float] = {"count": len(ordered)}
+    for p in ps:
+        rank = max(0, min(len(ordered) - 1, -(-p * len(ordered) // 100) - 1))
+        out[f"p{p}"] = round(ordered[rank] * 1000, 3)
+    out["max"] = round(ordered[-1] * 1000, 3)
+    return out
+
+
+def replay_scripts(history: dict, max_gap: float, speed: float) -> List[List[Step]]:
+    """One script per recorded player: every chunk stream in order, sleep tokens folded into the delays."""
+    scripts: List[List[Step]] = []
+    for pdata in history.values():
+        script: List[Step] = []
+        wait = 0.0
+        for cdata in (pdata.get("chunks") or {}).values():
+            for token in cdata.get("actions") or []:
+                if token in SLEEP_SECONDS:
+                    wait += SLEEP_SECONDS[token]
+                elif token in TOKEN_KEYS:
+                    script.append((min(wait / speed, max_gap), TOKEN_KEYS[token]))
+                    wait = 0.0
+        if script:
+            scripts.append(script)
+    return scripts
+
+
+def random_walk(rng: random.Random, rate: float) -> Iterator[Step]:
+    while True:
+        yield rng.expovariate(rate), rng.choice(MOVE_KEYS)
+
+
+async def run_player(url: str, token: str, script: Iterator[Step], stats: Stats, deadline: float,
+                     view_radius: int) -> None:
+    try:
+        ws = await websockets.connect(f"{url}/ws?token={token}", max_size=None, open_timeout=60)
+    except Exception:
+        stats.connect_errors += 1
+        return
+    stats.connected += 1
+    pending: Deque[float] = deque()
+
+    async def reader() -> None:
+        async for frame in ws:
+            now = time.perf_counter()
+            stats.frames += 1
+            stats.bytes_received += len(frame)
+            if pending and frame.startswith('{"type": "matrix"'):
+                stats.latencies.append(now - pending.popleft())
+
+    read_task = asyncio.create_task(reader())
+    try:
+        if view_radius:
+            await ws.send(json.dumps({"k": "view", "radius": view_radius}))
+        loop = asyncio.get_running_loop()
+        for delay, key in script:
+            if loop.time() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+            if read_task.done():
+                break
+            if key in MOVE_KEYS:
+                pending.append(time.perf_counter())
+                stats.moves_sent += 1
+            await ws.send(json.dumps({"k": key}))
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        if read_task.done():
+            stats.disconnects += 1
+        await ws.close()
+        read_task.cancel()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _spawn_server(port: int, data_dir: str) -> subprocess.Popen:
+    env = dict(os.environ, GAME_DATA_DIR=data_dir, PYTHONPATH=str(REPO_ROOT))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "services.game.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=data_dir, env=env,
+    )
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError("game server exited during startup")
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("game server did not come up")
+
+
+def scrape(http_url: str) -> Dict[str, float]:
+    """Unlabelled samples from /metrics; empty when the server does not expose it."""
+    try:
+        text = urllib.request.urlopen(f"{http_url}/metrics", timeout=5).read().decode()
+    except OSError:
+        return {}
+    samples: Dict[str, float] = {}
+    for line in text.splitlines():
+        if line.startswith("#") or "{" in line:
+            continue
+        name, _, value = line.partition(" ")
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            pass
+    return samples
+
+
+def process_usage(pid: Optional[int]) -> Dict[str, float]:
+    """CPU seconds and memory of ``pid`` from /proc (Linux), or of this process via getrusage."""
+    if pid is None:
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        return {"cpu_seconds": round(ru.ru_utime + ru.ru_stime, 3), "max_rss_mb": round(ru.ru_maxrss / 1024, 1)}
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        usage = {"cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks}
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key = "rss_mb" if line.startswith("VmRSS") else "max_rss_mb"
+                usage[key] = round(int(line.split()[1]) / 1024, 1)
+        return usage
+    except (OSError, IndexError, ValueError):
+        return {}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Human-readable regressions of ``result`` against ``baseline`` beyond ``tolerance`` (0.1 = 10%)."""
+    problems = []
+    base, now = baseline.get("moves_per_sec") or 0, result.get("moves_per_sec") or 0
+    if base and now < base * (1 - tolerance):
+        problems.append(f"moves_per_sec {now:.1f} < baseline {base:.1f}")
+    for p in ("p50", "p99"):
+        base = (baseline.get("latency_ms") or {}).get(p)
+        now = (result.get("latency_ms") or {}).get(p)
+        if base and now and now > base * (1 + tolerance):
+            problems.append(f"latency {p} {now:.2f}ms > baseline {base:.2f}ms")
+    return problems
+
+
+async def run(args: argparse.Namespace, url: str) -> Stats:
+    secret = os.getenv("AUTH_JWT_SECRET", "CHANGE_ME_123456789")
+    alg = os.getenv("JWT_ALG", "HS256")
+    if args.replay:
+        recorded = replay_scripts(json.loads(Path(args.replay).read_text(encoding="utf-8")), args.max_gap, args.speed)
+        if not recorded:
+            raise SystemExit(f"no replayable actions in {args.replay}")
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + args.ramp + args.duration
+    tasks = []
+    for i in range(args.players):
+        token = jwt.encode({"sub": f"bench-{args.seed}-{i:05d}", "iat": int(time.time())}, secret, algorithm=alg)
+        if args.replay:
+            script: Iterator[Step] = iter(recorded[i % len(recorded)])
+        else:
+            script = random_walk(random.Random(args.seed * 1_000_003 + i), args.rate)
+        tasks.append(asyncio.create_task(run_player(url, token, script, stats, deadline, args.view_radius)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.players)
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="ws://host:port of a running server (default: start one)")
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load after the ramp")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which players connect")
+    parser.add_argument("--rate", type=float, default=5.0, help="random-walk moves per second per player")
+    parser.add_argument("--view-radius", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", help="history.json whose action streams the players replay")
+    parser.add_argument("--speed", type=float, default=60.0, help="replay time compression")
+    parser.add_argument("--max-gap", type=float, default=1.0, help="longest replayed pause, in seconds")
+    parser.add_argument("--out", help="write the JSON result here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    server: Optional[subprocess.Popen] = None
+    scratch: Optional[tempfile.TemporaryDirectory] = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        scratch = tempfile.TemporaryDirectory(prefix="voxel-bench-")
+        port = _free_port()
+        server = _spawn_server(port, scratch.name)
+        url = f"ws://127.0.0.1:{port}"
+    http_url = "http" + url[2:]
+    server_pid = server.pid if server else None
+
+    try:
+        metrics_before = scrape(http_url)
+        usage_before = process_usage(server_pid)
+        started = time.perf_counter()
+        stats = asyncio.run(run(args, url))
+        elapsed = time.perf_counter() - started
+        metrics_after = scrape(http_url)
+        usage_after = process_usage(server_pid)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if scratch is not None:
+            scratch.cleanup()
+
+    def delta(name: str) -> Optional[float]:
+        if name in metrics_before and name in metrics_after:
+            return metrics_after[name] - metrics_before[name]
+        return None
+
+    server_moves = delta("voxel_hub_move_seconds_count")
+    result = {
+        "commit": _git_commit(),
+        "timestamp": int(time.time()),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "elapsed_seconds": round(elapsed, 3),
+        "players_connected": stats.connected,
+        "connect_errors": stats.connect_errors,
+        "disconnects": stats.disconnects,
+        "moves_sent": stats.moves_sent,
+        "moves_per_sec": round(stats.moves_sent / elapsed, 2),
+        "server_moves_per_sec": round(server_moves / elapsed, 2) if server_moves is not None else None,
+        "frames_received": stats.frames,
+        "frames_per_sec": round(stats.frames / elapsed, 2),
+        "mb_received": round(stats.bytes_received / 2**20, 3),
+        "latency_ms": percentiles(stats.latencies),
+        "server": {
+            "cpu_seconds": round(usage_after.get("cpu_seconds", 0) - usage_before.get("cpu_seconds", 0), 3),
+            "rss_mb": usage_after.get("rss_mb"),
+            "max_rss_mb": usage_after.get("max_rss_mb"),
+        } if usage_after else None,
+        "client": process_usage(None),
+    }
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    if args.baseline:
+        problems = compare(result, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for line in problems:
+            print(f"REGRESSION: {line}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
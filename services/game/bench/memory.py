@@ -0,0 +1,113 @@
+"""
+Memory cost of a connected player in the hub::
+
+    python -m services.game.bench.memory --players 20000
+    python -m services.game.bench.memory --players 20000 --out memory.json
+
+Connects ``--players`` fake sockets to a fresh Hub in admission-sized batches (storage
+calls are stubbed out for the run, so only the hub's own bookkeeping is measured and
+repository data is never touched) and reports the
+growth per player of
+
+* ``traced_bytes``: Python heap, from tracemalloc;
+* ``rss_bytes``: resident set size, which also counts torch's native allocations
+  (0-d tensors live mostly outside the Python heap).
+
+Each figure comes from its own hub, so tracemalloc's bookkeeping stays out of the RSS.
+The sockets are allocated before measuring starts; boards and free-cell indexes of the
+chunks the players land in are part of the figure.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+
+class _Socket:
+    async def send_text(self, text: str) -> None:
+        pass
+
+
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource  # peak, not current; good enough where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def _fill(players: int) -> Tuple[object, int]:
+    """A hub with ``players`` connected sockets, and the traced bytes it took if tracing is on."""
+    from .. import hub as hub_module
+    from ..settings import ADMISSION_BATCH
+    from ..tokens import Claims
+
+    hub = hub_module.Hub()
+    entries = [(_Socket(), Claims(f"{i:08b}", {}), None, None) for i in range(players)]
+    gc.collect()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    # placed the way the admission queue places a storm
+    for i in range(0, players, ADMISSION_BATCH):
+        await hub.connect_batch(entries[i:i + ADMISSION_BATCH])
+    gc.collect()
+    assert hub.socket_count() == players
+    return hub, tracemalloc.get_traced_memory()[0] - traced_before
+
+
+async def _measure(players: int) -> Dict[str, float]:
+    from .. import hub as hub_module
+    stubs = {
+        "load_chunk": lambda key: None,
+        "save_chunk": lambda key, board: None,
+        "get_player_position": lambda user_id: None,
+        "save_player_position": lambda *a, **k: None,
+    }
+    originals = {name: getattr(hub_module, name) for name in stubs}
+    for name, stub in stubs.items():
+        setattr(hub_module, name, stub)
+    try:
+        gc.collect()
+        rss_before = _rss()
+        kept, _ = await _fill(players)  # stays alive while the second hub is measured
+        rss = _rss() - rss_before
+
+        tracemalloc.start()
+        _, traced = await _fill(players)
+        tracemalloc.stop()
+    finally:
+        for name, original in originals.items():
+            setattr(hub_module, name, original)
+    return {
+        "players": players,
+        "traced_bytes": round(traced / players, 1),
+        "rss_bytes": round(rss / players, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=20000)
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(_measure(args.players))
+    print(f"{result['players']} players: {result['traced_bytes']:.0f} B/player traced, "
+          f"{result['rss_bytes']:.0f} B/player rss", file=sys.stderr)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    # importing services.game.db opens world.db under GAME_DATA_DIR; keep that out of the repo
+    with tempfile.TemporaryDirectory(prefix="voxel-memory-data-") as _data_dir:
+        os.environ.setdefault("GAME_DATA_DIR", _data_dir)
+        sys.exit(main())
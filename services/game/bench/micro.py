@@ -0,0 +1,304 @@
+"""
+Per-operation micro-benchmarks for the game and chat hot paths (stdlib timeit)::
+
+    python -m services.game.bench.micro --out micro.json
+    python -m services.game.bench.micro --filter history --baseline micro.json
+
+Every case builds its inputs from a fixed seed inside a scratch directory (history.json,
+message.json, the SQLite files and the chat service's data are redirected there), so two
+runs on the same machine measure the same work and repository data is never touched.
+Module globals a case redirects are put back after it. With --baseline, cases slower than the baseline by more than
+--tolerance are reported and the exit code is 1.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parents[3]
+
+# a case factory gets a seeded rng and a scratch dir and returns the operation to time
+Factory = Callable[[random.Random, Path], Callable[[], object]]
+CASES: Dict[str, Factory] = {}
+# (object, attribute, original value) of every global a case replaced; see _patch
+_PATCHED: List[Tuple[object, str, object]] = []
+# modules a case imported with their data in the scratch dir; dropped again by _restore
+_IMPORTED: List[str] = []
+
+
+def case(name: str) -> Callable[[Factory], Factory]:
+    def register(factory: Factory) -> Factory:
+        CASES[name] = factory
+        return factory
+    return register
+
+
+def _patch(obj: object, name: str, value: object) -> None:
+    """Replaces ``obj.name`` for the current case; run_cases restores it afterwards."""
+    _PATCHED.append((obj, name, getattr(obj, name)))
+    setattr(obj, name, value)
+
+
+def _restore() -> None:
+    while _PATCHED:
+        obj, name, value = _PATCHED.pop()
+        setattr(obj, name, value)
+    while _IMPORTED:
+        # the scratch dir goes away with the run; the next import must not find a module pointing at it
+        name = _IMPORTED.pop()
+        sys.modules.pop(name, None)
+        parent, _, child = name.rpartition(".")
+        if parent in sys.modules and hasattr(sys.modules[parent], child):
+            delattr(sys.modules[parent], child)
+
+
+# ---------- bits ----------
+@case("bits.set_bit")
+def _set_bit(rng: random.Random, scratch: Path):
+    import torch
+    from ..bits import set_bit
+    v = torch.tensor(rng.randrange(256), dtype=torch.uint8)
+    bit = rng.randrange(8)
+    return lambda: set_bit(v, bit, True)
+
+
+@case("bits.inc_color")
+def _inc_color(rng: random.Random, scratch: Path):
+    import torch
+    from ..bits import inc_color
+    v = torch.tensor(rng.randrange(256), dtype=torch.uint8)
+    return lambda: inc_color(v)
+
+
+@case("bits.make_color")
+def _make_color(rng: random.Random, scratch: Path):
+    from ..bits import make_color
+    r, g, b = (rng.randrange(4) for _ in range(3))
+    return lambda: make_color(r, g, b)
+
+
+# ---------- ChunkDB ----------
+def _chunk_case(where: str, op: str) -> Factory:
+    def factory(rng: random.Random, scratch: Path):
+        import torch
+        from ..db import ChunkDB
+        from ..ids import key_from_coords
+        from ..settings import W, H
+        db = ChunkDB(":memory:" if where == "memory" else scratch / f"chunks-{op}.db")
+        gen = torch.Generator().manual_seed(rng.randrange(2**31))
+        boards = [torch.randint(0, 256, (H, W), dtype=torch.uint8, generator=gen) for _ in range(64)]
+        ids = [key_from_coords(i % 8, i // 8) for i in range(64)]
+        for cid, board in zip(ids, boards):
+            db.save_chunk(cid, board)
+        state = {"i": 0}
+
+        def save():
+            i = state["i"] = (state["i"] + 1) % 64
+            db.save_chunk(ids[i], boards[i])
+
+        def load():
+            i = state["i"] = (state["i"] + 1) % 64
+            return db.load_chunk(ids[i])
+
+        return save if op == "save" else load
+    return factory
+
+
+for _where in ("memory", "file"):
+    for _op in ("save", "load"):
+        case(f"chunkdb.{_op}_chunk[{_where}]")(_chunk_case(_where, _op))
+
+
+# ---------- history.json ----------
+def _history_case(players: int) -> Factory:
+    def factory(rng: random.Random, scratch: Path):
+        from .. import db_history
+        path = scratch / f"history-{players}.json"
+        history = {
+            f"p{i}": {"chunks": {"0,0": {"actions": [rng.randrange(1, 10) for _ in range(200)], "last_ts": 0}}}
+            for i in range(players)
+        }
+        path.write_text(json.dumps(history), encoding="utf-8")
+        _patch(db_history, "HISTORIES_JSON_PATH", path)
+        state = {"ts": 1_000_000}
+
+        def append():
+            state["ts"] += 1
+            db_history.append_player_action("p0", "0,0", db_history.TOKEN_RIGHT, now_ts=state["ts"])
+
+        return append
+    return factory
+
+
+for _players in (10, 100, 1000):
+    case(f"history.append_player_action[{_players} players]")(_history_case(_players))
+
+
+# ---------- message.json ----------
+def _message_case(existing: int, op: str) -> Factory:
+    def factory(rng: random.Random, scratch: Path):
+        from .. import db
+        from ..models import Message
+        path = scratch / f"message-{existing}-{op}.json"
+        messages = {}
+        for i in range(existing):
+            m = Message(content=f"m{i}", author="bench", chunk_id=f"{i % 50},0", position=(i % 64, i // 64 % 64))
+            messages[f"{m.chunk_id}_{m.position[0]}_{m.position[1]}"] = m.to_dict()
+        path.write_text(json.dumps(messages), encoding="utf-8")
+        _patch(db, "MESSAGES_JSON_PATH", path)
+        probe = Message(content="probe", author="bench", chunk_id="999,0", position=(1, 1))
+
+        if op == "save":
+            return lambda: db.save_message(probe)
+        return lambda: db.load_message("3,0", 3, 0)
+    return factory
+
+
+for _existing in (100, 1000):
+    case(f"messages.save_message[{_existing}]")(_message_case(_existing, "save"))
+    case(f"messages.load_message[{_existing}]")(_message_case(_existing, "load"))
+
+
+# ---------- chat ----------
+def _import_chat(scratch: Path):
+    """services.chat.main, imported with its data dir in ``scratch``: importing it replays,
+    compacts and retrofits chats.json, which must not happen to the repository's copy.
+    A module imported here is forgotten again after the case."""
+    if "services.chat.main" in sys.modules:
+        return sys.modules["services.chat.main"]
+    previous = os.environ.get("CHAT_DATA_DIR")
+    os.environ["CHAT_DATA_DIR"] = str(scratch / "chat")
+    try:
+        from services.chat import main as chat
+        _IMPORTED.append("services.chat.main")
+    finally:
+        if previous is None:
+            del os.environ["CHAT_DATA_DIR"]
+        else:
+            os.environ["CHAT_DATA_DIR"] = previous
+    return chat
+
+
+def _chat_case(total: int) -> Factory:
+    def factory(rng: random.Random, scratch: Path):
+        chat = _import_chat(scratch)
+        users = [f"{i:08b}" for i in range(1, 201)]
+        msgs = []
+        for i in range(total):
+            a, b = rng.sample(users, 2)
+            msgs.append({"id": f"m{i}", "from": a, "to": b, "message": f"hello {i}",
+                         "timestamp": f"2025-01-01T00:00:{i % 60:02d}Z"})
+        _patch(chat, "chats_data", {"chats": [{"chat_id": "chat1", "messages": msgs}]})
+        a, b = users[0], users[1]
+        return lambda: chat.history_between(a, b, viewer=a)
+    return factory
+
+
+for _total in (10_000, 100_000):
+    case(f"chat.history_between[{_total} messages]")(_chat_case(_total))
+
+
+# ---------- runner ----------
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> Dict[str, float]:
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:  # like Timer.autorange, but with a configurable floor
+        if timer.timeit(number) >= min_time:
+            break
+        number *= 10 if number < 1000 else 2
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "best_us": round(min(runs) * 1e6, 3),
+        "median_us": round(statistics.median(runs) * 1e6, 3),
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+def run_cases(names: List[str], seed: int, repeat: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="voxel-micro-") as scratch:
+        for name in names:
+            # save_message logs every call; keep stdout clean for the JSON result
+            try:
+                with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+                    fn = CASES[name](random.Random(f"{seed}:{name}"), Path(scratch))
+                    results[name] = measure(fn, repeat, min_time)
+            finally:
+                _restore()
+            print(f"{name:48s} {results[name]['best_us']:>12.3f} us", file=sys.stderr)
+    return results
+
+
+def compare(cases: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[Tuple[str, float]]:
+    """(case, slowdown ratio) for every case whose best time grew beyond ``tolerance``."""
+    slower = []
+    for name, now in cases.items():
+        before = baseline.get(name)
+        if not before or not before.get("best_us"):
+            continue
+        ratio = now["best_us"] / before["best_us"]
+        if ratio > 1 + tolerance:
+            slower.append((name, round(ratio, 3)))
+    return slower
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only cases whose name contains this")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args(argv)
+
+    names = [n for n in CASES if args.filter in n]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    result = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "cases": run_cases(names, args.seed, args.repeat, args.min_time),
+    }
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")).get("cases", {})
+        slower = compare(result["cases"], baseline, args.tolerance)
+        for name, ratio in slower:
+            print(f"REGRESSION: {name} is {ratio:.2f}x the baseline", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    # importing services.game.db opens world.db under GAME_DATA_DIR; keep that out of the repo too
+    with tempfile.TemporaryDirectory(prefix="voxel-micro-data-") as _data_dir:
+        os.environ.setdefault("GAME_DATA_DIR", _data_dir)
+        sys.exit(main())
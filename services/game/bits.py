@@ -37,3 +37,13 @@ def with_player(v: torch.Tensor) -> torch.Tensor:
 def without_player(v: torch.Tensor) -> torch.Tensor:
     return set_bit(v, BIT_IS_PLAYER, False)
 
+
+# plain-int versions for cell values kept outside a board (a player's colour and the cell under it)
+def with_player_int(v: int) -> int:
+    return v | (1 << BIT_IS_PLAYER)
+
+def without_player_int(v: int) -> int:
+    return v & ~(1 << BIT_IS_PLAYER) & 0xFF
+
+def has_bit_int(v: int, bit: int) -> bool:
+    return bool((v >> bit) & 1)
@@ -0,0 +1,307 @@
+"""
+Pub/sub for chunk update frames.
+
+The hub publishes every encoded ``matrix`` frame on a ChunkBus and delivers to its own
+sockets from its bus subscriptions, so a socket can watch a chunk that is simulated by
+another Hub: in the same process (InProcessBus) or in another process connected to the
+same broker (LocalSocketBus + ``python -m services.game.bus --listen 127.0.0.1:7199``).
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import logging
+import queue
+import threading
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from .ids import ChunkKey
+from .metrics import BUS_FRAMES_DROPPED
+
+LOGGER = logging.getLogger("voxel-bus")
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+Handler = Callable[[ChunkKey, str], Awaitable[None]]
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(text: str) -> Address:
+    """``host:port`` -> TCP address, anything else is a unix socket path."""
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return text
+
+
+def _encode(op: str, key: ChunkKey, frame: str = "") -> bytes:
+    return f"{op}\0{key}\0{frame}".encode()
+
+
+def _decode(data: bytes) -> Tuple[str, ChunkKey, str]:
+    op, key, frame = data.decode().split("\0", 2)
+    return op, int(key), frame
+
+
+class ChunkBus:
+    """
+    Base bus: handlers subscribe per chunk and ``publish`` awaits every handler subscribed
+    to that chunk, in subscription order. Subclasses that reach other processes hook the
+    first/last local subscriber of a chunk and set ``shared``.
+    """
+    shared = False
+
+    def __init__(self) -> None:
+        self._handlers: Dict[ChunkKey, List[Handler]] = {}
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def subscribe(self, key: ChunkKey, handler: Handler) -> None:
+        handlers = self._handlers.setdefault(key, [])
+        if handler in handlers:
+            return
+        handlers.append(handler)
+        if len(handlers) == 1:
+            self._first_subscriber(key)
+
+    def unsubscribe(self, key: ChunkKey, handler: Handler) -> None:
+        handlers = self._handlers.get(key)
+        if not handlers or handler not in handlers:
+            return
+        handlers.remove(handler)
+        if not handlers:
+            del self._handlers[key]
+            self._last_unsubscriber(key)
+
+    def wants(self, key: ChunkKey) -> bool:
+        """False when publishing ``key`` would reach nobody (lets the hub skip encoding)."""
+        return key in self._handlers
+
+    async def publish(self, key: ChunkKey, frame: str) -> None:
+        await self._dispatch(key, frame)
+
+    async def _dispatch(self, key: ChunkKey, frame: str) -> None:
+        for handler in list(self._handlers.get(key, ())):
+            try:
+                await handler(key, frame)
+            except Exception as e:
+                LOGGER.debug("chunk handler failed: %r", e)
+
+    def _first_subscriber(self, key: ChunkKey) -> None:
+        pass
+
+    def _last_unsubscriber(self, key: ChunkKey) -> None:
+        pass
+
+
+class InProcessBus(ChunkBus):
+    """All publishers and subscribers live in this event loop. The default."""
+
+
+class LocalSocketBus(ChunkBus):
+    """
+    Connects to a BusBroker over multiprocessing.connection. Local subscribers are
+    served directly; the broker only learns which chunks this process wants and relays
+    frames published by the other processes. A reader thread feeds an asyncio queue
+    so frames are delivered on the loop in the order the broker sent them, and a writer
+    thread drains an outbox, so a slow broker never blocks the loop (or the hub lock
+    ``publish`` is called under). While more than ``max_pending`` frames wait, new
+    ``pub`` frames are dropped; subscription changes never are.
+    """
+    shared = True
+
+    def __init__(self, address: Address, authkey: bytes, connect_timeout: float = 10.0,
+                 max_pending: int = 1024) -> None:
+        super().__init__()
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.max_pending = max_pending
+        self._conn: Optional[Connection] = None
+        self._outbox: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._inbox: Optional[asyncio.Queue] = None
+        self._pump: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        # the broker may have been launched alongside us and not be listening yet
+        deadline = loop.time() + self.connect_timeout
+        while True:
+            try:
+                self._conn = await asyncio.to_thread(Client, self.address, authkey=self.authkey)
+                break
+            except OSError as e:
+                if loop.time() >= deadline:
+                    raise ConnectionError(f"chunk bus broker at {self.address} not reachable: {e!r}") from e
+                await asyncio.sleep(0.05)
+        self._inbox = asyncio.Queue()
+        for key in self._handlers:  # subscriptions made before the connection existed
+            self._send("sub", key)
+        threading.Thread(target=self._read_loop, args=(self._conn, loop), name="chunk-bus-reader",
+                         daemon=True).start()
+        self._writer = threading.Thread(target=self._write_loop, args=(self._conn,), name="chunk-bus-writer",
+                                        daemon=True)
+        self._writer.start()
+        self._pump = loop.create_task(self._run())
+        LOGGER.info("Chunk bus connected to %s", self.address)
+
+    async def close(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+            self._pump = None
+        conn, self._conn = self._conn, None
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self._outbox.put(None)
+            await asyncio.to_thread(writer.join, 1.0)  # let queued frames reach the broker
+        if conn is not None:
+            conn.close()
+
+    def wants(self, key: ChunkKey) -> bool:
+        # remote subscriptions are only known to the broker
+        return True
+
+    async def publish(self, key: ChunkKey, frame: str) -> None:
+        await self._dispatch(key, frame)
+        self._send("pub", key, frame)
+
+    def _first_subscriber(self, key: ChunkKey) -> None:
+        self._send("sub", key)
+
+    def _last_unsubscriber(self, key: ChunkKey) -> None:
+        self._send("unsub", key)
+
+    def _send(self, op: str, key: ChunkKey, frame: str = "") -> None:
+        if self._conn is None:
+            return
+        if op == "pub" and self._outbox.qsize() >= self.max_pending:
+            BUS_FRAMES_DROPPED.inc()  # the next frame of the chunk supersedes this one anyway
+            return
+        self._outbox.put(_encode(op, key, frame))
+
+    def _write_loop(self, conn: Connection) -> None:
+        while True:
+            data = self._outbox.get()
+            if data is None:
+                return
+            try:
+                conn.send_bytes(data)
+            except OSError as e:
+                LOGGER.warning("chunk bus send failed: %r", e)
+                return
+
+    def _read_loop(self, conn: Connection, loop: asyncio.AbstractEventLoop) -> None:
+        try:
+            while True:
+                op, key, frame = _decode(conn.recv_bytes())
+                if op == "pub":
+                    loop.call_soon_threadsafe(self._inbox.put_nowait, (key, frame))
+        except (EOFError, OSError):
+            LOGGER.info("Chunk bus connection closed")
+        except RuntimeError:
+            pass  # event loop already closed
+
+    async def _run(self) -> None:
+        while True:
+            key, frame = await self._inbox.get()
+            await self._dispatch(key, frame)
+
+
+class BusBroker:
+    """Relays every published frame to the other connections subscribed to its chunk. One thread per connection."""
+
+    def __init__(self, address: Address, authkey: bytes) -> None:
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        self._subs: Dict[ChunkKey, Set[Connection]] = {}
+        self._send_locks: Dict[Connection, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="chunk-bus-broker", daemon=True)
+        thread.start()
+        return thread
+
+    def serve_forever(self) -> None:
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+            except (AuthenticationError, EOFError):
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            with self._lock:
+                self._send_locks[conn] = threading.Lock()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def close(self) -> None:
+        self._closed = True
+        self._listener.close()
+
+    def _serve(self, conn: Connection) -> None:
+        try:
+            while True:
+                data = conn.recv_bytes()
+                op, key, _ = _decode(data)
+                if op == "sub":
+                    with self._lock:
+                        self._subs.setdefault(key, set()).add(conn)
+                elif op == "unsub":
+                    with self._lock:
+                        self._discard(key, conn)
+                elif op == "pub":
+                    with self._lock:
+                        targets = [c for c in self._subs.get(key, ()) if c is not conn]
+                    for target in targets:
+                        self._forward(target, data)
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                for key in list(self._subs):
+                    self._discard(key, conn)
+                self._send_locks.pop(conn, None)
+            conn.close()
+
+    def _discard(self, key: ChunkKey, conn: Connection) -> None:
+        subs = self._subs.get(key)
+        if subs is not None:
+            subs.discard(conn)
+            if not subs:
+                del self._subs[key]
+
+    def _forward(self, conn: Connection, data: bytes) -> None:
+        lock = self._send_locks.get(conn)
+        if lock is None:
+            return
+        try:
+            with lock:
+                conn.send_bytes(data)
+        except OSError as e:
+            LOGGER.debug("chunk bus forward failed: %r", e)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from .settings import BUS_ADDRESS, BUS_AUTHKEY
+
+    parser = argparse.ArgumentParser(description="Chunk pub/sub broker for the game workers")
+    parser.add_argument("--listen", default=BUS_ADDRESS or "127.0.0.1:7199")
+    args = parser.parse_args(argv)
+    broker = BusBroker(parse_address(args.listen), BUS_AUTHKEY)
+    LOGGER.info("Chunk bus listening on %s", broker.address)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        broker.close()
+
+
+if __name__ == "__main__":
+    main()
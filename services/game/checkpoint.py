@@ -0,0 +1,95 @@
+"""
+World checkpoint written on graceful shutdown and mapped back in on startup.
+
+Layout, little endian::
+
+    header    magic b"VXCP", u16 version, u16 w, u16 h, u32 chunks, u32 sessions
+    chunk     u64 key, w*h board bytes
+    session   u64 key, u16 row, u16 col, u8 color, u8 underlying, u16 id length, utf-8 id
+
+Restored boards are tensors over a private (copy-on-write) mapping of the file: a
+chunk costs nothing until it is first read, and the first write to it copies one page,
+never the file.
+"""
+from __future__ import annotations
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import torch
+
+from .ids import ChunkKey
+
+MAGIC = b"VXCP"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHHII")
+_CHUNK = struct.Struct("<Q")
+_SESSION = struct.Struct("<QHHBBH")
+
+
+@dataclass(frozen=True)
+class SessionRecord:
+    user_id: str
+    key: ChunkKey
+    row: int
+    col: int
+    color: int
+    underlying: int
+
+
+def write_checkpoint(path: Path, w: int, h: int, chunks: Dict[ChunkKey, torch.Tensor],
+                     sessions: List[SessionRecord]) -> None:
+    """Writes next to ``path`` and renames over it, so a reader never sees half a file."""
+    tmp = Path(path).with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, w, h, len(chunks), len(sessions)))
+        for key, board in chunks.items():
+            f.write(_CHUNK.pack(key))
+            f.write(board.contiguous().numpy().tobytes())
+        for s in sessions:
+            uid = s.user_id.encode()
+            f.write(_SESSION.pack(s.key, s.row, s.col, s.color, s.underlying, len(uid)))
+            f.write(uid)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_checkpoint(path: Path, w: int, h: int) -> Tuple[Dict[ChunkKey, torch.Tensor], List[SessionRecord]]:
+    """Raises ``ValueError`` when the file is not a checkpoint for ``w`` x ``h`` chunks."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(mm) < _HEADER.size:
+        raise ValueError("checkpoint truncated")
+    magic, version, cw, ch, n_chunks, n_sessions = _HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not a version {VERSION} checkpoint")
+    if (cw, ch) != (w, h):
+        raise ValueError(f"checkpoint is for {cw}x{ch} chunks, not {w}x{h}")
+    size = w * h
+    if len(mm) < _HEADER.size + n_chunks * (_CHUNK.size + size):
+        raise ValueError("checkpoint truncated")
+
+    chunks: Dict[ChunkKey, torch.Tensor] = {}
+    offset = _HEADER.size
+    for _ in range(n_chunks):
+        (key,) = _CHUNK.unpack_from(mm, offset)
+        offset += _CHUNK.size
+        # the tensors keep the mapping alive
+        chunks[key] = torch.frombuffer(mm, dtype=torch.uint8, count=size, offset=offset).view(h, w)
+        offset += size
+
+    sessions: List[SessionRecord] = []
+    try:
+        for _ in range(n_sessions):
+            key, row, col, color, underlying, n = _SESSION.unpack_from(mm, offset)
+            offset += _SESSION.size
+            user_id = bytes(mm[offset:offset + n]).decode()
+            offset += n
+            sessions.append(SessionRecord(user_id, key, row, col, color, underlying))
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"checkpoint truncated: {e}") from e
+    return chunks, sessions
@@ -0,0 +1,39 @@
+"""
+Shrinks an existing world.db::
+
+    python -m services.game.compact
+    python -m services.game.compact --db /path/to/world.db --no-vacuum
+
+Deletes every stored all-zero chunk (they read back as empty anyway, see
+ChunkDB.save_chunk) and then VACUUMs the file to hand the freed pages back to the
+file system. Safe while the server runs (WAL mode), though VACUUM briefly blocks writers.
+"""
+import argparse
+import os
+from pathlib import Path
+from typing import List
+
+from .db import ChunkDB
+from .settings import DB_PATH
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--no-vacuum", action="store_true", help="only delete the empty rows")
+    args = parser.parse_args(argv)
+
+    if not args.db.exists():
+        parser.error(f"{args.db} does not exist")
+    before = os.path.getsize(args.db)
+    db = ChunkDB(args.db)
+    total = len(db.list_chunk_keys())
+    removed = db.compact(vacuum=not args.no_vacuum)
+    db.conn.close()
+    after = os.path.getsize(args.db)
+    print(f"removed {removed} empty chunks, {total - removed} left; {before} -> {after} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
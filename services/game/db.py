@@ -1,6 +1,6 @@
 import sqlite3, time
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Iterator, Optional, List, Tuple
 import numpy as np
 import torch
 from .settings import DB_PATH, W, H, DTYPE
@@ -8,10 +8,18 @@ import json
 import os
 from json import JSONDecodeError
 from .models import Message
+from .metrics import SAVE_CHUNK_SECONDS, LOAD_CHUNK_SECONDS
+from .ids import ChunkKey, key_from_id, id_from_key, coords_from_key
 from .settings import DB_PATH, W, H, DTYPE
 
 BASE_ROOT_DIR = Path(__file__).resolve().parents[2] 
-MESSAGES_JSON_PATH = BASE_ROOT_DIR / "data" / "message.json"
+BASE_MESSAGES_JSON_PATH = Path(os.getenv("GAME_DATA_DIR") or BASE_ROOT_DIR / "data") / "message.json"
+# save_message קורא וכותב את כל הקובץ, וזה לא בטוח בין תהליכים: עם GAME_SHARDS > 1 כל worker
+# קורא וכותב רק את ההודעות של ה-chunks שלו בקובץ משלו (split_messages_by_shard / fold_shard_messages)
+MESSAGES_JSON_PATH = (
+    BASE_MESSAGES_JSON_PATH.with_name(f"message.shard-{os.getenv('GAME_SHARD_ID', '0')}.json")
+    if int(os.getenv("GAME_SHARDS", "1")) > 1 else BASE_MESSAGES_JSON_PATH
+)
 
 class ChunkDB:
     def __init__(self, db_path: Path =DB_PATH):
@@ -20,47 +28,151 @@ class ChunkDB:
             self.conn.execute("PRAGMA journal_mode=WAL")        
         except Exception as e:
             print('[DB] failed execute to the connection')
+        # INTEGER PRIMARY KEY is the rowid itself: rows are stored in Morton-key order, so
+        # neighbouring chunks share B-tree pages instead of being scattered by string order
         self.conn.execute("""
         CREATE TABLE IF NOT EXISTS chunks (
-          id TEXT PRIMARY KEY,
+          id INTEGER PRIMARY KEY,
+          cx INTEGER,
+          cy INTEGER,
           w INTEGER NOT NULL,
           h INTEGER NOT NULL,
           data BLOB NOT NULL,
           last_used INTEGER
         )
         """)
+        self._migrate_text_ids()
+        self._add_coord_columns()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunks_by_coords ON chunks (cx, cy)")
 
-    def save_chunk(self, cid: str, data_t : torch.Tensor):
+    def _migrate_text_ids(self) -> None:
+        """Rewrites a world.db from before integer keys ("cx,cy" TEXT ids) in place, once."""
+        columns = {r[1]: r[2] for r in self.conn.execute("PRAGMA table_info(chunks)")}
+        if columns.get("id", "").upper() != "TEXT":
+            return
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute("""
+            CREATE TABLE chunks_by_key (
+              id INTEGER PRIMARY KEY,
+              w INTEGER NOT NULL,
+              h INTEGER NOT NULL,
+              data BLOB NOT NULL,
+              last_used INTEGER
+            )
+            """)
+            rows = self.conn.execute("SELECT id, w, h, data, last_used FROM chunks").fetchall()
+            self.conn.executemany(
+                "INSERT INTO chunks_by_key (id, w, h, data, last_used) VALUES (?, ?, ?, ?, ?)",
+                sorted((key_from_id(cid), w, h, blob, used) for cid, w, h, blob, used in rows),
+            )
+            self.conn.execute("DROP TABLE chunks")
+            self.conn.execute("ALTER TABLE chunks_by_key RENAME TO chunks")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _add_coord_columns(self) -> None:
+        """Adds and backfills cx/cy on a world.db from before range queries, once."""
+        columns = {r[1] for r in self.conn.execute("PRAGMA table_info(chunks)")}
+        if "cx" in columns:
+            return
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute("ALTER TABLE chunks ADD COLUMN cx INTEGER")
+            self.conn.execute("ALTER TABLE chunks ADD COLUMN cy INTEGER")
+            keys = [r[0] for r in self.conn.execute("SELECT id FROM chunks")]
+            self.conn.executemany(
+                "UPDATE chunks SET cx=?, cy=? WHERE id=?",
+                ((*coords_from_key(key), key) for key in keys),
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def save_chunk(self, key: ChunkKey, data_t : torch.Tensor):
         assert data_t.dtype == torch.uint8
         arr = data_t.numpy().astype(np.uint8, copy = False)
+        if not arr.any():
+            # empty chunks are implicit: a missing row reads as an all-zero board
+            self.conn.execute("DELETE FROM chunks WHERE id=?", (key,))
+            return
         blob = arr.tobytes(order = "C")
         now = int(time.time())
         self.conn.execute(
              """
-            INSERT INTO chunks (id, w, h, data, last_used)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO chunks (id, cx, cy, w, h, data, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(id) DO UPDATE SET
               w=excluded.w,
               h=excluded.h,
               data=excluded.data,
               last_used=excluded.last_used
             """,
-            (cid, W, H, blob, now),
+            (key, *coords_from_key(key), W, H, blob, now),
         )
 
-    def load_chunk(self, cid: str) -> Optional[torch.Tensor]:
-        curr = self.conn.execute("SELECT data, w, h FROM chunks WHERE id=?", (cid,))
+    def load_chunk(self, key: ChunkKey) -> Optional[torch.Tensor]:
+        curr = self.conn.execute("SELECT data, w, h FROM chunks WHERE id=?", (key,))
         row = curr.fetchone()
         if not row:
             return None
         blob, w, h = row
         arr = np.frombuffer(blob, dtype = np.uint8, count = w*h).reshape(h, w)
-        self.conn.execute("UPDATE chunks SET last_used=? WHERE id=?", (int(time.time()), cid))
+        self.conn.execute("UPDATE chunks SET last_used=? WHERE id=?", (int(time.time()), key))
         return torch.tensor(arr, dtype=DTYPE)
     
-    def list_chunk_ids(self) ->List[str]:
+    def list_chunk_keys(self) -> List[ChunkKey]:
         curr = self.conn.execute("SELECT id FROM chunks")
         return [r[0] for r in curr.fetchall()]
+
+    def list_chunk_ids(self) ->List[str]:
+        return [id_from_key(key) for key in self.list_chunk_keys()]
+
+    # Range queries stream rows off the (cx, cy) index in batches, so a caller that stops
+    # early never reads the rest. They are reads only: last_used is left alone. Bounds are
+    # inclusive chunk coordinates.
+    def iter_keys_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[ChunkKey]:
+        for key, in self._stream("SELECT id FROM chunks WHERE cx BETWEEN ? AND ? AND cy BETWEEN ? AND ?",
+                                 (x0, x1, y0, y1)):
+            yield key
+
+    def iter_chunks_in_rect(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[ChunkKey, torch.Tensor]]:
+        rows = self._stream("SELECT id, data, w, h FROM chunks WHERE cx BETWEEN ? AND ? AND cy BETWEEN ? AND ?",
+                            (x0, x1, y0, y1))
+        for key, blob, w, h in rows:
+            yield key, self._board(blob, w, h)
+
+    def iter_chunks_in_radius(self, cx: int, cy: int, radius: int) -> Iterator[Tuple[ChunkKey, torch.Tensor]]:
+        """Chunks whose centre-to-centre distance from (cx, cy) is at most ``radius`` chunks."""
+        rows = self._stream(
+            """
+            SELECT id, data, w, h FROM chunks
+            WHERE cx BETWEEN ? AND ? AND cy BETWEEN ? AND ?
+              AND (cx - ?) * (cx - ?) + (cy - ?) * (cy - ?) <= ?
+            """,
+            (cx - radius, cx + radius, cy - radius, cy + radius, cx, cx, cy, cy, radius * radius),
+        )
+        for key, blob, w, h in rows:
+            yield key, self._board(blob, w, h)
+
+    def _stream(self, sql: str, params: tuple, batch: int = 64) -> Iterator[tuple]:
+        curr = self.conn.execute(sql, params)
+        try:
+            while True:
+                rows = curr.fetchmany(batch)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            curr.close()
+
+    @staticmethod
+    def _board(blob: bytes, w: int, h: int) -> torch.Tensor:
+        arr = np.frombuffer(blob, dtype = np.uint8, count = w*h).reshape(h, w)
+        return torch.tensor(arr, dtype=DTYPE)
     
     def clear_player_bits_all(self)-> None:
         curr = self.conn.execute("SELECT id, data, w, h FROM chunks")
@@ -74,28 +186,82 @@ class ChunkDB:
                 "UPDATE chunks SET data=?, last_used=? WHERE id=?",
                 (new_blob, now, cid),
             )
+        # chunks that only held players are empty now
+        self.delete_empty_chunks()
+
+    def delete_empty_chunks(self) -> int:
+        """Drops every stored all-zero board; returns how many rows went."""
+        curr = self.conn.execute("DELETE FROM chunks WHERE data = zeroblob(length(data))")
+        return curr.rowcount
+
+    def compact(self, vacuum: bool = True) -> int:
+        removed = self.delete_empty_chunks()
+        if vacuum:
+            self.conn.execute("VACUUM")
+        return removed
             
 #insert_text(board_id, r, c)
 
 _db = ChunkDB()
-def save_chunk(cid: str, data: torch.Tensor)-> None:
-    _db.save_chunk(cid, data)
+@SAVE_CHUNK_SECONDS.timed
+def save_chunk(key: ChunkKey, data: torch.Tensor)-> None:
+    _db.save_chunk(key, data)
+
+@LOAD_CHUNK_SECONDS.timed
+def load_chunk(key: ChunkKey)-> Optional[torch.Tensor]:
+    return _db.load_chunk(key)
+
+def chunks_in_rect(x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[ChunkKey, torch.Tensor]]:
+    return _db.iter_chunks_in_rect(x0, y0, x1, y1)
 
-def load_chunk(cid: str)-> Optional[torch.Tensor]:
-    return _db.load_chunk(cid)
+def chunks_in_radius(cx: int, cy: int, radius: int) -> Iterator[Tuple[ChunkKey, torch.Tensor]]:
+    return _db.iter_chunks_in_radius(cx, cy, radius)
 
 def clear_player_bits_all()->None:
     _db.clear_player_bits_all()
 
-def _safe_load_messages() -> dict:
+def _safe_load_messages(path: Path | None = None) -> dict:
     """טוען את קובץ ההודעות בבטחה (גם אם ריק/מקולקל)."""
-    if not MESSAGES_JSON_PATH.exists():
+    path = path or MESSAGES_JSON_PATH
+    if not path.exists():
         return {}
     try:
-        with open(MESSAGES_JSON_PATH, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except (JSONDecodeError, ValueError):
         return {}
+
+def _write_messages(messages: dict, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(messages, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def fold_shard_messages() -> int:
+    """
+    מחזיר את message.shard-*.json לתוך message.json ומוחק אותם; מחזיר כמה קבצים מוזגו.
+    כל chunk שייך ל-shard אחד, כך שאין התנגשויות. להריץ רק כשאף game worker לא רץ.
+    """
+    parts = sorted(BASE_MESSAGES_JSON_PATH.parent.glob("message.shard-*.json"))
+    if not parts:
+        return 0
+    merged = _safe_load_messages(BASE_MESSAGES_JSON_PATH)
+    for part in parts:
+        merged.update(_safe_load_messages(part))
+    _write_messages(merged, BASE_MESSAGES_JSON_PATH)
+    for part in parts:
+        part.unlink()
+    return len(parts)
+
+def split_messages_by_shard(count: int, shard_for: Callable[[ChunkKey], int]) -> None:
+    """מחלק את message.json לקובץ לכל shard לפי בעלות על ה-chunk (לפני שה-workers עולים)."""
+    parts: List[dict] = [{} for _ in range(count)]
+    for location_key, message in _safe_load_messages(BASE_MESSAGES_JSON_PATH).items():
+        chunk_id = message.get("chunk_id") or location_key.rsplit("_", 2)[0]
+        parts[shard_for(key_from_id(chunk_id))][location_key] = message
+    for shard_id, messages in enumerate(parts):
+        _write_messages(messages, BASE_MESSAGES_JSON_PATH.with_name(f"message.shard-{shard_id}.json"))
 def save_message(message: Message) -> None:
     """שומר הודעה חדשה בקובץ JSON"""
     try:
@@ -107,10 +273,7 @@ def save_message(message: Message) -> None:
         messages[location_key] = message.to_dict()
 
         # כתיבה אטומית
-        tmp_path = MESSAGES_JSON_PATH.with_suffix(".tmp")
-        with open(tmp_path, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, indent=2, ensure_ascii=False)
-        os.replace(tmp_path, MESSAGES_JSON_PATH)
+        _write_messages(messages, MESSAGES_JSON_PATH)
 
         print(f"[DEBUG] Message saved successfully to {MESSAGES_JSON_PATH}")
     except Exception as e:
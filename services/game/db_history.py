@@ -3,8 +3,17 @@ import os, json, time
 from json import JSONDecodeError
 from pathlib import Path
 
+from .metrics import APPEND_ACTION_SECONDS
+
 BASE_ROOT_DIR = Path(os.path.dirname(os.path.abspath(__file__))).parents[1]  # תקני בהתאם למבנה שלך
-HISTORIES_JSON_PATH = BASE_ROOT_DIR / "data" / "history.json"
+BASE_HISTORIES_JSON_PATH = Path(os.getenv("GAME_DATA_DIR") or BASE_ROOT_DIR / "data") / "history.json"
+# append_player_action קורא וכותב את כל הקובץ, וזה לא בטוח בין תהליכים: עם GAME_SHARDS > 1
+# כל worker כותב לקובץ משלו, ו-fold_shard_histories ממזג אותם חזרה (כשאף worker לא רץ)
+HISTORIES_JSON_PATH = (
+    BASE_HISTORIES_JSON_PATH.with_name(f"history.shard-{os.getenv('GAME_SHARD_ID', '0')}.json")
+    if int(os.getenv("GAME_SHARDS", "1")) > 1 else BASE_HISTORIES_JSON_PATH
+)
+MAX_ACTIONS = 1000
 
 # === מיפוי טוקנים ===
 TOKEN_RIGHT = 1
@@ -17,21 +26,51 @@ TOKEN_SLEEP_1S = 7
 TOKEN_SLEEP_1M = 8
 TOKEN_SLEEP_1H = 9
 
-def _safe_load_histories() -> dict:
-    if not HISTORIES_JSON_PATH.exists():
+def _safe_load_histories(path: Path | None = None) -> dict:
+    path = path or HISTORIES_JSON_PATH
+    if not path.exists():
         return {}
     try:
-        with open(HISTORIES_JSON_PATH, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except (JSONDecodeError, ValueError):
         return {}
 
-def _atomic_write_histories(payload: dict) -> None:
-    HISTORIES_JSON_PATH.parent.mkdir(parents=True, exist_ok=True)
-    tmp_path = HISTORIES_JSON_PATH.with_suffix(".tmp")
+def _atomic_write_histories(payload: dict, path: Path | None = None) -> None:
+    path = path or HISTORIES_JSON_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
     with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(payload, f, indent=2, ensure_ascii=False)
-    os.replace(tmp_path, HISTORIES_JSON_PATH)
+    os.replace(tmp_path, path)
+
+def fold_shard_histories() -> int:
+    """
+    ממזג את history.shard-*.json של ה-workers לתוך history.json ומוחק אותם; מחזיר כמה קבצים מוזגו.
+    להריץ רק כשאף game worker לא רץ (ה-launcher עושה זאת לפני ואחרי).
+    """
+    parts = sorted(BASE_HISTORIES_JSON_PATH.parent.glob("history.shard-*.json"))
+    if not parts:
+        return 0
+    merged = _safe_load_histories(BASE_HISTORIES_JSON_PATH)
+    for part in parts:
+        for player_id, pdata in _safe_load_histories(part).items():
+            chunks = merged.setdefault(player_id, {}).setdefault("chunks", {})
+            for chunk_id, cdata in pdata.get("chunks", {}).items():
+                mine = chunks.get(chunk_id)
+                if mine is None:
+                    chunks[chunk_id] = cdata
+                    continue
+                # אותו שחקן באותו chunk בשני קבצים (מעבר בין shards): הישן קודם
+                first, second = sorted((mine, cdata), key=lambda c: c.get("last_ts") or 0)
+                chunks[chunk_id] = {
+                    "actions": (first.get("actions", []) + second.get("actions", []))[-MAX_ACTIONS:],
+                    "last_ts": second.get("last_ts"),
+                }
+    _atomic_write_histories(merged, BASE_HISTORIES_JSON_PATH)
+    for part in parts:
+        part.unlink()
+    return len(parts)
 
 def _append_sleep_tokens(actions: list[int], delta_seconds: int) -> None:
     if delta_seconds <= 0:
@@ -44,6 +83,7 @@ def _append_sleep_tokens(actions: list[int], delta_seconds: int) -> None:
     actions.extend([TOKEN_SLEEP_1M] * minutes)
     actions.extend([TOKEN_SLEEP_1S] * seconds)
 
+@APPEND_ACTION_SECONDS.timed
 def append_player_action(player_id: str, chunk_id: str, action_token: int, now_ts: int | None = None) -> None:
 
     now_ts = now_ts or int(time.time())
@@ -58,7 +98,7 @@ def append_player_action(player_id: str, chunk_id: str, action_token: int, now_t
         _append_sleep_tokens(cdata["actions"], delta)
 
     cdata["actions"].append(int(action_token))
-    if len(cdata["actions"]) > 1000:
-        cdata["actions"] = cdata["actions"][-1000:]
+    if len(cdata["actions"]) > MAX_ACTIONS:
+        cdata["actions"] = cdata["actions"][-MAX_ACTIONS:]
     cdata["last_ts"] = now_ts
     _atomic_write_histories(data)
@@ -1,19 +1,38 @@
 from __future__ import annotations
 import asyncio
+import heapq
 import json
 import logging
+import os
 import random
+import secrets
+import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Dict, Optional, Set, Tuple, Literal, TypedDict
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Literal, TypedDict
 import torch
 from fastapi import WebSocket
 
-from .settings import BIT_HAS_LINK, W, H, DTYPE, BIT_IS_PLAYER
-from .bits import set_bit, get_bit, make_color, with_player, without_player
-from .ids import chunk_id_from_coords, coords_from_chunk_id
+from .settings import BIT_HAS_LINK, W, H, DTYPE, BIT_IS_PLAYER, SPAWN_SEED, SPAWN_SEARCH_RADIUS, MAX_VIEW_RADIUS
+from .settings import PARKED_SESSION_TTL, RESUME_GRACE, CHUNK_CHANGE_LOG, IDLE_HIBERNATE_SECONDS
+from .settings import PACER_MIN_INTERVAL, PACER_MAX_INTERVAL
+from .bits import make_color, with_player_int, without_player_int, has_bit_int
+from .ids import (
+    ChunkKey, key_from_coords, coords_from_key, key_from_id, id_from_key, neighbor_key,
+)
 from .db import load_message, save_chunk, load_chunk, save_message
 from .models import Message
 from .players_db import get_player_position, save_player_position
+from .tokens import Claims
+from .occupancy import AllFree, FreeCells
+from .sharding import ShardMap, HandoffTicket, issue_handoff
+from .bus import ChunkBus, InProcessBus
+from .checkpoint import SessionRecord, read_checkpoint, write_checkpoint
+from .pacer import ClientPacer
+from .metrics import (
+    BROADCAST_SECONDS, BYTES_SENT, FRAMES_SENT, LOCK_HOLD_SECONDS, LOCK_WAIT_SECONDS, MOVE_SECONDS,
+    InstrumentedLock,
+)
 
 from services.game.db_history import (
     append_player_action,
@@ -27,18 +46,53 @@ if not LOGGER.handlers:
 
 Direction = Literal["up", "down", "left", "right"]
 
-@dataclass(frozen=True)
-class Coord:
-    row: int
-    col: int
+class Session:
+    """
+    Everything the hub keeps for one socket. Cells are plain board values (ints), not
+    tensors; ``chunk_key`` is None until the player has been placed.
+    """
+    __slots__ = ("ws", "user_id", "chunk_key", "row", "col", "visible", "underlying", "color",
+                 "view_radius", "subs", "resume_id", "last_msg_pos", "last_input", "hibernating", "pacer")
+
+    def __init__(self, ws: WebSocket, pacer: ClientPacer) -> None:
+        self.ws = ws
+        self.pacer = pacer  # chunk frames to this socket go through it
+        self.user_id: Optional[str] = None
+        self.chunk_key: Optional[ChunkKey] = None
+        self.row = 0
+        self.col = 0
+        self.visible = 0
+        self.underlying = 0
+        self.color = 0
+        self.view_radius = 0
+        self.subs: Tuple[ChunkKey, ...] = ()  # chunks in the area of interest
+        self.resume_id: Optional[str] = None
+        self.last_msg_pos: Optional[Tuple[ChunkKey, int, int]] = None
+        self.last_input = time.monotonic()
+        self.hibernating = False
+
+    def place(self, chunk_key: ChunkKey, row: int, col: int, visible: int, underlying: int) -> None:
+        self.chunk_key, self.row, self.col = chunk_key, row, col
+        self.visible, self.underlying = visible, underlying
 
 @dataclass
-class PlayerState:
-    chunk_id: str
-    pos: Coord
-    visible_cell: torch.Tensor
-    underlying_cell: torch.Tensor
-    color: torch.Tensor
+class ParkedSession:
+    session: SessionRecord
+    deadline: float
+    resume_id: Optional[str] = None  # None when restored from a checkpoint
+
+@dataclass(frozen=True)
+class ResumeRequest:
+    """What a reconnecting client remembers: its resume token and the last chunk version it applied."""
+    token: str
+    chunk_id: Optional[str] = None
+    version: int = -1
+
+class HandedOff(Exception):
+    """A connecting player lives on another shard; its socket was already sent the handoff frame."""
+
+# (socket, verified claims, handoff ticket, resume request) of a socket waiting to be placed
+Connecting = Tuple[WebSocket, Optional[Claims], Optional[HandoffTicket], Optional[ResumeRequest]]
 
 class MatrixPayload(TypedDict):
     type: Literal["matrix"]
@@ -46,131 +100,583 @@ class MatrixPayload(TypedDict):
     h: int
     data: list[int]
     chunk_id: str
+    version: int
     total_players: int
 
+class DeltaPayload(TypedDict):
+    type: Literal["delta"]
+    chunk_id: str
+    since: int
+    version: int
+    cells: list[list[int]]  # [flat index, value]
+
+class ViewportPayload(TypedDict):
+    type: Literal["viewport"]
+    center: str
+    radius: int
+    subscribed: list[str]
+    unsubscribed: list[str]
+
 class Hub:
-    def __init__(self) -> None:
-        self._chunks: Dict[str, torch.Tensor] = {}
-        self._chunk_watchers: Dict[str, Set[WebSocket]] = {}
-        self._root_chunk_id = chunk_id_from_coords(0, 0)
-        self._ensure_chunk(self._root_chunk_id)
-        self._sockets: Set[WebSocket] = set()
-        self._state_by_ws: Dict[WebSocket, PlayerState] = {}
-        self._last_msg_pos_by_ws: Dict[WebSocket, Optional[Tuple[str, int, int]]] = {}
-        self._lock = asyncio.Lock()
-
-    def _ensure_chunk(self, chunk_id: str) -> torch.Tensor:
-        if chunk_id in self._chunks:
-            return self._chunks[chunk_id]
-        board = load_chunk(chunk_id)
+    def __init__(self, shard_map: Optional[ShardMap] = None, shard_id: int = 0,
+                 bus: Optional[ChunkBus] = None) -> None:
+        self._shard_map = shard_map
+        self._shard_id = shard_id
+        # matrix frames go out through the bus, so watchers may sit behind another hub
+        self._bus = bus if bus is not None else InProcessBus()
+        self._background: Set[asyncio.Task] = set()
+        self._chunks: Dict[ChunkKey, torch.Tensor] = {}
+        self._free: Dict[ChunkKey, FreeCells | AllFree] = {}
+        self._rng = random.Random(SPAWN_SEED)
+        # per-chunk membership: the sessions whose area of interest contains the chunk. Idle
+        # sessions sit in _dormant instead and are left out of the fan-out until they wake up
+        self._chunk_watchers: Dict[ChunkKey, Set[Session]] = {}
+        self._dormant: Dict[ChunkKey, Set[Session]] = {}
+        # every chunk that has no row in world.db shares this board until something is written
+        # to it; nothing may mutate it in place (_ensure_chunk hands out private copies)
+        self._empty = torch.zeros((H, W), dtype=DTYPE)
+        self._all_free = AllFree(H, W)  # the free-cell index that goes with _empty
+        self._root_chunk_key = key_from_coords(0, 0)
+        if self.owns(self._root_chunk_key):
+            self._chunk(self._root_chunk_key)
+        # one registry for every attached socket, placed or still being placed
+        self._sessions: Dict[WebSocket, Session] = {}
+        # players cut off by a server restart: their cell stays taken until they reconnect or the deadline passes.
+        # One user may have several tabs parked at once, each holding its own cell
+        self._parked: Dict[str, List[ParkedSession]] = {}
+        # every _save bumps the chunk's version and logs the cells it changed, for delta catch-up
+        self._versions: Dict[ChunkKey, int] = {}
+        self._changes: Dict[ChunkKey, Deque[Tuple[int, List[Tuple[int, int]]]]] = {}
+        self._lock = InstrumentedLock(LOCK_WAIT_SECONDS, LOCK_HOLD_SECONDS)
+
+    def socket_count(self) -> int:
+        return len(self._sessions)
+
+    def parked_count(self) -> int:
+        return sum(len(parked) for parked in self._parked.values())
+
+    def loaded_chunk_count(self) -> int:
+        """Chunks with a board of their own in memory (empty ones share ``_empty``)."""
+        return sum(1 for board in self._chunks.values() if board is not self._empty)
+
+    def watched_chunk_count(self) -> int:
+        return len(self._chunk_watchers)
+
+    def watch_count(self) -> int:
+        """Chunk subscriptions of awake local sockets, summed over chunks."""
+        return sum(len(watchers) for watchers in self._chunk_watchers.values())
+
+    def watcher_counts(self, limit: int) -> Dict[str, int]:
+        """Watcher count of the ``limit`` most watched chunks."""
+        top = heapq.nlargest(limit, self._chunk_watchers.items(), key=lambda item: len(item[1]))
+        return {id_from_key(key): len(watchers) for key, watchers in top}
+
+    def hibernating_count(self) -> int:
+        return sum(1 for session in self._sessions.values() if session.hibernating)
+
+    def _placed(self, ws: WebSocket) -> Optional[Session]:
+        """The session of ``ws`` once its player is on the board."""
+        session = self._sessions.get(ws)
+        return session if session is not None and session.chunk_key is not None else None
+
+    def lock_holder(self) -> Optional[str]:
+        """Name of the Hub method inside ``async with self._lock`` right now, if any."""
+        return self._lock.holder
+
+    def owns(self, chunk_key: ChunkKey) -> bool:
+        return self._shard_map is None or self._shard_map.shard_for(chunk_key) == self._shard_id
+
+    def _chunk(self, chunk_key: ChunkKey) -> torch.Tensor:
+        """Read-only board of an owned chunk; a chunk missing from the database is the shared zero board."""
+        board = self._chunks.get(chunk_key)
         if board is None:
-            board = torch.zeros((H, W), dtype=DTYPE)
-            save_chunk(chunk_id, board)
-        self._chunks[chunk_id] = board
+            board = load_chunk(chunk_key)
+            if board is None:
+                board = self._empty
+                self._free[chunk_key] = self._all_free
+            else:
+                self._free[chunk_key] = FreeCells.from_board(board, BIT_IS_PLAYER)
+            self._chunks[chunk_key] = board
         return board
 
-    @staticmethod
-    def _is_empty_cell(board: torch.Tensor, r: int, c: int) -> bool:
-        return int(get_bit(board[r, c], BIT_IS_PLAYER)) == 0
+    def _ensure_chunk(self, chunk_key: ChunkKey) -> torch.Tensor:
+        """Board of an owned chunk that the caller is about to modify (and then ``_save``)."""
+        board = self._chunk(chunk_key)
+        if board is self._empty:
+            board = self._chunks[chunk_key] = self._empty.clone()
+            self._free[chunk_key] = FreeCells(range(H * W), H, W)
+        return board
+
+    def _save(self, chunk_key: ChunkKey, board: torch.Tensor, cells: Iterable[Tuple[int, int]]) -> None:
+        """Persists ``board`` after the caller changed ``cells`` (row, col) in it."""
+        version = self._versions[chunk_key] = self._versions.get(chunk_key, 0) + 1
+        log = self._changes.get(chunk_key)
+        if log is None:
+            log = self._changes[chunk_key] = deque(maxlen=CHUNK_CHANGE_LOG)
+        log.append((version, [(r * W + c, int(board[r, c])) for r, c in cells]))
+        # an all-zero board is not stored (ChunkDB drops its row) and goes back to sharing _empty
+        if not bool(board.any()):
+            self._chunks[chunk_key] = self._empty
+            self._free[chunk_key] = self._all_free
+        save_chunk(chunk_key, board)
+
+    def _delta(self, chunk_key: ChunkKey, since: int) -> Optional[DeltaPayload]:
+        """Cells changed after version ``since``, or None when the change log no longer reaches back that far."""
+        version = self._versions.get(chunk_key, 0)
+        log = self._changes.get(chunk_key, ())
+        if since > version or (since < version and (not log or log[0][0] > since + 1)):
+            return None
+        cells: Dict[int, int] = {}
+        for v, changed in log:
+            if v > since:
+                cells.update(changed)
+        return {
+            "type": "delta",
+            "chunk_id": id_from_key(chunk_key),
+            "since": since,
+            "version": version,
+            "cells": [[i, value] for i, value in sorted(cells.items())],
+        }
 
-    def _random_empty_cell(self, board: torch.Tensor) -> Coord:##??
-        for _ in range(4096):
-            r = random.randrange(H)
-            c = random.randrange(W)
-            if self._is_empty_cell(board, r, c):
-                return Coord(r, c)
-        return Coord(H // 2, W // 2)
+    def _is_free(self, chunk_key: ChunkKey, r: int, c: int) -> bool:
+        self._chunk(chunk_key)
+        return 0 <= r < H and 0 <= c < W and self._free[chunk_key].is_free(r, c)
+
+    def _random_empty_cell(self, chunk_key: ChunkKey) -> Optional[Tuple[int, int]]:
+        self._chunk(chunk_key)
+        free = self._free[chunk_key]
+        if not len(free):
+            return None
+        return free.pick(self._rng)
+
+    def _spawn_point(self, chunk_key: ChunkKey) -> Tuple[ChunkKey, int, int]:
+        spawn = self._random_empty_cell(chunk_key)
+        if spawn is not None:
+            return (chunk_key, *spawn)
+        # chunk is full: walk outward ring by ring until some chunk has room
+        cx, cy = coords_from_key(chunk_key)
+        for radius in range(1, SPAWN_SEARCH_RADIUS + 1):
+            for dy in range(-radius, radius + 1):
+                for dx in range(-radius, radius + 1):
+                    if max(abs(dx), abs(dy)) != radius:
+                        continue
+                    candidate = key_from_coords(cx + dx, cy + dy)
+                    if not self.owns(candidate):
+                        continue
+                    spawn = self._random_empty_cell(candidate)
+                    if spawn is not None:
+                        return (candidate, *spawn)
+        raise RuntimeError(f"no free cell within {SPAWN_SEARCH_RADIUS} chunks of {id_from_key(chunk_key)}")
 
     @staticmethod
-    def _neighbor_chunk_id(chunk_id: str, direction: Direction) -> str:
-        cx, cy = coords_from_chunk_id(chunk_id)
+    def _neighbor_chunk_key(chunk_key: ChunkKey, direction: Direction) -> ChunkKey:
         if direction == "up":
-            cy -= 1
-        elif direction == "down":
-            cy += 1
-        elif direction == "left":
-            cx -= 1
-        else:
-            cx += 1
-        return chunk_id_from_coords(cx, cy)
+            return neighbor_key(chunk_key, 0, -1)
+        if direction == "down":
+            return neighbor_key(chunk_key, 0, 1)
+        if direction == "left":
+            return neighbor_key(chunk_key, -1, 0)
+        return neighbor_key(chunk_key, 1, 0)
+
+    @staticmethod
+    def _interest(center: ChunkKey, radius: int) -> Set[ChunkKey]:
+        cx, cy = coords_from_key(center)
+        return {
+            key_from_coords(cx + dx, cy + dy)
+            for dy in range(-radius, radius + 1)
+            for dx in range(-radius, radius + 1)
+        }
+
+    def _resubscribe(self, session: Session, center: ChunkKey) -> Tuple[List[ChunkKey], List[ChunkKey]]:
+        """Moves the session's area of interest to ``center``; returns (added, removed) chunk keys."""
+        # another shard's chunks are only visible when its updates can reach us over the bus
+        wanted = {cid for cid in self._interest(center, session.view_radius) if self.owns(cid) or self._bus.shared}
+        current = set(session.subs)
+        added = sorted(wanted - current)
+        removed = sorted(current - wanted)
+        for cid in removed:
+            self._unwatch(session, cid)
+        for cid in added:
+            if self.owns(cid):
+                self._chunk(cid)
+            self._watch(session, cid)
+        session.subs = tuple(wanted)
+        return added, removed
+
+    def _unsubscribe_all(self, session: Session) -> None:
+        for cid in session.subs:
+            self._unwatch(session, cid)
+        session.subs = ()
+
+    def _watch(self, session: Session, chunk_key: ChunkKey) -> None:
+        # the bus subscription lasts while anyone, awake or not, has the chunk in view
+        if chunk_key not in self._chunk_watchers and chunk_key not in self._dormant:
+            self._bus.subscribe(chunk_key, self._deliver)
+        members = self._dormant if session.hibernating else self._chunk_watchers
+        members.setdefault(chunk_key, set()).add(session)
+
+    def _unwatch(self, session: Session, chunk_key: ChunkKey) -> None:
+        for members in (self._chunk_watchers, self._dormant):
+            sessions = members.get(chunk_key)
+            if sessions is not None:
+                sessions.discard(session)
+                if not sessions:
+                    del members[chunk_key]
+        if chunk_key not in self._chunk_watchers and chunk_key not in self._dormant:
+            self._bus.unsubscribe(chunk_key, self._deliver)
+
+    def _set_hibernating(self, session: Session, hibernating: bool) -> None:
+        """Moves the session between the live and dormant member sets of every chunk it watches."""
+        source, target = (self._chunk_watchers, self._dormant) if hibernating else (self._dormant, self._chunk_watchers)
+        for chunk_key in session.subs:
+            sessions = source.get(chunk_key)
+            if sessions is not None:
+                sessions.discard(session)
+                if not sessions:
+                    del source[chunk_key]
+            target.setdefault(chunk_key, set()).add(session)
+        session.hibernating = hibernating
+
+    async def hibernate_idle(self, now: Optional[float] = None) -> int:
+        """Takes sockets idle for ``IDLE_HIBERNATE_SECONDS`` out of the chunk fan-out; returns how many."""
+        if IDLE_HIBERNATE_SECONDS <= 0:
+            return 0
+        cutoff = (time.monotonic() if now is None else now) - IDLE_HIBERNATE_SECONDS
+        async with self._lock:
+            idle = [
+                session for session in self._sessions.values()
+                if session.chunk_key is not None and not session.hibernating and session.last_input <= cutoff
+            ]
+            for session in idle:
+                self._set_hibernating(session, True)
+        for session in idle:
+            try:
+                await self._send(session.ws, json.dumps({"type": "hibernate"}))
+            except Exception as e:
+                LOGGER.debug("send hibernate failed: %r", e)
+                self._drop_later(session.ws)
+        return len(idle)
+
+    async def touch(self, ws: WebSocket) -> None:
+        """Records input from ``ws``; a hibernating socket wakes up with a fresh matrix of every chunk it watches."""
+        session = self._placed(ws)
+        if session is None:
+            return
+        session.last_input = time.monotonic()
+        if not session.hibernating:
+            return
+        self._set_hibernating(session, False)
+        keys = [session.chunk_key] + [key for key in session.subs if key != session.chunk_key]
+        try:
+            for key in keys:
+                await self._send_matrix(session, key)
+        except Exception as e:
+            LOGGER.debug("send wake-up snapshot failed: %r", e)
+
+    async def send_summaries(self) -> int:
+        """One small frame per hibernating socket: its chunk's version and the player count."""
+        texts: Dict[ChunkKey, str] = {}
+        sent = 0
+        for session in [s for s in self._sessions.values() if s.hibernating]:
+            text = texts.get(session.chunk_key)
+            if text is None:
+                text = texts[session.chunk_key] = json.dumps({
+                    "type": "summary",
+                    "chunk_id": id_from_key(session.chunk_key),
+                    "version": self._versions.get(session.chunk_key, 0),
+                    "total_players": len(self._sessions),
+                })
+            try:
+                await self._send(session.ws, text)
+                sent += 1
+            except Exception as e:
+                LOGGER.debug("send summary failed: %r", e)
+                self._drop_later(session.ws)
+        return sent
+
+    async def _send_viewport(self, session: Session, center: ChunkKey, added: Iterable[ChunkKey],
+                             removed: Iterable[ChunkKey], skip: Iterable[ChunkKey] = ()) -> None:
+        """Sends the subscription diff plus a matrix for every newly visible chunk not in ``skip``."""
+        if session.view_radius == 0:
+            return
+        ws = session.ws
+        payload: ViewportPayload = {
+            "type": "viewport",
+            "center": id_from_key(center),
+            "radius": session.view_radius,
+            "subscribed": [id_from_key(key) for key in added],
+            "unsubscribed": [id_from_key(key) for key in removed],
+        }
+        try:
+            await self._send(ws, json.dumps(payload))
+            skipped = set(skip)
+            for key in added:
+                if key not in skipped:
+                    await self._send_matrix(session, key)
+        except Exception as e:
+            LOGGER.debug("send viewport failed: %r", e)
 
-    async def connect(self, ws: WebSocket) -> None:
-        self._sockets.add(ws)
+    async def set_view_radius(self, ws: WebSocket, radius: int) -> None:
         async with self._lock:
-            chunk_id = self._root_chunk_id
-            board = self._ensure_chunk(chunk_id)
-            # spawn = self._random_empty_cell(board)
-            
-            from jose import jwt
-            from .main import JWT_ALG, JWT_SECRET
-            token = ws.query_params.get("token")
-            user_id = "unknown"
-            if token:
+            session = self._placed(ws)
+            if not session:
+                return
+            session.view_radius = max(0, min(int(radius), MAX_VIEW_RADIUS))
+            added, removed = self._resubscribe(session, session.chunk_key)
+            await self._send_viewport(session, session.chunk_key, added, removed)
+
+    async def connect(self, ws: WebSocket, claims: Optional[Claims] = None,
+                      handoff: Optional[HandoffTicket] = None, resume: Optional[ResumeRequest] = None) -> None:
+        error = (await self.connect_batch([(ws, claims, handoff, resume)], site="connect"))[0]
+        if error is not None:
+            raise error
+
+    async def connect_batch(self, entries: List[Connecting], site: str = "connect_batch") -> List[Optional[Exception]]:
+        """
+        Places a batch of new sockets under one lock hold, then saves and broadcasts each
+        touched chunk once (a reconnect storm spawns many players into the same few chunks).
+        Returns, per entry, the exception that kept it out or None.
+        """
+        errors: List[Optional[Exception]] = []
+        touched: Dict[ChunkKey, List[Tuple[int, int]]] = {}
+        for ws, _, _, _ in entries:
+            self._sessions[ws] = Session(ws, ClientPacer(ws, self._send, self._drop_later,
+                                                         PACER_MIN_INTERVAL, PACER_MAX_INTERVAL))
+        async with self._lock.at(site):
+            for ws, claims, handoff, resume in entries:
+                session = self._sessions[ws]
                 try:
-                    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-                    user_id = payload.get("sub") or payload.get("id") or "unknown"
-                except Exception:
-                    LOGGER.error("failed to find id by the token")
-            pos = get_player_position(user_id)
-            if pos:
-                chunk_id, row, col = pos
-                board = self._ensure_chunk(chunk_id)
-                if self._is_empty_cell(board, row, col):
-                    spawn = Coord(row, col)
-                else:
-                    spawn = self._random_empty_cell(board)
-            else:
-                chunk_id = self._root_chunk_id
-                board = self._ensure_chunk(chunk_id)
-                spawn = self._random_empty_cell(board)
-                
+                    await self._place(session, claims, handoff, resume, touched)
+                    errors.append(None)
+                except Exception as e:
+                    self._unsubscribe_all(session)
+                    session.pacer.close()
+                    self._sessions.pop(ws, None)
+                    errors.append(e)
+            for chunk_key, cells in touched.items():
+                self._save(chunk_key, self._chunks[chunk_key], cells)
+        for chunk_key in touched:
+            await self._broadcast_chunk(chunk_key)
+        return errors
+
+    async def _place(self, session: Session, claims: Optional[Claims], handoff: Optional[HandoffTicket],
+                     resume: Optional[ResumeRequest], touched: Dict[ChunkKey, List[Tuple[int, int]]]) -> None:
+        """Puts one connecting player on the board; cells it changes go into ``touched``. Caller holds the lock."""
+        # the token was already verified by the endpoint; nothing to decode under the lock
+        user_id = session.user_id = claims.user_id if claims else "unknown"
+        parked = self._unpark(user_id, resume) if handoff is None else None
+        if parked is not None:
+            # the board did not change, so only this socket needs to hear about it
+            chunk_key = self._resume(session, parked.session)
+            await self._send_session(session)
+            await self._catch_up(session, chunk_key, parked, resume)
+            return
+        if handoff is not None and handoff.user_id == user_id:
+            pos: Optional[Tuple[ChunkKey, int, int]] = (key_from_id(handoff.chunk_id), handoff.row, handoff.col)
+            color = handoff.color
+        else:
+            saved = get_player_position(user_id)
+            pos = (key_from_id(saved[0]), saved[1], saved[2]) if saved else None
             pr, pg, pb = (random.randint(0, 3) for _ in range(3))
-            color = make_color(pr, pg, pb)
-            underlying = without_player(board[spawn.row, spawn.col])
-            visible = with_player(color)
-            board[spawn.row, spawn.col] = visible
-            save_chunk(chunk_id, board)
-            self._state_by_ws[ws] = PlayerState(chunk_id, spawn, visible.clone(), underlying, color)
-            
-            if not hasattr(self,"_user_id_by_ws"):
-                self._user_id_by_ws ={}
-            self._user_id_by_ws[ws] = user_id
-            save_player_position(user_id, chunk_id, spawn.row, spawn.col)
-           
-            self._chunk_watchers.setdefault(chunk_id, set()).add(ws)
-        await self._broadcast_chunk(chunk_id)
+            color = int(make_color(pr, pg, pb))
+
+        preferred = pos[0] if pos else self._root_chunk_key
+        if not self.owns(preferred):
+            # the player lives on another shard; send them there without touching our world
+            # (connect_batch forgets the session, the endpoint closes the socket)
+            row, col = (pos[1], pos[2]) if pos else (H // 2, W // 2)
+            await self._send_handoff(session.ws, HandoffTicket(user_id, id_from_key(preferred), row, col, color))
+            raise HandedOff(f"chunk {id_from_key(preferred)} belongs to another shard")
+
+        if pos and self._is_free(*pos):
+            chunk_key, row, col = pos
+        else:
+            chunk_key, row, col = self._spawn_point(preferred)
+        board = self._ensure_chunk(chunk_key)
+
+        visible = with_player_int(color)
+        session.color = color
+        session.place(chunk_key, row, col, visible, without_player_int(int(board[row, col])))
+        board[row, col] = visible
+        self._free[chunk_key].occupy(row, col)
+        touched.setdefault(chunk_key, []).append((row, col))
+        save_player_position(user_id, id_from_key(chunk_key), row, col)
+
+        self._resubscribe(session, chunk_key)
+        await self._send_session(session)
+
+    def _unpark(self, user_id: str, resume: Optional[ResumeRequest]) -> Optional[ParkedSession]:
+        """Takes one of the user's parked sessions: the one the resume token names, else the oldest."""
+        parked = self._parked.get(user_id)
+        if not parked:
+            return None
+        index = 0
+        if resume is not None:
+            for i, p in enumerate(parked):
+                if p.resume_id is not None and secrets.compare_digest(resume.token, p.resume_id):
+                    index = i
+                    break
+        taken = parked.pop(index)
+        if not parked:
+            del self._parked[user_id]
+        return taken
+
+    def _resume(self, session: Session, parked: SessionRecord) -> ChunkKey:
+        """Puts a parked player back on the socket; its cell never stopped being taken. Caller holds the lock."""
+        board = self._ensure_chunk(parked.key)
+        session.color = parked.color
+        session.place(parked.key, parked.row, parked.col, int(board[parked.row, parked.col]), parked.underlying)
+        self._resubscribe(session, parked.key)
+        return parked.key
+
+    async def _send_session(self, session: Session) -> None:
+        """Hands the client a fresh resume token; unknown users cannot resume, so they get none."""
+        if session.user_id == "unknown":
+            return
+        token = session.resume_id = secrets.token_urlsafe(16)
+        try:
+            await self._send(session.ws, json.dumps({"type": "session", "resume": token, "grace": RESUME_GRACE}))
+        except Exception as e:
+            LOGGER.debug("send session failed: %r", e)
+
+    async def _catch_up(self, session: Session, chunk_key: ChunkKey, parked: ParkedSession,
+                        resume: Optional[ResumeRequest]) -> None:
+        """Sends a resumed socket what it missed: a delta when its token and version allow, else the matrix."""
+        delta = None
+        if (resume is not None and parked.resume_id is not None
+                and secrets.compare_digest(resume.token, parked.resume_id)
+                and resume.chunk_id == id_from_key(chunk_key)):
+            delta = self._delta(chunk_key, resume.version)
+        try:
+            if delta is not None:
+                await session.pacer.send_now(chunk_key, json.dumps(delta))
+            else:
+                await self._send_matrix(session, chunk_key)
+        except Exception as e:
+            LOGGER.debug("send catch-up failed: %r", e)
+
+    def _park_state(self, ws: WebSocket, deadline: float) -> Optional[SessionRecord]:
+        """Forgets the socket but leaves its player on the board. Caller holds the lock."""
+        session = self._placed(ws)
+        if session is None or not session.user_id or session.user_id == "unknown":
+            # nobody could ever claim it back
+            self._detach(ws)
+            return None
+        del self._sessions[ws]
+        self._unsubscribe_all(session)
+        session.pacer.close()
+        record = SessionRecord(session.user_id, session.chunk_key, session.row, session.col,
+                               session.color, session.underlying)
+        self._parked.setdefault(session.user_id, []).append(ParkedSession(record, deadline, session.resume_id))
+        save_player_position(session.user_id, id_from_key(session.chunk_key), session.row, session.col, flush=True)
+        return record
+
+    async def park(self, ws: WebSocket, grace: float = PARKED_SESSION_TTL) -> None:
+        """Like ``disconnect``, but the player keeps its cell for ``grace`` seconds in case it comes back."""
+        async with self._lock:
+            self._park_state(ws, time.monotonic() + grace)
+
+    async def expire_parked(self, now: Optional[float] = None) -> int:
+        if not self._parked:
+            return 0
+        now = time.monotonic() if now is None else now
+        async with self._lock:
+            expired: List[SessionRecord] = []
+            for user_id in list(self._parked):
+                parked = self._parked[user_id]
+                expired.extend(p.session for p in parked if p.deadline <= now)
+                parked[:] = [p for p in parked if p.deadline > now]
+                if not parked:
+                    del self._parked[user_id]
+            for session in expired:
+                board = self._ensure_chunk(session.key)
+                board[session.row, session.col] = session.underlying
+                self._free[session.key].release(session.row, session.col)
+                self._save(session.key, board, [(session.row, session.col)])
+            for chunk_key in {session.key for session in expired}:
+                await self._broadcast_chunk(chunk_key)
+        return len(expired)
+
+    async def save_checkpoint(self, path) -> int:
+        """Parks every connected player and writes them with the loaded chunks; returns the session count."""
+        async with self._lock:
+            deadline = time.monotonic() + PARKED_SESSION_TTL
+            for ws in [ws for ws, session in self._sessions.items() if session.chunk_key is not None]:
+                self._park_state(ws, deadline)
+            sessions = [p.session for parked in self._parked.values() for p in parked]
+            chunks = {key: board for key, board in self._chunks.items() if board is not self._empty}
+            write_checkpoint(path, W, H, chunks, sessions)
+        LOGGER.info("Checkpoint: %d chunks, %d sessions -> %s", len(chunks), len(sessions), path)
+        return len(sessions)
+
+    def restore_checkpoint(self, path) -> bool:
+        """Warms the chunk cache and parks the sessions of a checkpoint, then deletes it. Call before serving."""
+        try:
+            chunks, sessions = read_checkpoint(path, W, H)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Ignoring checkpoint %s: %r", path, e)
+            return False
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        for key, board in chunks.items():
+            if self.owns(key):
+                self._chunks[key] = board
+                self._free[key] = FreeCells.from_board(board, BIT_IS_PLAYER)
+        deadline = time.monotonic() + PARKED_SESSION_TTL
+        for session in sessions:
+            if session.key in self._chunks:
+                self._parked.setdefault(session.user_id, []).append(ParkedSession(session, deadline))
+                self._free[session.key].occupy(session.row, session.col)
+        # world.db may have been cleared by a launcher since; make the parked players visible there too
+        for chunk_key in {p.session.key for parked in self._parked.values() for p in parked}:
+            save_chunk(chunk_key, self._chunks[chunk_key])
+        LOGGER.info("Restored checkpoint: %d chunks, %d parked sessions", len(chunks), self.parked_count())
+        return True
+
+    def _detach(self, ws: WebSocket) -> Optional[Session]:
+        """Takes the player off its cell and forgets the socket; returns the session if it was placed. Caller holds the lock."""
+        session = self._sessions.pop(ws, None)
+        if session is None:
+            return None
+        self._unsubscribe_all(session)
+        session.pacer.close()
+        if session.chunk_key is None:
+            return None
+        board = self._ensure_chunk(session.chunk_key)
+        board[session.row, session.col] = session.underlying
+        self._free[session.chunk_key].release(session.row, session.col)
+        self._save(session.chunk_key, board, [(session.row, session.col)])
+        return session
+
+    async def _send_handoff(self, ws: WebSocket, ticket: HandoffTicket) -> None:
+        shard = self._shard_map.shard_for(key_from_id(ticket.chunk_id)) if self._shard_map else self._shard_id
+        try:
+            await self._send(ws, json.dumps({"type": "handoff", "shard": shard, "ticket": issue_handoff(ticket)}))
+        except Exception as e:
+            LOGGER.debug("send handoff failed: %r", e)
 
     async def disconnect(self, ws: WebSocket) -> None:
-        prev_chunk_id: Optional[str] = None
+        prev_chunk_key: Optional[ChunkKey] = None
         async with self._lock:
-            state = self._state_by_ws.pop(ws, None)
-            if state:
-                board = self._ensure_chunk(state.chunk_id)
-                board[state.pos.row, state.pos.col] = state.underlying_cell
-                save_chunk(state.chunk_id, board)
-                watchers = self._chunk_watchers.get(state.chunk_id, set())
-                watchers.discard(ws)
-                prev_chunk_id = state.chunk_id
-            
-            self._last_msg_pos_by_ws.pop(ws, None)
-            self._sockets.discard(ws)
-       
-        if hasattr(self, "_user_id_by_ws"):
-            user_id = self._user_id_by_ws.get(ws)
-            state = self._state_by_ws.get(ws)
-        if user_id and state:
-            save_player_position(user_id, state.chunk_id, state.pos.row, state.pos.col)
-        
-        if hasattr(self, "_user_id_by_ws") and ws in self._user_id_by_ws:
-            del self._user_id_by_ws
-            
-        if prev_chunk_id:
-            await self._broadcast_chunk(prev_chunk_id)
+            session = self._placed(ws)
+            if session and session.user_id:
+                save_player_position(session.user_id, id_from_key(session.chunk_key), session.row, session.col, flush=True)
+            if self._detach(ws):
+                prev_chunk_key = session.chunk_key
+
+        if prev_chunk_key is not None:
+            await self._broadcast_chunk(prev_chunk_key)
 
+    @MOVE_SECONDS.timed
     async def move(self, ws: WebSocket, dr: int, dc: int) -> None:
         async with self._lock:
-            state = self._state_by_ws[ws]
-            board = self._ensure_chunk(state.chunk_id)
+            session = self._sessions[ws]
+            board = self._ensure_chunk(session.chunk_key)
 
             if dr == 0 and dc == 1:
                 tok = TOKEN_RIGHT
@@ -181,36 +687,28 @@ class Hub:
             else:
                 tok = TOKEN_DOWN
 
-            nr, nc = state.pos.row + dr, state.pos.col + dc
+            nr, nc = session.row + dr, session.col + dc
 
             if 0 <= nr < H and 0 <= nc < W:
-                if self._is_empty_cell(board, nr, nc):
-                    board[state.pos.row, state.pos.col] = state.underlying_cell
-                    dest_before = board[nr, nc]
-                    new_underlying = without_player(dest_before)
-                    new_visible = with_player(state.color)
-                    if get_bit(dest_before, BIT_HAS_LINK):
-                        new_visible = set_bit(new_visible, BIT_HAS_LINK, True)
+                if self._is_free(session.chunk_key, nr, nc):
+                    board[session.row, session.col] = session.underlying
+                    self._free[session.chunk_key].release(session.row, session.col)
+                    dest_before = int(board[nr, nc])
+                    new_visible = with_player_int(session.color) | (dest_before & (1 << BIT_HAS_LINK))
                     board[nr, nc] = new_visible
-                    save_chunk(state.chunk_id, board)
+                    self._free[session.chunk_key].occupy(nr, nc)
+                    self._save(session.chunk_key, board, [(session.row, session.col), (nr, nc)])
 
-                    state.pos = Coord(nr, nc)
-                    state.underlying_cell = new_underlying
-                    state.visible_cell = new_visible
+                    session.place(session.chunk_key, nr, nc, new_visible, without_player_int(dest_before))
 
-                    append_player_action(self._player_id(ws), state.chunk_id, tok)
+                    append_player_action(self._player_id(ws), id_from_key(session.chunk_key), tok)
 
-                    await self._broadcast_chunk(state.chunk_id)
-                    await self._maybe_send_message_at(ws)
-                    
-                    user_id = self._user_id_by_ws.get(ws)
+                    if session.user_id:
+                        save_player_position(session.user_id, id_from_key(session.chunk_key), session.row, session.col)
 
-                    if user_id:
-                        save_player_position(user_id, state.chunk_id, state.pos.row, state.pos.col)
+                    await self._broadcast_chunk(session.chunk_key)
+                    await self._maybe_send_message_at(ws)
                 return
-            user_id = self._user_id_by_ws.get(ws)
-            if user_id:
-                save_player_position(user_id,state.chunk_id, state.pos.row, state.pos.col)
            
             if nr < 0:
                 direction: Direction = "up"
@@ -221,122 +719,180 @@ class Hub:
             else:
                 direction = "right"
 
-            new_chunk_id = self._neighbor_chunk_id(state.chunk_id, direction)
-            new_board = self._ensure_chunk(new_chunk_id)
+            new_chunk_key = self._neighbor_chunk_key(session.chunk_key, direction)
 
             if direction == "up":
-                target = Coord(H - 1, state.pos.col)
+                tr, tc = H - 1, session.col
             elif direction == "down":
-                target = Coord(0, state.pos.col)
+                tr, tc = 0, session.col
             elif direction == "left":
-                target = Coord(state.pos.row, W - 1)
+                tr, tc = session.row, W - 1
             else:
-                target = Coord(state.pos.row, 0)
+                tr, tc = session.row, 0
+
+            if not self.owns(new_chunk_key):
+                user_id = session.user_id or self._player_id(ws)
+                append_player_action(self._player_id(ws), id_from_key(new_chunk_key), tok)
+                save_player_position(user_id, id_from_key(new_chunk_key), tr, tc, flush=True)
+                old_chunk = session.chunk_key
+                self._detach(ws)
+                await self._send_handoff(
+                    ws, HandoffTicket(user_id, id_from_key(new_chunk_key), tr, tc, session.color)
+                )
+                await self._broadcast_chunk(old_chunk)
+                return
+
+            new_board = self._ensure_chunk(new_chunk_key)
+
+            if self._is_free(new_chunk_key, tr, tc):
+                board[session.row, session.col] = session.underlying
+                self._free[session.chunk_key].release(session.row, session.col)
+                self._save(session.chunk_key, board, [(session.row, session.col)])
 
-            if self._is_empty_cell(new_board, target.row, target.col):
-                board[state.pos.row, state.pos.col] = state.underlying_cell
-                save_chunk(state.chunk_id, board)
+                dest_before = int(new_board[tr, tc])
+                new_visible = with_player_int(session.color) | (dest_before & (1 << BIT_HAS_LINK))
+                new_board[tr, tc] = new_visible
+                self._free[new_chunk_key].occupy(tr, tc)
+                self._save(new_chunk_key, new_board, [(tr, tc)])
 
-                dest_before = new_board[target.row, target.col]
-                new_underlying = without_player(dest_before)
-                new_visible = with_player(state.color)
-                if get_bit(dest_before, BIT_HAS_LINK):
-                    new_visible = set_bit(new_visible, BIT_HAS_LINK, True)
-                new_board[target.row, target.col] = new_visible
-                save_chunk(new_chunk_id, new_board)
+                added, removed = self._resubscribe(session, new_chunk_key)
 
-                self._chunk_watchers.setdefault(new_chunk_id, set()).add(ws)
-                self._chunk_watchers.get(state.chunk_id, set()).discard(ws)
+                old_chunk = session.chunk_key
+                session.place(new_chunk_key, tr, tc, new_visible, without_player_int(dest_before))
 
-                old_chunk = state.chunk_id
-                state.chunk_id = new_chunk_id
-                state.pos = target
-                state.underlying_cell = new_underlying
-                state.visible_cell = new_visible
 
+                append_player_action(self._player_id(ws), id_from_key(session.chunk_key), tok)
 
-                append_player_action(self._player_id(ws), state.chunk_id, tok)
+                if session.user_id:
+                    save_player_position(session.user_id, id_from_key(session.chunk_key), session.row, session.col, flush=True)
 
+                await self._send_viewport(session, new_chunk_key, added, removed, skip=(old_chunk, new_chunk_key))
                 await self._broadcast_chunk(old_chunk)
-                await self._broadcast_chunk(new_chunk_id)
+                await self._broadcast_chunk(new_chunk_key)
                 await self._maybe_send_message_at(ws)
            
     async def color_plus_plus(self, ws: WebSocket) -> None:
         async with self._lock:
-            state = self._state_by_ws[ws]
-            board = self._ensure_chunk(state.chunk_id)
+            session = self._sessions[ws]
+            board = self._ensure_chunk(session.chunk_key)
             pr, pg, pb = (random.randint(0, 3) for _ in range(3))
-            new_color = make_color(pr, pg, pb)
-            state.color = new_color
-            state.underlying_cell = new_color
-            board[state.pos.row, state.pos.col] = with_player(new_color)
-            save_chunk(state.chunk_id, board)
-
-            append_player_action(self._player_id(ws), state.chunk_id, TOKEN_COLOR)
-
-            await self._broadcast_chunk(state.chunk_id)
+            new_color = int(make_color(pr, pg, pb))
+            session.color = new_color
+            session.underlying = new_color
+            session.visible = with_player_int(new_color)
+            board[session.row, session.col] = session.visible
+            self._save(session.chunk_key, board, [(session.row, session.col)])
+
+            append_player_action(self._player_id(ws), id_from_key(session.chunk_key), TOKEN_COLOR)
+
+            await self._broadcast_chunk(session.chunk_key)
+
+    def _matrix_text(self, chunk_key: ChunkKey) -> str:
+        if self.owns(chunk_key):
+            return self._encode(chunk_key, self._chunk(chunk_key))
+        # another shard simulates it: start from the saved state, updates arrive over the bus
+        return self._encode(chunk_key, self._peek(chunk_key))
+
+    def _peek(self, chunk_key: ChunkKey) -> torch.Tensor:
+        """Board of any chunk without caching it: the hub's copy if it has one, else the saved state."""
+        board = self._chunks.get(chunk_key)
+        if board is None:
+            board = load_chunk(chunk_key)
+        return self._empty if board is None else board
 
-    async def _send_chunk(self, ws: WebSocket) -> None:
-        state = self._state_by_ws.get(ws)
-        if not state:
-            return
-        board = self._ensure_chunk(state.chunk_id)
+    def _encode(self, chunk_key: ChunkKey, board: torch.Tensor) -> str:
         payload: MatrixPayload = {
             "type": "matrix",
             "w": W,
             "h": H,
             "data": board.flatten().tolist(),
-            "chunk_id": state.chunk_id,
-            "total_players": len(self._sockets),
+            "chunk_id": id_from_key(chunk_key),
+            "version": self._versions.get(chunk_key, 0),
+            "total_players": len(self._sessions),
         }
+        return json.dumps(payload)
+
+    def snapshot(self, chunk_key: ChunkKey) -> str:
+        """
+        The encoded matrix of a chunk right now; does not take the lock. Spectators may name any
+        chunk, so one the hub does not hold yet is read without being cached.
+        """
+        return self._encode(chunk_key, self._peek(chunk_key))
+
+    async def _send_matrix(self, session: Session, chunk_key: ChunkKey) -> None:
+        """Sends the current matrix right away, through the pacer so no older frame for the chunk follows it."""
+        await session.pacer.send_now(chunk_key, self._matrix_text(chunk_key))
+
+    async def _send_chunk(self, ws: WebSocket) -> None:
+        session = self._placed(ws)
+        if not session:
+            return
         try:
-            await ws.send_text(json.dumps(payload))
+            await self._send_matrix(session, session.chunk_key)
         except Exception as e:
             LOGGER.debug("send chunk failed: %r", e)
 
-    async def _broadcast_chunk(self, chunk_id: str) -> None:
-        board = self._ensure_chunk(chunk_id)
-        payload: MatrixPayload = {
-            "type": "matrix",
-            "w": W,
-            "h": H,
-            "data": board.flatten().tolist(),
-            "chunk_id": chunk_id,
-            "total_players": len(self._sockets),
-        }
-        dead: Set[WebSocket] = set()
-        for s in list(self._chunk_watchers.get(chunk_id, set())):
-            try:
-                await s.send_text(json.dumps(payload))
-            except Exception as e:
-                LOGGER.debug("broadcast failed: %r", e)
-                dead.add(s)
-        for s in dead:
-            try:
-                await self.disconnect(s)
-            except Exception as e:
-                LOGGER.debug("disconnect failed: %r", e)
+    async def _broadcast_chunk(self, chunk_key: ChunkKey) -> None:
+        if not self._bus.wants(chunk_key):
+            return
+        with BROADCAST_SECONDS.time():
+            # encoded once and shared by every subscriber whose viewport contains the chunk,
+            # whichever hub their socket is connected to
+            await self._bus.publish(chunk_key, self._matrix_text(chunk_key))
+
+    @staticmethod
+    async def _send(ws: WebSocket, text: str) -> None:
+        await ws.send_text(text)
+        FRAMES_SENT.inc()
+        BYTES_SENT.inc(len(text))
+
+    async def _deliver(self, chunk_key: ChunkKey, text: str) -> None:
+        # queued per client, never awaited here: a slow socket cannot hold up the hub or the other watchers
+        for session in self._chunk_watchers.get(chunk_key, ()):
+            session.pacer.deliver(chunk_key, text)
+
+    def ping_all(self) -> int:
+        """Starts a round-trip measurement on every awake socket; returns how many."""
+        sessions = [s for s in self._sessions.values() if s.chunk_key is not None and not s.hibernating]
+        for session in sessions:
+            session.pacer.ping()
+        return len(sessions)
+
+    def pong(self, ws: WebSocket, ping_id: int) -> None:
+        session = self._sessions.get(ws)
+        if session is not None:
+            session.pacer.pong(ping_id)
+
+    def _drop_later(self, ws: WebSocket) -> None:
+        # usually reached from move/connect with the lock held; disconnect takes it itself
+        task = asyncio.get_running_loop().create_task(self._drop(ws))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _drop(self, ws: WebSocket) -> None:
+        try:
+            await self.disconnect(ws)
+        except Exception as e:
+            LOGGER.debug("disconnect failed: %r", e)
 
     async def _maybe_send_message_at(self, ws: WebSocket) -> None:
-        state = self._state_by_ws.get(ws)
-        if not state:
+        session = self._placed(ws)
+        if not session:
             return
-        board = self._ensure_chunk(state.chunk_id)
-        cell_under = state.underlying_cell or without_player(board[state.pos.row, state.pos.col])
-        if get_bit(cell_under, BIT_HAS_LINK):
-            last = self._last_msg_pos_by_ws.get(ws)
-            current_pos = (state.chunk_id, state.pos.row, state.pos.col)
-            if last == current_pos:
+        cell_under = session.underlying or without_player_int(int(self._chunk(session.chunk_key)[session.row, session.col]))
+        if has_bit_int(cell_under, BIT_HAS_LINK):
+            current_pos = (session.chunk_key, session.row, session.col)
+            if session.last_msg_pos == current_pos:
                 return
-            message = load_message(state.chunk_id, state.pos.row, state.pos.col)
+            message = load_message(id_from_key(session.chunk_key), session.row, session.col)
             if message:
                 try:
-                    await ws.send_text(json.dumps({"type": "message", "data": message}))
+                    await self._send(ws, json.dumps({"type": "message", "data": message}))
                 except Exception as e:
                     LOGGER.debug("send message failed: %r", e)
-                self._last_msg_pos_by_ws[ws] = current_pos
+                session.last_msg_pos = current_pos
         else:
-            self._last_msg_pos_by_ws[ws] = None
+            session.last_msg_pos = None
 
     async def check_for_message(self, ws: WebSocket) -> None:
         await self._maybe_send_message_at(ws)
@@ -344,11 +900,11 @@ class Hub:
     async def write_message(self, ws: WebSocket, content: str) -> None:
         async with self._lock:
             try:
-                state = self._state_by_ws[ws]
-                board = self._ensure_chunk(state.chunk_id)
-                existing = load_message(state.chunk_id, state.pos.row, state.pos.col)
-                if existing or get_bit(board[state.pos.row, state.pos.col], BIT_HAS_LINK):
-                    await ws.send_text(json.dumps({
+                session = self._sessions[ws]
+                board = self._ensure_chunk(session.chunk_key)
+                existing = load_message(id_from_key(session.chunk_key), session.row, session.col)
+                if existing or has_bit_int(int(board[session.row, session.col]), BIT_HAS_LINK):
+                    await self._send(ws, json.dumps({
                         "type": "error",
                         "code": "SPACE_OCCUPIED",
                         "message": "This spot already has a message!"
@@ -357,32 +913,28 @@ class Hub:
                 message = Message(
                     content=content,
                     author=str(id(ws)),
-                    chunk_id=state.chunk_id,
-                    position=(state.pos.row, state.pos.col)
+                    chunk_id=id_from_key(session.chunk_key),
+                    position=(session.row, session.col)
                 )
                 save_message(message)
-                board[state.pos.row, state.pos.col] = set_bit(board[state.pos.row, state.pos.col], BIT_HAS_LINK, True)
-                state.underlying_cell = set_bit(state.underlying_cell, BIT_HAS_LINK, True)
-                save_chunk(state.chunk_id, board)
+                session.visible |= 1 << BIT_HAS_LINK
+                session.underlying |= 1 << BIT_HAS_LINK
+                board[session.row, session.col] = int(board[session.row, session.col]) | (1 << BIT_HAS_LINK)
+                self._save(session.chunk_key, board, [(session.row, session.col)])
             except Exception as e:
                 LOGGER.error("Failed to write message: %r", e)
                 try:
-                    await ws.send_text(json.dumps({"type": "error", "message": "Failed to save message"}))
+                    await self._send(ws, json.dumps({"type": "error", "message": "Failed to save message"}))
                 except Exception:
                     pass
                 return
-        await self._broadcast_chunk(state.chunk_id)
+        await self._broadcast_chunk(session.chunk_key)
         notice = json.dumps({"type": "announcement", "data": {"text": "A player hid a treasure"}})
-        for target_ws in list(self._chunk_watchers.get(state.chunk_id, set())):
-            try:
-                await target_ws.send_text(notice)
-            except Exception as e:
-                LOGGER.debug("send announcement failed: %r", e)
+        await self._bus.publish(session.chunk_key, notice)
 
     def _player_id(self, ws: WebSocket) -> str:
-
-        if hasattr(self, "_user_id_by_ws"):
-            user_id = self._user_id_by_ws.get(ws)
-            if user_id and user_id != "unknown":
-                return user_id
+        session = self._sessions.get(ws)
+        user_id = session.user_id if session else None
+        if user_id and user_id != "unknown":
+            return user_id
         return f"ws-{id(ws)}"
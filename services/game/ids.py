@@ -1,8 +1,64 @@
 from typing import Tuple
 
+# Chunks are addressed internally by a packed integer key: the Z-order (Morton) interleave
+# of (cx + 2^30, cy + 2^30), x in the even bits and y in the odd bits. Keys of nearby
+# chunks are numerically close, so as the INTEGER PRIMARY KEY of `chunks` they sit on
+# nearby B-tree pages. The "cx,cy" strings only exist on the wire and in JSON files.
+ChunkKey = int
+
+_OFFSET = 1 << 30          # coordinates must lie in [-2^30, 2^30)
+_X_MASK = 0x5555555555555555 & ((1 << 62) - 1)
+_Y_MASK = _X_MASK << 1
+
+
 def chunk_id_from_coords(cx: int, cy: int) -> str:
     return f"{cx},{cy}"
 
 def coords_from_chunk_id(cid: str) -> Tuple[int, int]:
     a, b = cid.split(",")
     return int(a), int(b)
+
+
+def _spread(v: int) -> int:
+    """Moves bit i of a 31-bit value to bit 2i."""
+    v &= 0x7FFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+def _compact(v: int) -> int:
+    """Inverse of _spread: gathers the even bits."""
+    v &= 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    v = (v | (v >> 16)) & 0x00000000FFFFFFFF
+    return v
+
+
+def key_from_coords(cx: int, cy: int) -> ChunkKey:
+    return _spread(cx + _OFFSET) | (_spread(cy + _OFFSET) << 1)
+
+def coords_from_key(key: ChunkKey) -> Tuple[int, int]:
+    return _compact(key) - _OFFSET, _compact(key >> 1) - _OFFSET
+
+def key_from_id(cid: str) -> ChunkKey:
+    return key_from_coords(*coords_from_chunk_id(cid))
+
+def id_from_key(key: ChunkKey) -> str:
+    return chunk_id_from_coords(*coords_from_key(key))
+
+
+def neighbor_key(key: ChunkKey, dx: int, dy: int) -> ChunkKey:
+    """Steps of -1/0/+1 per axis directly in Morton space (dilated-integer add), no decode."""
+    if dx:
+        xs = ((key | _Y_MASK) + 1) & _X_MASK if dx > 0 else ((key & _X_MASK) - 1) & _X_MASK
+        key = xs | (key & _Y_MASK)
+    if dy:
+        ys = ((key | _X_MASK) + 2) & _Y_MASK if dy > 0 else ((key & _Y_MASK) - 2) & _Y_MASK
+        key = ys | (key & _X_MASK)
+    return key
@@ -0,0 +1,111 @@
+"""
+Event-loop lag monitor.
+
+A heartbeat coroutine on the loop wakes every ``interval`` seconds and records how late
+it woke up (``voxel_event_loop_lag_seconds``). A watchdog thread checks the heartbeat;
+when it is older than ``threshold`` the loop is stuck in synchronous code, so the
+watchdog reads the loop thread's stack and the running task from outside and logs
+one warning per stall naming them, plus a second line once the loop is free again.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from .metrics import LOOP_LAG_SECONDS
+
+LOGGER = logging.getLogger("voxel-looplag")
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _where(frame, depth: int = 4) -> str:
+    """Innermost repo frames first-to-last (``hub.py:move > db_history.py:append_player_action``)."""
+    ours: List[str] = []
+    innermost: Optional[str] = None
+    while frame is not None:
+        code = frame.f_code
+        label = f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+        if innermost is None:
+            innermost = label
+        if code.co_filename.startswith(_REPO_ROOT) and len(ours) < depth:
+            ours.append(label)
+        frame = frame.f_back
+    chain = " > ".join(reversed(ours))
+    if innermost and (not ours or ours[0] != innermost):
+        chain = f"{chain} > {innermost}" if chain else innermost
+    return chain or "?"
+
+
+def _describe(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "no task (callback)"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.05, threshold: float = 0.25) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Call from the loop being monitored."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0.0, now - before - self.interval))
+            self._beat = now
+
+    def _watch(self) -> None:
+        stalled_at: Optional[float] = None  # heartbeat value of the stall being reported
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if stalled_at is not None and beat != stalled_at:
+                LOGGER.warning("Event loop unblocked after %.3fs", beat - stalled_at)
+                stalled_at = None
+            if stalled_at is None and blocked > self.threshold + self.interval:
+                stalled_at = beat
+                self.stalls += 1
+                frame = sys._current_frames().get(self._loop_thread)
+                try:
+                    task = asyncio.current_task(self._loop)
+                except RuntimeError:
+                    task = None
+                LOGGER.warning(
+                    "Event loop blocked for %.3fs+ in %s at %s",
+                    blocked - self.interval, _describe(task), _where(frame),
+                )
@@ -1,17 +1,36 @@
 import os
+import hmac
 import json
+import asyncio
 import logging
+import time
 from typing import Any, Optional, Tuple, TypedDict, Literal
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from jose import jwt, JWTError
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from jose import JWTError
 
-from .settings import W, H
-from .hub import Hub
-from .db import clear_player_bits_all
-
-JWT_SECRET = os.getenv("AUTH_JWT_SECRET", "CHANGE_ME_123456789")
-JWT_ALG = os.getenv("JWT_ALG", "HS256")
+from .settings import W, H, BIT_IS_PLAYER, BIT_HAS_LINK, JWT_SECRET, JWT_ALG, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+from .hub import Hub, HandedOff, ResumeRequest
+from .db import chunks_in_rect, clear_player_bits_all, fold_shard_messages
+from .db_history import fold_shard_histories
+from .ids import id_from_key, key_from_id
+from .players_db import flush_player_positions
+from .settings import POSITION_FLUSH_SECONDS, SHARD_COUNT, SHARD_ID, SHARD_REGION
+from .sharding import ShardMap, HandoffTicket, HANDOFF_CLOSE_CODE, is_handoff, read_handoff
+from .bus import InProcessBus, LocalSocketBus, parse_address
+from .settings import BUS_ADDRESS, BUS_AUTHKEY, BUS_CONNECT_TIMEOUT
+from .tokens import Claims, TokenVerifier, extract_token
+from . import metrics
+from .profiler import SamplingProfiler
+from .settings import ADMIN_TOKEN, PROFILE_MAX_SECONDS, LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD
+from .settings import CHECKPOINT_PATH, RESUME_GRACE
+from .looplag import LoopLagMonitor
+from .admission import AdmissionController
+from .settings import ADMISSION_RATE, ADMISSION_BATCH, ADMISSION_WINDOW
+from .settings import IDLE_HIBERNATE_SECONDS, HIBERNATE_SUMMARY_SECONDS, PING_INTERVAL
+from .settings import PACER_MIN_INTERVAL, PACER_MAX_INTERVAL, SPECTATE_MAX_CHUNKS, METRICS_TOP_CHUNKS
+from .spectate import Spectators
 
 LOGGER = logging.getLogger("voxel-server")
 if not LOGGER.handlers:
@@ -21,59 +40,197 @@ if not LOGGER.handlers:
     )
 
 app = FastAPI(title="-Voxel Server-")
-hub = Hub()
+# with GAME_SHARDS > 1 this process is one worker behind services.game.router and only
+# simulates the chunks its shard owns (see services.game.shards for the launcher)
+# GAME_BUS_ADDRESS connects to a chunk bus broker so viewports can include other workers' chunks
+bus = LocalSocketBus(parse_address(BUS_ADDRESS), BUS_AUTHKEY, BUS_CONNECT_TIMEOUT) if BUS_ADDRESS else InProcessBus()
+hub = Hub(ShardMap(SHARD_COUNT, SHARD_REGION), SHARD_ID, bus) if SHARD_COUNT > 1 else Hub(bus=bus)
+verifier = TokenVerifier(JWT_SECRET, [JWT_ALG], max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+lag_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD)
+# a reconnect storm queues here instead of piling onto the hub lock one socket at a time
+admission = AdmissionController(hub.connect_batch, ADMISSION_RATE, ADMISSION_BATCH, ADMISSION_WINDOW)
+# read-only sockets fed from the frames the hub already publishes on the bus
+spectators = Spectators(bus, hub.snapshot, Hub._send, PACER_MIN_INTERVAL, PACER_MAX_INTERVAL)
+
+metrics.gauge("voxel_connected_sockets", "WebSockets attached to the hub", hub.socket_count)
+metrics.gauge("voxel_admission_queue", "Sockets waiting to be placed", admission.queued)
+metrics.gauge("voxel_hibernating_sockets", "Idle sockets left out of chunk updates", hub.hibernating_count)
+metrics.gauge("voxel_spectators", "Read-only /spectate sockets", spectators.count)
+metrics.gauge("voxel_loaded_chunks", "Chunks held in memory", hub.loaded_chunk_count)
+metrics.gauge("voxel_watched_chunks", "Chunks at least one awake local socket watches", hub.watched_chunk_count)
+metrics.gauge("voxel_chunk_watches", "Chunk subscriptions of awake local sockets", hub.watch_count)
+# one series per chunk would grow with the world; only the busiest few are labelled
+metrics.gauge("voxel_chunk_watchers_top", f"Watchers of the {METRICS_TOP_CHUNKS} most watched chunks",
+              lambda: hub.watcher_counts(METRICS_TOP_CHUNKS), label="chunk_id")
 
 class IncomingMsg(TypedDict, total=False):
     k: str
     content: str
+    radius: int
+    t: int
 
 MoveKey = Literal["arrowup", "up", "arrowdown", "down", "arrowleft", "left", "arrowright", "right"]
 
+async def _position_flusher() -> None:
+    while True:
+        await asyncio.sleep(POSITION_FLUSH_SECONDS)
+        try:
+            flush_player_positions()
+        except Exception as e:
+            LOGGER.warning("Failed to flush player positions: %r", e)
+
+async def _parked_sweeper() -> None:
+    while True:
+        await asyncio.sleep(1)
+        try:
+            await hub.expire_parked()
+        except Exception as e:
+            LOGGER.warning("Failed to expire parked sessions: %r", e)
+
+async def _idle_sweeper() -> None:
+    last_summary = 0.0
+    while True:
+        await asyncio.sleep(1)
+        try:
+            await hub.hibernate_idle()
+            now = time.monotonic()
+            if HIBERNATE_SUMMARY_SECONDS > 0 and now - last_summary >= HIBERNATE_SUMMARY_SECONDS:
+                last_summary = now
+                await hub.send_summaries()
+        except Exception as e:
+            LOGGER.warning("Failed to hibernate idle sockets: %r", e)
+
+async def _pinger() -> None:
+    # round trips feed each client's frame pacing (see pacer.py)
+    while True:
+        await asyncio.sleep(PING_INTERVAL)
+        hub.ping_all()
+
 @app.on_event("startup")
 async def on_startup() -> None:
-    LOGGER.info("Startup: clearing all player bits…")
-    clear_player_bits_all()
+    # after a graceful shutdown the only player bits in world.db are the parked sessions just restored
+    restored = hub.restore_checkpoint(CHECKPOINT_PATH)
+    if SHARD_COUNT <= 1 and not restored:
+        # sharded workers share world.db; the launcher clears it once before starting them
+        LOGGER.info("Startup: clearing all player bits…")
+        clear_player_bits_all()
+    if SHARD_COUNT <= 1 and fold_shard_messages() + fold_shard_histories():
+        # a sharded run that did not shut down cleanly left its per-worker files behind
+        LOGGER.info("Startup: folded per-shard message/history files back")
+    await bus.start()
+    lag_monitor.start()
+    admission.start()
+    asyncio.create_task(_position_flusher())
+    asyncio.create_task(_parked_sweeper())
+    if IDLE_HIBERNATE_SECONDS > 0:
+        asyncio.create_task(_idle_sweeper())
+    if PING_INTERVAL > 0:
+        asyncio.create_task(_pinger())
     LOGGER.info("Startup complete.")
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
     LOGGER.info("Shutdown: disconnecting all websockets…")
-    for ws in list(hub.pos_by_ws.keys()):
-        try:
-            await hub.disconnect(ws)
-        except Exception as e:
-            LOGGER.warning("Failed to disconnect ws during shutdown: %r", e)
+    lag_monitor.stop()
+    await admission.stop()
+    # players keep their cells across the restart; the next process restores them from the checkpoint
+    try:
+        await hub.save_checkpoint(CHECKPOINT_PATH)
+    except Exception as e:
+        LOGGER.warning("Failed to write checkpoint: %r", e)
+    flush_player_positions()
+    await bus.close()
     LOGGER.info("Shutdown complete.")
 
 @app.get("/")
 def root() -> dict[str, Any]:
     return {"ok": True, "w": W, "h": H}
 
-def _extract_token(ws: WebSocket) -> Optional[str]:
-    try:
-        token = ws.query_params.get("token")
-        if token:
-            return token
-    except Exception:
-        LOGGER.error("Failed find token")
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _require_admin(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="admin endpoints disabled")
+    supplied = request.headers.get("x-admin-token") or ""
+    auth = request.headers.get("authorization") or ""
+    if not supplied and auth.lower().startswith("bearer "):
+        supplied = auth[7:]
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="forbidden")
+
+_profiler: Optional[SamplingProfiler] = None
+
+def _profile_result(profiler: SamplingProfiler, fmt: str) -> Any:
+    if fmt == "json":
+        return {**profiler.summary(), "collapsed": profiler.collapsed()}
+    # collapsed stacks: feed straight to flamegraph.pl / speedscope / inferno
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={"Content-Disposition": 'attachment; filename="voxel-profile.collapsed"'},
+    )
+
+@app.post("/admin/profile/start", dependencies=[Depends(_require_admin)])
+def profile_start(interval_ms: float = 10.0) -> dict[str, Any]:
+    global _profiler
+    if _profiler is not None and _profiler.running:
+        raise HTTPException(status_code=409, detail="profiler already running")
+    _profiler = SamplingProfiler(max(interval_ms, 1.0) / 1000, holder=hub.lock_holder)
+    _profiler.start()
+    return {"ok": True, "interval_ms": interval_ms}
+
+@app.post("/admin/profile/stop", dependencies=[Depends(_require_admin)])
+def profile_stop(format: Literal["collapsed", "json"] = "collapsed") -> Any:
+    if _profiler is None or not _profiler.running:
+        raise HTTPException(status_code=409, detail="profiler not running")
+    _profiler.stop()
+    return _profile_result(_profiler, format)
+
+@app.post("/admin/profile", dependencies=[Depends(_require_admin)])
+async def profile_for(seconds: float = 10.0, interval_ms: float = 10.0,
+                      format: Literal["collapsed", "json"] = "collapsed") -> Any:
+    """Samples every thread for ``seconds`` (the loop keeps serving meanwhile) and returns the stacks."""
+    global _profiler
+    if _profiler is not None and _profiler.running:
+        raise HTTPException(status_code=409, detail="profiler already running")
+    profiler = _profiler = SamplingProfiler(max(interval_ms, 1.0) / 1000, holder=hub.lock_holder)
+    profiler.start()
     try:
-        auth = ws.headers.get("authorization") or ws.headers.get("Authorization")
-        if isinstance(auth, str) and auth.lower().startswith("bearer "):
-            return auth[7:]
-    except Exception:
-        pass
-    return None
+        await asyncio.sleep(min(max(seconds, 0.0), PROFILE_MAX_SECONDS))
+    finally:
+        profiler.stop()
+    return _profile_result(profiler, format)
+
+@app.get("/admin/chunks", dependencies=[Depends(_require_admin)])
+def chunks_in_region(x0: int, y0: int, x1: int, y1: int) -> StreamingResponse:
+    """One JSON line per stored chunk in the inclusive rectangle, read straight off the (cx, cy) index."""
+    async def lines():
+        # sqlite connections are bound to the loop thread, so the generator is consumed here
+        for key, board in chunks_in_rect(x0, y0, x1, y1):
+            yield json.dumps({
+                "chunk_id": id_from_key(key),
+                "players": int(((board >> BIT_IS_PLAYER) & 1).sum()),
+                "links": int(((board >> BIT_HAS_LINK) & 1).sum()),
+            }) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-def _verify_token_or_reason(token: Optional[str]) -> Tuple[bool, str]:
+def _extract_token(ws: WebSocket) -> Optional[str]:
+    return extract_token(ws)
+
+def _verify_token_or_reason(token: Optional[str]) -> Tuple[Optional[Claims], str]:
     if not token:
-        return False, "no token provided"
+        return None, "no token provided"
     try:
-        jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return True, ""
+        claims = verifier.verify(token)
     except JWTError as e:
-        return False, f"invalid token: {e}"
+        return None, f"invalid token: {e}"
     except Exception as e:
-        return False, f"token error: {e}"
+        return None, f"token error: {e}"
+    if is_handoff(claims.payload):
+        return None, "invalid token: a handoff ticket is not a login token"
+    return claims, ""
 
 async def _safe_send_json(ws: WebSocket, obj: Any) -> None:
     try:
@@ -119,34 +276,71 @@ async def _handle_command(ws: WebSocket, data: IncomingMsg) -> None:
             await _handle_message(ws, data)
         elif k in ("whereami",):
             await hub._send_chunk(ws)#??
+        elif k == "pong":
+            hub.pong(ws, int(data.get("t") or 0))
+        elif k == "wake":
+            pass  # hub.touch already sent the snapshot
+        elif k == "view":
+            await hub.set_view_radius(ws, int(data.get("radius") or 0))
         elif k:
             LOGGER.info("Unknown key received: %s", k)
     except Exception as e:
         LOGGER.exception("Action failed for key=%s: %s", k, e)
         await _safe_send_json(ws, {"ok": False, "error": "action_failed", "msg": str(e)})
 
+def _resume_request(ws: WebSocket) -> Optional[ResumeRequest]:
+    """``?resume=<token>&chunk=<cx,cy>&version=<n>`` from a client reconnecting after a drop."""
+    token = ws.query_params.get("resume")
+    if not token:
+        return None
+    try:
+        version = int(ws.query_params.get("version", "-1"))
+    except ValueError:
+        version = -1
+    return ResumeRequest(token, ws.query_params.get("chunk"), version)
+
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket) -> None:
     token = _extract_token(ws)
-    ok, reason = _verify_token_or_reason(token)
-    if not ok:
+    claims, reason = _verify_token_or_reason(token)
+    if claims is None:
         await _close_with_reason(ws, 1008, reason)
         return
+    resume = _resume_request(ws)
+    handoff: Optional[HandoffTicket] = None
+    ticket = ws.query_params.get("handoff")
+    if ticket:
+        try:
+            handoff = read_handoff(ticket)
+        except Exception as e:
+            await _close_with_reason(ws, 1008, f"invalid handoff: {e}")
+            return
     try:
         await ws.accept()
         LOGGER.info("Client connected: %s", ws.client)
-        await hub.connect(ws)
+        await admission.admit(ws, claims, handoff, resume)
         # try:
         #     # await hub.check_for_message(ws)
         #     pass
         # except Exception:
         #     pass
+    except HandedOff as e:
+        # the handoff frame is out; a router follows it, any other client gets a close instead of a dead socket
+        LOGGER.debug("handed off at connect: %s", e)
+        await _close_with_reason(ws, HANDOFF_CLOSE_CODE, "handoff")
+        return
     except Exception as e:
         LOGGER.exception("Failed to accept/connect client: %s", e)
         await _close_with_reason(ws, 1011, "hub.connect error")
         return
+    close_code = 1000
     try:
-        async for raw in ws.iter_text():
+        while True:
+            try:
+                raw = await ws.receive_text()
+            except WebSocketDisconnect as e:
+                close_code = e.code
+                break
             try:
                 data = json.loads(raw)
                 if not isinstance(data, dict):
@@ -154,11 +348,48 @@ async def ws_endpoint(ws: WebSocket) -> None:
             except Exception as e:
                 LOGGER.debug("JSON parse error: %s raw=%r", e, raw)
                 continue
+            if data.get("k") != "pong":  # a background tab still answers pings
+                await hub.touch(ws)
             await _handle_command(ws, data)
     finally:
         LOGGER.info("Connection closing → hub.disconnect")
         try:
+            if close_code == 1012:
+                # uvicorn closes every socket with 1012 (service restart) on graceful shutdown
+                await hub.park(ws)
+            elif close_code not in (1000, 1001):
+                # dropped rather than closed (1006 and friends): hold the player for a resume
+                await hub.park(ws, RESUME_GRACE)
             await hub.disconnect(ws)
             LOGGER.info("Disconnected successfully.")
         except Exception as e:
             LOGGER.exception("Error during disconnect: %s", e)
+
+@app.websocket("/spectate")
+async def spectate_endpoint(ws: WebSocket) -> None:
+    """``/spectate?token=...&chunk=0,0&chunk=1,0``: the chunks' matrix frames, no player."""
+    claims, reason = _verify_token_or_reason(_extract_token(ws))
+    if claims is None:
+        await _close_with_reason(ws, 1008, reason)
+        return
+    try:
+        keys = {key_from_id(cid) for cid in ws.query_params.getlist("chunk")}
+    except ValueError:
+        await _close_with_reason(ws, 1008, "chunk must be cx,cy")
+        return
+    if not 0 < len(keys) <= SPECTATE_MAX_CHUNKS:
+        await _close_with_reason(ws, 1008, f"spectate 1 to {SPECTATE_MAX_CHUNKS} chunks")
+        return
+    if not bus.shared and not all(hub.owns(key) for key in keys):
+        # updates of another shard's chunks only arrive over a shared bus
+        await _close_with_reason(ws, 1008, "chunk is simulated by another shard")
+        return
+    await ws.accept()
+    spectators.add(ws, keys)
+    try:
+        while True:
+            await ws.receive_text()  # input is ignored; this only notices the close
+    except WebSocketDisconnect:
+        pass
+    finally:
+        spectators.remove(ws)
@@ -0,0 +1,265 @@
+"""
+In-process metrics rendered in the Prometheus text format by ``GET /metrics``.
+
+Recording is a perf_counter() pair, a bisect and a couple of integer adds, with no
+locks: everything that records runs on the event loop thread (or under the GIL for
+the few thread-pool callers, where a lost increment is acceptable).
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import inspect
+import sys
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+# seconds; the hot paths live well under a millisecond, SQLite/JSON writes in the ms range
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name} {self.value}"]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 labels: str = "") -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels  # pre-rendered 'key="value"' when part of a HistogramFamily
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """``with HIST.time():`` - also fine around ``await``s inside a coroutine."""
+        return _Timer(self)
+
+    def timed(self, fn: Callable) -> Callable:
+        """Decorator for plain functions and coroutine functions."""
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.observe(perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(perf_counter() - start)
+        return wrapper
+
+    def render(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        extra = f"{self.labels}," if self.labels else ""
+        suffix = f"{{{self.labels}}}" if self.labels else ""
+        for bound, n in zip(self.buckets, self._counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{{extra}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{{extra}le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum{suffix} {self.sum:.9g}")
+        lines.append(f"{self.name}_count{suffix} {self.count}")
+        return lines
+
+
+class HistogramFamily:
+    """Histograms sharing a name, one per value of ``label`` (created on first use)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._children: Dict[str, Histogram] = {}
+
+    def labels(self, value: str) -> Histogram:
+        child = self._children.get(value)
+        if child is None:
+            child = self._children[value] = Histogram(self.name, self.help, self.buckets, f'{self.label}="{value}"')
+        return child
+
+    def render(self) -> List[str]:
+        lines: List[str] = []
+        for value in sorted(self._children):
+            lines.extend(self._children[value].render())
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_hist", "_start")
+
+    def __init__(self, hist: Histogram) -> None:
+        self._hist = hist
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.observe(perf_counter() - self._start)
+
+
+GaugeValue = Union[float, Mapping[str, float]]
+
+
+class Gauge:
+    """Sampled when /metrics is scraped. ``fn`` returns a number, or ``{label value: number}`` when ``label`` is set."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], GaugeValue], label: Optional[str] = None) -> None:
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+
+    def render(self) -> List[str]:
+        value = self.fn()
+        if self.label is None:
+            return [f"{self.name} {value:g}"]
+        return [f'{self.name}{{{self.label}="{key}"}} {v:g}' for key, v in sorted(value.items())]
+
+
+Metric = Union[Counter, Histogram, HistogramFamily, Gauge]
+_registry: Dict[str, Metric] = {}
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter(name, help))
+
+
+def histogram(name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, buckets))
+
+
+def histogram_family(name: str, help: str, label: str,
+                     buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> HistogramFamily:
+    return _register(HistogramFamily(name, help, label, buckets))
+
+
+def gauge(name: str, help: str, fn: Callable[[], GaugeValue], label: Optional[str] = None) -> Gauge:
+    # gauges are bound to live objects, so registering the same name again replaces the callback
+    metric = Gauge(name, help, fn, label)
+    _registry[name] = metric
+    return metric
+
+
+def _register(metric):
+    existing = _registry.get(metric.name)
+    if existing is not None:
+        return existing
+    _registry[metric.name] = metric
+    return metric
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class InstrumentedLock:
+    """
+    asyncio.Lock that records, per call site, how long each ``async with`` waited to get in
+    and how long it then held the lock. The call site is the name of the function running
+    the ``async with`` (``move``, ``connect``, ...), or the name given to ``at`` when one
+    function serves several callers; the current one is exposed as ``holder`` for the
+    sampling profiler.
+    """
+
+    def __init__(self, wait: HistogramFamily, hold: HistogramFamily) -> None:
+        self._lock = asyncio.Lock()
+        self._wait = wait
+        self._hold = hold
+        self._acquired_at = 0.0
+        self.holder: Optional[str] = None
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def at(self, site: str) -> "_LockSite":
+        """``async with lock.at("connect"):`` records under ``site`` instead of the function name."""
+        return _LockSite(self, site)
+
+    async def __aenter__(self) -> None:
+        # frame 1 is the coroutine running the ``async with``
+        await self._enter(sys._getframe(1).f_code.co_name)
+
+    async def _enter(self, site: str) -> None:
+        start = perf_counter()
+        await self._lock.acquire()
+        self._acquired_at = perf_counter()
+        self._wait.labels(site).observe(self._acquired_at - start)
+        self.holder = site
+
+    async def __aexit__(self, *exc) -> None:
+        self._hold.labels(self.holder or "unknown").observe(perf_counter() - self._acquired_at)
+        self.holder = None
+        self._lock.release()
+
+
+class _LockSite:
+    __slots__ = ("_lock", "_site")
+
+    def __init__(self, lock: InstrumentedLock, site: str) -> None:
+        self._lock = lock
+        self._site = site
+
+    async def __aenter__(self) -> None:
+        await self._lock._enter(self._site)
+
+    async def __aexit__(self, *exc) -> None:
+        await self._lock.__aexit__(*exc)
+
+
+MOVE_SECONDS = histogram("voxel_hub_move_seconds", "Hub.move latency, lock wait and broadcasts included")
+BROADCAST_SECONDS = histogram("voxel_broadcast_chunk_seconds", "Encoding and publishing one chunk update")
+SAVE_CHUNK_SECONDS = histogram("voxel_save_chunk_seconds", "ChunkDB.save_chunk latency")
+LOAD_CHUNK_SECONDS = histogram("voxel_load_chunk_seconds", "ChunkDB.load_chunk latency")
+APPEND_ACTION_SECONDS = histogram("voxel_append_player_action_seconds", "history.json append latency")
+LOCK_WAIT_SECONDS = histogram_family("voxel_hub_lock_wait_seconds", "Time spent waiting for the hub lock", "site")
+LOCK_HOLD_SECONDS = histogram_family("voxel_hub_lock_hold_seconds", "Time the hub lock was held", "site")
+LOOP_LAG_SECONDS = histogram("voxel_event_loop_lag_seconds", "How late the loop heartbeat woke up")
+ADMISSION_WAIT_SECONDS = histogram("voxel_admission_wait_seconds", "Time a new socket waited in the admission queue")
+ADMISSION_BATCH_SIZE = histogram("voxel_admission_batch_size", "Sockets placed per admission batch",
+                                 (1, 2, 5, 10, 20, 50, 100, 200))
+FRAMES_SENT = counter("voxel_ws_frames_sent_total", "WebSocket frames sent by the hub")
+BYTES_SENT = counter("voxel_ws_bytes_sent_total", "WebSocket payload bytes sent by the hub")
+FRAMES_COALESCED = counter("voxel_ws_frames_coalesced_total", "Chunk frames replaced by a newer one before reaching a slow client")
+BUS_FRAMES_DROPPED = counter("voxel_bus_frames_dropped_total", "Chunk frames not published because the bus broker fell behind")
+CLIENT_RTT_SECONDS = histogram("voxel_client_rtt_seconds", "Application-level ping round trip per client")
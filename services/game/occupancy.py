@@ -0,0 +1,93 @@
+from __future__ import annotations
+import random
+from array import array
+from typing import Iterable
+
+import torch
+
+
+class FreeCells:
+    """
+    Free (player-less) cells of one chunk, as flat indices ``row * w + col``.
+
+    A dense array of the free cells plus each cell's slot in that array gives O(1)
+    occupy/release (swap-remove) and O(1) uniform random pick. Given the same seed
+    and the same sequence of enter/leave events the picks are deterministic. Both are
+    unboxed ``array('H')`` (2 bytes per cell) for chunks of up to 65535 cells.
+    """
+
+    __slots__ = ("w", "_cells", "_slot", "_none")
+
+    def __init__(self, free: Iterable[int], h: int, w: int) -> None:
+        self.w = w
+        typecode = "H" if h * w < 0xFFFF else "L"
+        self._none = (1 << (8 * array(typecode).itemsize)) - 1  # slot of a taken cell
+        self._cells = array(typecode, free)
+        self._slot = array(typecode, [self._none]) * (h * w)
+        for i, cell in enumerate(self._cells):
+            self._slot[cell] = i
+
+    @classmethod
+    def from_board(cls, board: torch.Tensor, player_bit: int) -> "FreeCells":
+        h, w = board.shape
+        free = torch.nonzero(((board >> player_bit) & 1).flatten() == 0).flatten().tolist()
+        return cls(free, h, w)
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def is_free(self, row: int, col: int) -> bool:
+        return self._slot[row * self.w + col] != self._none
+
+    def occupy(self, row: int, col: int) -> None:
+        cell = row * self.w + col
+        i = self._slot[cell]
+        if i == self._none:
+            return
+        last = self._cells.pop()
+        if last != cell:
+            self._cells[i] = last
+            self._slot[last] = i
+        self._slot[cell] = self._none
+
+    def release(self, row: int, col: int) -> None:
+        cell = row * self.w + col
+        if self._slot[cell] != self._none:
+            return
+        self._slot[cell] = len(self._cells)
+        self._cells.append(cell)
+
+    def pick(self, rng: random.Random) -> tuple[int, int]:
+        """A uniformly random free cell as ``(row, col)``; the caller checks ``len`` first."""
+        cell = self._cells[rng.randrange(len(self._cells))]
+        return divmod(cell, self.w)
+
+
+class AllFree:
+    """
+    The free-cell index of a chunk that has no row in the database (the hub's shared zero
+    board): every cell is free, so nothing per cell needs to be stored. One instance is
+    shared by all such chunks and is read-only; a chunk that is about to be written gets
+    a real ``FreeCells`` first. Picks match those of ``FreeCells(range(h * w), h, w)``.
+    """
+
+    __slots__ = ("w", "_n")
+
+    def __init__(self, h: int, w: int) -> None:
+        self.w = w
+        self._n = h * w
+
+    def __len__(self) -> int:
+        return self._n
+
+    def is_free(self, row: int, col: int) -> bool:
+        return True
+
+    def occupy(self, row: int, col: int) -> None:
+        raise TypeError("AllFree is shared; give the chunk its own FreeCells before occupying a cell")
+
+    def release(self, row: int, col: int) -> None:
+        pass  # already free
+
+    def pick(self, rng: random.Random) -> tuple[int, int]:
+        return divmod(rng.randrange(self._n), self.w)
@@ -0,0 +1,151 @@
+"""
+Per-client pacing of chunk frames.
+
+Each socket gets a ``ClientPacer``. Chunk updates are offered to it instead of being sent
+inline, and the latest frame per chunk replaces any frame for that chunk still waiting
+(latest wins). A send task, started only while something is waiting, flushes the queue
+no more often than once per ``interval()``:
+
+    clamp(max(rtt / 2, 2 * send time), min_interval, max_interval)
+
+where ``rtt`` comes from app-level ``{"type": "ping"}`` / ``{"k": "pong"}`` frames and
+``send time`` is how long ``send_text`` took per flush (it grows as the socket's buffer
+fills), both as moving averages. A LAN client keeps both near zero and is sent every
+frame as it is produced; a slow one gets fewer, fresher frames instead of a backlog.
+
+A frame the hub must send at once (a snapshot after a move or a wake-up) goes through
+``send_now``: it replaces any queued frame for its chunk, including one the send task has
+already taken but not sent yet, and waits for a frame that is mid-send, so an older matrix
+can never arrive after it.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from fastapi import WebSocket
+
+from .metrics import CLIENT_RTT_SECONDS, FRAMES_COALESCED
+
+SMOOTHING = 0.25  # weight of a new sample in the moving averages
+# every json.dumps'd MatrixPayload starts like this (dicts keep insertion order)
+MATRIX_PREFIX = '{"type": "matrix"'
+
+Send = Callable[[WebSocket, str], Awaitable[None]]
+
+_ping_ids = itertools.count(1)
+
+
+class ClientPacer:
+    __slots__ = ("ws", "_send", "_on_error", "min_interval", "max_interval", "rtt", "send_time",
+                 "_pending", "_taken", "_sending", "_next_at", "_task", "_ping", "_ping_id", "_ping_at")
+
+    def __init__(self, ws: WebSocket, send: Send, on_error: Callable[[WebSocket], None],
+                 min_interval: float = 0.0, max_interval: float = 1.0) -> None:
+        self.ws = ws
+        self._send = send
+        self._on_error = on_error
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rtt: Optional[float] = None
+        self.send_time = 0.0
+        # chunk key -> latest frame, or a fresh object() -> frame that must not be coalesced
+        self._pending: Dict[Hashable, str] = {}
+        self._taken: Dict[Hashable, str] = {}  # the batch the send task is working through
+        self._sending = asyncio.Lock()  # one send_text at a time, so frames leave in order
+        self._next_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._ping: Optional[str] = None
+        self._ping_id = 0
+        self._ping_at = 0.0
+
+    def interval(self) -> float:
+        wanted = max((self.rtt or 0.0) / 2, 2 * self.send_time)
+        return min(self.max_interval, max(self.min_interval, wanted))
+
+    def deliver(self, key: Hashable, text: str) -> None:
+        """Queues a frame published for chunk ``key``: matrices supersede each other, anything else keeps its place."""
+        if text.startswith(MATRIX_PREFIX):
+            self.offer(key, text)
+        else:
+            self.push(text)
+
+    def offer(self, key: Hashable, text: str) -> None:
+        """Queues a chunk frame, replacing one for the same chunk that has not gone out yet."""
+        if key in self._pending:
+            FRAMES_COALESCED.inc()
+        self._pending[key] = text
+        self._kick()
+
+    def push(self, text: str) -> None:
+        """Queues a frame that is never dropped, in order with the chunk frames."""
+        self._pending[object()] = text
+        self._kick()
+
+    async def send_now(self, key: Hashable, text: str) -> None:
+        """Sends a chunk frame right away, superseding older frames for the chunk; send errors propagate."""
+        self._pending.pop(key, None)
+        self._taken.pop(key, None)
+        async with self._sending:
+            await self._send(self.ws, text)
+
+    def ping(self) -> None:
+        self._ping_id = next(_ping_ids)
+        self._ping = json.dumps({"type": "ping", "t": self._ping_id})
+        self._kick()
+
+    def pong(self, ping_id: int) -> None:
+        if ping_id != self._ping_id or not self._ping_at:
+            return
+        sample = time.monotonic() - self._ping_at
+        self._ping_at = 0.0
+        CLIENT_RTT_SECONDS.observe(sample)
+        self.rtt = sample if self.rtt is None else self.rtt + SMOOTHING * (sample - self.rtt)
+
+    def close(self) -> None:
+        self._pending.clear()
+        self._taken.clear()
+        self._ping = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _kick(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self) -> None:
+        try:
+            while self._pending or self._ping:
+                if self._ping:
+                    # outside the pacing, so the round trip measures the link and not our queue
+                    text, self._ping = self._ping, None
+                    async with self._sending:
+                        self._ping_at = time.monotonic()
+                        await self._send(self.ws, text)
+                    continue
+                wait = self._next_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._taken, self._pending = self._pending, {}
+                start = time.monotonic()
+                while self._taken:
+                    async with self._sending:
+                        # send_now may have superseded the rest of the batch while we waited
+                        if self._taken:
+                            text = self._taken.pop(next(iter(self._taken)))
+                            await self._send(self.ws, text)
+                took = time.monotonic() - start
+                self.send_time += SMOOTHING * (took - self.send_time)
+                self._next_at = start + self.interval()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._pending.clear()
+            self._taken.clear()
+            self._on_error(self.ws)
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
@@ -1,11 +1,14 @@
+import os
 import sqlite3
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Iterable, Optional, Tuple
 import time
 
+from .settings import POSITION_FLUSH_SECONDS
+
 # Base path for data folder (same logic as db.py)
 BASE_ROOT_DIR = Path(__file__).resolve().parents[2]
-PLAYER_DB_PATH = BASE_ROOT_DIR / "data" / "players.db"
+PLAYER_DB_PATH = Path(os.getenv("GAME_DATA_DIR") or BASE_ROOT_DIR / "data") / "players.db"
 
 class PlayerDB:
     def __init__(self, db_path: Path = PLAYER_DB_PATH):
@@ -42,11 +45,71 @@ class PlayerDB:
           last_seen=excluded.last_seen
         """, (player_id, chunk_id, row, col, now))
 
+    def upsert_player_positions(self, rows: Iterable[Tuple[str, str, int, int]]) -> None:
+        now = int(time.time())
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany("""
+            INSERT INTO players (id, chunk_id, row, col, last_seen)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+              chunk_id=excluded.chunk_id,
+              row=excluded.row,
+              col=excluded.col,
+              last_seen=excluded.last_seen
+            """, [(pid, cid, r, c, now) for pid, cid, r, c in rows])
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+
+class PositionBuffer:
+    """
+    Keeps only the latest position per player in memory and writes them all in one
+    transaction. At most ``flush_interval`` seconds of movement are lost on a crash.
+    """
+
+    def __init__(self, db: PlayerDB, flush_interval: float = POSITION_FLUSH_SECONDS):
+        self._db = db
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Tuple[str, int, int]] = {}
+        self._last_flush = time.monotonic()
+
+    def stage(self, player_id: str, chunk_id: str, row: int, col: int) -> None:
+        self._pending[player_id] = (chunk_id, row, col)
+
+    def get(self, player_id: str) -> Optional[Tuple[str, int, int]]:
+        return self._pending.get(player_id)
+
+    def due(self) -> bool:
+        return bool(self._pending) and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self) -> int:
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            self._db.upsert_player_positions((pid, cid, r, c) for pid, (cid, r, c) in pending.items())
+        except Exception:
+            # keep whatever was staged meanwhile, and retry the failed batch next time
+            pending.update(self._pending)
+            self._pending = pending
+            raise
+        return len(pending)
+
 # Global singleton instance
 _player_db = PlayerDB()
+_positions = PositionBuffer(_player_db)
 
 def get_player_position(player_id: str) -> Optional[Tuple[str, int, int]]:
-    return _player_db.get_player_position(player_id)
+    return _positions.get(player_id) or _player_db.get_player_position(player_id)
+
+def save_player_position(player_id: str, chunk_id: str, row: int, col: int, flush: bool = False) -> None:
+    _positions.stage(player_id, chunk_id, row, col)
+    if flush or _positions.due():
+        _positions.flush()
 
-def save_player_position(player_id: str, chunk_id: str, row: int, col: int) -> None:
-    _player_db.upsert_player_position(player_id, chunk_id, row, col)
+def flush_player_positions() -> int:
+    return _positions.flush()
@@ -0,0 +1,92 @@
+"""
+Sampling profiler that can be switched on in a running server.
+
+A daemon thread wakes every ``interval`` seconds, grabs ``sys._current_frames()`` and
+counts each thread's stack. Nothing is installed in the profiled threads (no
+sys.setprofile), so the cost is one stack walk per thread per tick and zero when
+stopped. Output is in the collapsed format (``frame;frame;frame count``) read by
+flamegraph.pl, speedscope and inferno. Every stack is rooted at its thread name and,
+when a ``holder`` callback is given, at the Hub method holding the lock at that moment.
+"""
+from __future__ import annotations
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+
+def _frame_label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01, holder: Optional[Callable[[], Optional[str]]] = None,
+                 max_depth: int = 128) -> None:
+        self.interval = interval
+        self.holder = holder
+        self.max_depth = max_depth
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stacks: Counter = Counter()
+        self._holders: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            raise RuntimeError("profiler already running")
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.stopped_at = time.monotonic()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            holder = self.holder() if self.holder else None
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack: List[str] = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                root = [names.get(ident, str(ident))]
+                if self.holder is not None:
+                    root.append(f"[lock: {holder or 'free'}]")
+                self._stacks[";".join(root + stack[::-1])] += 1
+            if self.holder is not None:
+                self._holders[holder or "free"] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def summary(self, top: int = 20) -> Dict[str, object]:
+        leaves: Counter = Counter()
+        for stack, count in self._stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        end = self.stopped_at or time.monotonic()
+        return {
+            "samples": self.samples,
+            "seconds": round(end - (self.started_at or end), 3),
+            "interval": self.interval,
+            "lock_holders": dict(self._holders.most_common()),
+            "top_frames": dict(leaves.most_common(top)),
+        }
@@ -0,0 +1,108 @@
+"""
+WebSocket router for the sharded game service.
+
+Terminates client sockets and proxies each one to the worker that owns the player's
+current chunk (``ws://GAME_SHARD_HOST:GAME_SHARD_BASE_PORT+shard/ws``). When a worker
+answers with a ``handoff`` frame the router reconnects the client to the new owner,
+passing the signed ticket along; the client never sees the switch.
+
+Run via ``python -m services.game.shards`` or ``uvicorn services.game.router:app``.
+"""
+import asyncio
+import json
+import logging
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+
+import websockets
+from fastapi import FastAPI, WebSocket
+from jose import JWTError
+
+from .ids import key_from_coords, key_from_id
+from .players_db import get_player_position
+from .settings import (
+    JWT_SECRET, JWT_ALG, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL,
+    SHARD_COUNT, SHARD_REGION, SHARD_HOST, SHARD_BASE_PORT,
+)
+from .sharding import ShardMap, is_handoff
+from .tokens import TokenVerifier, extract_token
+
+LOGGER = logging.getLogger("voxel-router")
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+HANDOFF_PREFIX = '{"type": "handoff"'
+
+app = FastAPI(title="-Voxel Router-")
+shards = ShardMap(SHARD_COUNT, SHARD_REGION)
+verifier = TokenVerifier(JWT_SECRET, [JWT_ALG], max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+def shard_url(shard: int, token: str, ticket: Optional[str] = None) -> str:
+    query = {"token": token}
+    if ticket:
+        query["handoff"] = ticket
+    return f"ws://{SHARD_HOST}:{SHARD_BASE_PORT + shard}/ws?{urlencode(query)}"
+
+
+async def _pump(client: WebSocket, upstream) -> Optional[Tuple[int, str]]:
+    """Relays frames both ways. Returns ``(shard, ticket)`` on handoff, ``None`` when either side closed."""
+
+    async def client_to_upstream() -> None:
+        while True:
+            await upstream.send(await client.receive_text())
+
+    async def upstream_to_client() -> Optional[Tuple[int, str]]:
+        async for frame in upstream:
+            if isinstance(frame, str) and frame.startswith(HANDOFF_PREFIX):
+                msg = json.loads(frame)
+                return int(msg["shard"]), msg["ticket"]
+            await client.send_text(frame if isinstance(frame, str) else frame.decode())
+        return None
+
+    reader = asyncio.create_task(client_to_upstream())
+    writer = asyncio.create_task(upstream_to_client())
+    done, pending = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            LOGGER.debug("relay stopped: %r", task.exception())
+    if writer in done and not writer.cancelled() and writer.exception() is None:
+        return writer.result()
+    return None
+
+
+@app.websocket("/ws")
+async def ws_endpoint(ws: WebSocket) -> None:
+    token = extract_token(ws)
+    try:
+        claims = verifier.verify(token) if token else None
+    except JWTError:
+        claims = None
+    if claims is None or is_handoff(claims.payload):
+        await ws.close(code=1008, reason="invalid token")
+        return
+    await ws.accept()
+
+    pos = get_player_position(claims.user_id)
+    shard = shards.shard_for(key_from_id(pos[0]) if pos else key_from_coords(0, 0))
+    ticket: Optional[str] = None
+    try:
+        while True:
+            try:
+                async with websockets.connect(shard_url(shard, token, ticket), max_size=None) as upstream:
+                    outcome = await _pump(ws, upstream)
+            except (OSError, websockets.InvalidHandshake) as e:
+                LOGGER.error("shard %s unreachable: %r", shard, e)
+                await ws.close(code=1011, reason="shard unavailable")
+                return
+            if outcome is None:
+                break
+            shard, ticket = outcome
+            LOGGER.debug("handoff of %s to shard %s", claims.user_id, shard)
+    finally:
+        try:
+            await ws.close()
+        except Exception:
+            pass
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 import torch
 
@@ -15,6 +16,76 @@ COLOR_BITS = {
     "b": (BIT_B0, BIT_B1),
 }
 
-DATA_DIR = Path("data")
+# GAME_DATA_DIR relocates every game data file (benchmarks point it at a scratch directory)
+DATA_DIR = Path(os.getenv("GAME_DATA_DIR", "data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-DB_PATH = DATA_DIR / "world.db"
\ No newline at end of file
+DB_PATH = DATA_DIR / "world.db"
+JWT_SECRET = os.getenv("AUTH_JWT_SECRET", "CHANGE_ME_123456789")
+JWT_ALG = os.getenv("JWT_ALG", "HS256")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# worst case of movement lost on a crash; positions are also flushed on chunk change and disconnect
+POSITION_FLUSH_SECONDS = float(os.getenv("POSITION_FLUSH_SECONDS", "2"))
+
+# fixed seed makes spawn points reproducible (unset = random)
+SPAWN_SEED = int(os.environ["SPAWN_SEED"]) if os.getenv("SPAWN_SEED") else None
+# how many rings of chunks around the preferred one are searched when it is full
+SPAWN_SEARCH_RADIUS = int(os.getenv("SPAWN_SEARCH_RADIUS", "8"))
+
+# largest viewport a client may subscribe to: (2r+1)^2 chunks around its own
+MAX_VIEW_RADIUS = int(os.getenv("MAX_VIEW_RADIUS", "2"))
+
+# sharding: GAME_SHARDS worker processes, each owning blocks of GAME_SHARD_REGION^2 chunks
+SHARD_COUNT = int(os.getenv("GAME_SHARDS", "1"))
+SHARD_ID = int(os.getenv("GAME_SHARD_ID", "0"))
+SHARD_REGION = int(os.getenv("GAME_SHARD_REGION", "4"))
+SHARD_HOST = os.getenv("GAME_SHARD_HOST", "127.0.0.1")
+SHARD_BASE_PORT = int(os.getenv("GAME_SHARD_BASE_PORT", "7100"))
+HANDOFF_TTL = int(os.getenv("GAME_HANDOFF_TTL", "30"))
+
+# chunk pub/sub: empty = in-process only; "host:port" or a socket path = LocalSocketBus to that broker
+BUS_ADDRESS = os.getenv("GAME_BUS_ADDRESS", "")
+BUS_AUTHKEY = os.getenv("GAME_BUS_AUTHKEY", JWT_SECRET).encode()
+# how long a worker keeps retrying to reach the broker on startup
+BUS_CONNECT_TIMEOUT = float(os.getenv("GAME_BUS_CONNECT_TIMEOUT", "10"))
+
+# admin endpoints (/admin/...) are disabled unless this is set
+ADMIN_TOKEN = os.getenv("GAME_ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("GAME_PROFILE_MAX_SECONDS", "300"))
+
+# graceful shutdown writes hot chunks and sessions here; the next start restores and deletes it
+CHECKPOINT_PATH = Path(os.getenv("GAME_CHECKPOINT_PATH") or DATA_DIR / f"checkpoint-{SHARD_ID}.bin")
+# how long a session parked by a restart keeps its cell for the reconnecting player
+PARKED_SESSION_TTL = float(os.getenv("GAME_PARKED_SESSION_TTL", "60"))
+# a connection that drops without a close frame keeps its player this long for a resume
+RESUME_GRACE = float(os.getenv("GAME_RESUME_GRACE", "20"))
+# changes remembered per chunk for delta catch-up; a client further behind gets the full matrix
+CHUNK_CHANGE_LOG = int(os.getenv("GAME_CHUNK_CHANGE_LOG", "256"))
+
+# new sockets are placed by an admission queue: at most ADMISSION_RATE per second (<= 0: no
+# limit), up to ADMISSION_BATCH per hub lock hold, gathering a burst for ADMISSION_WINDOW seconds
+ADMISSION_RATE = float(os.getenv("GAME_ADMISSION_RATE", "200"))
+ADMISSION_BATCH = int(os.getenv("GAME_ADMISSION_BATCH", "50"))
+ADMISSION_WINDOW = float(os.getenv("GAME_ADMISSION_WINDOW", "0.02"))
+
+# sockets without input for IDLE_HIBERNATE_SECONDS stop receiving chunk updates (<= 0: never);
+# while hibernating they get a small summary every HIBERNATE_SUMMARY_SECONDS (<= 0: nothing)
+IDLE_HIBERNATE_SECONDS = float(os.getenv("GAME_IDLE_HIBERNATE_SECONDS", "300"))
+HIBERNATE_SUMMARY_SECONDS = float(os.getenv("GAME_HIBERNATE_SUMMARY_SECONDS", "30"))
+
+# per-client pacing: chunk frames to a socket go out at most once per max(rtt / 2, 2 * send time),
+# clamped to [PACER_MIN_INTERVAL, PACER_MAX_INTERVAL]; rtt comes from a ping every PING_INTERVAL
+PING_INTERVAL = float(os.getenv("GAME_PING_INTERVAL", "5"))
+PACER_MIN_INTERVAL = float(os.getenv("GAME_PACER_MIN_INTERVAL", "0"))
+PACER_MAX_INTERVAL = float(os.getenv("GAME_PACER_MAX_INTERVAL", "1"))
+
+# /spectate: chunks one spectator socket may watch
+SPECTATE_MAX_CHUNKS = int(os.getenv("GAME_SPECTATE_MAX_CHUNKS", "16"))
+
+# event-loop watchdog: heartbeat period and how long a block may last before it is logged
+LOOP_LAG_INTERVAL = float(os.getenv("GAME_LOOP_LAG_INTERVAL", "0.05"))
+LOOP_LAG_THRESHOLD = float(os.getenv("GAME_LOOP_LAG_THRESHOLD", "0.25"))
+
+# /metrics labels per-chunk watcher counts for the busiest chunks only, to bound the series count
+METRICS_TOP_CHUNKS = int(os.getenv("GAME_METRICS_TOP_CHUNKS", "10"))
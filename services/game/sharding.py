@@ -0,0 +1,73 @@
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping
+
+from jose import jwt
+
+from .ids import ChunkKey, coords_from_key
+from .settings import JWT_SECRET, JWT_ALG, HANDOFF_TTL
+
+# a worker closes a socket whose player lives elsewhere with this code, right after the handoff frame
+HANDOFF_CLOSE_CODE = 4000
+
+
+@dataclass(frozen=True)
+class ShardMap:
+    """
+    Chunk -> shard ownership. Chunks are grouped into ``region`` x ``region`` blocks and
+    every block lives on exactly one shard, so most border crossings stay local.
+    The mapping is a pure function of the coordinates: every process agrees on it
+    without talking to the others.
+    """
+    count: int
+    region: int = 4
+
+    def shard_for(self, key: ChunkKey) -> int:
+        if self.count <= 1:
+            return 0
+        cx, cy = coords_from_key(key)
+        bx, by = cx // self.region, cy // self.region
+        return ((bx * 73856093) ^ (by * 19349663)) % self.count
+
+
+@dataclass(frozen=True)
+class HandoffTicket:
+    user_id: str
+    chunk_id: str
+    row: int
+    col: int
+    color: int
+
+
+def issue_handoff(ticket: HandoffTicket) -> str:
+    """Signs a ticket with the JWT secret so only a shard can mint one."""
+    claims: Dict[str, Any] = {
+        "typ": "handoff",
+        "sub": ticket.user_id,
+        "chunk": ticket.chunk_id,
+        "row": ticket.row,
+        "col": ticket.col,
+        "color": ticket.color,
+        "exp": int(time.time()) + HANDOFF_TTL,
+    }
+    return jwt.encode(claims, JWT_SECRET, algorithm=JWT_ALG)
+
+
+def is_handoff(claims: Mapping[str, Any]) -> bool:
+    """Tickets share the login tokens' secret, so a verifier must turn these claims away."""
+    return claims.get("typ") == "handoff"
+
+
+def read_handoff(token: str) -> HandoffTicket:
+    """Raises ``JWTError`` for forged/expired tickets and ``ValueError`` for anything that is not a handoff."""
+    claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+    if not is_handoff(claims):
+        raise ValueError("not a handoff ticket")
+    return HandoffTicket(
+        user_id=str(claims["sub"]),
+        chunk_id=str(claims["chunk"]),
+        row=int(claims["row"]),
+        col=int(claims["col"]),
+        color=int(claims["color"]),
+    )
@@ -0,0 +1,90 @@
+"""
+Launches the sharded game service on one machine::
+
+    python -m services.game.shards --workers 4 --port 7002
+
+Starts ``--workers`` uvicorn processes running ``services.game.main:app`` (worker i
+listens on ``--base-port + i`` with GAME_SHARD_ID=i), the chunk bus broker on
+``--bus-port`` and the router on ``--port``.
+All workers share world.db and players.db (SQLite in WAL mode); each one only
+writes the chunks its shard owns. message.json and history.json are rewritten whole on
+every change, so they cannot be shared: before the workers start, message.json is split
+into one ``message.shard-N.json`` per worker (by chunk owner) and each worker appends to
+its own ``history.shard-N.json``; both are folded back once every worker has exited.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+from typing import List
+
+from .db import clear_player_bits_all, fold_shard_messages, split_messages_by_shard
+from .db_history import fold_shard_histories
+from .sharding import ShardMap
+
+
+def _uvicorn(app: str, host: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", host, "--port", str(port)],
+        env=env,
+    )
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7002)
+    parser.add_argument("--base-port", type=int, default=int(os.getenv("GAME_SHARD_BASE_PORT", "7100")))
+    parser.add_argument("--region", type=int, default=int(os.getenv("GAME_SHARD_REGION", "4")))
+    parser.add_argument("--bus-port", type=int, default=7199)
+    args = parser.parse_args(argv)
+
+    # workers skip this on startup: with several processes it must happen exactly once
+    clear_player_bits_all()
+    # files a previous run left behind (it did not get to fold them) go back first
+    fold_shard_messages()
+    fold_shard_histories()
+    split_messages_by_shard(args.workers, ShardMap(args.workers, args.region).shard_for)
+
+    env = dict(os.environ)
+    env.update({
+        "GAME_SHARDS": str(args.workers),
+        "GAME_SHARD_REGION": str(args.region),
+        "GAME_SHARD_HOST": "127.0.0.1",
+        "GAME_SHARD_BASE_PORT": str(args.base_port),
+        "GAME_BUS_ADDRESS": f"127.0.0.1:{args.bus_port}",
+    })
+    # workers retry the broker until GAME_BUS_CONNECT_TIMEOUT, so they may start while it is still binding
+    broker = subprocess.Popen([sys.executable, "-m", "services.game.bus"], env=env)
+    procs = [broker] + [
+        _uvicorn("services.game.main:app", "127.0.0.1", args.base_port + i, {**env, "GAME_SHARD_ID": str(i)})
+        for i in range(args.workers)
+    ]
+    procs.append(_uvicorn("services.game.router:app", args.host, args.port, env))
+
+    def _stop(*_):
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        while all(p.poll() is None for p in procs):
+            try:
+                procs[-1].wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                pass
+    finally:
+        _stop()
+        for p in procs:
+            p.wait()
+        fold_shard_messages()
+        fold_shard_histories()
+    return max((p.returncode or 0) for p in procs)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Read-only spectators of chunks (``/spectate?chunk=0,0&chunk=1,0``).
+
+A spectator has no player, no session and never takes the hub lock. It listens to the
+same chunk bus the hub publishes on and is handed the very frame objects the hub
+already encoded, so a chunk update costs one encode however many spectators watch it.
+The latest matrix of every spectated chunk is kept, so a new spectator starts from it
+without encoding anything either. Frames go out through a ``ClientPacer`` per socket:
+a slow spectator gets fewer, fresher frames and never holds up the others.
+"""
+from __future__ import annotations
+import logging
+from typing import Callable, Dict, Iterable, Set
+
+from fastapi import WebSocket
+
+from .bus import ChunkBus
+from .ids import ChunkKey
+from .pacer import MATRIX_PREFIX, ClientPacer, Send
+
+LOGGER = logging.getLogger("voxel-spectate")
+if not LOGGER.handlers:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+
+class Spectators:
+    def __init__(self, bus: ChunkBus, snapshot: Callable[[ChunkKey], str], send: Send,
+                 min_interval: float = 0.0, max_interval: float = 1.0) -> None:
+        self._bus = bus
+        self._snapshot = snapshot  # encodes a chunk's current matrix; only for chunks nobody spectates yet
+        self._send = send
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._pacers: Dict[WebSocket, ClientPacer] = {}
+        self._keys: Dict[WebSocket, Set[ChunkKey]] = {}
+        self._watchers: Dict[ChunkKey, Set[ClientPacer]] = {}
+        self._latest: Dict[ChunkKey, str] = {}
+
+    def count(self) -> int:
+        return len(self._pacers)
+
+    def add(self, ws: WebSocket, keys: Iterable[ChunkKey]) -> None:
+        pacer = self._pacers[ws] = ClientPacer(ws, self._send, self.remove, self._min_interval, self._max_interval)
+        wanted = self._keys[ws] = set(keys)
+        for key in wanted:
+            watchers = self._watchers.get(key)
+            if watchers is None:
+                watchers = self._watchers[key] = set()
+                self._bus.subscribe(key, self._deliver)
+            watchers.add(pacer)
+            latest = self._latest.get(key)
+            if latest is None:
+                latest = self._latest[key] = self._snapshot(key)
+            pacer.offer(key, latest)
+
+    def remove(self, ws: WebSocket) -> None:
+        pacer = self._pacers.pop(ws, None)
+        if pacer is None:
+            return
+        pacer.close()
+        for key in self._keys.pop(ws, ()):
+            watchers = self._watchers.get(key)
+            if watchers is None:
+                continue
+            watchers.discard(pacer)
+            if not watchers:
+                del self._watchers[key], self._latest[key]
+                self._bus.unsubscribe(key, self._deliver)
+
+    async def _deliver(self, key: ChunkKey, text: str) -> None:
+        if text.startswith(MATRIX_PREFIX):
+            self._latest[key] = text
+        for pacer in self._watchers.get(key, ()):
+            pacer.deliver(key, text)
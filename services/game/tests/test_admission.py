@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from services.game.admission import AdmissionController
+
+pytest_plugins = "pytest_asyncio"
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, txt: str):
+        self.sent.append(json.loads(txt))
+
+
+class RecordingHub:
+    def __init__(self, fail=()):
+        self.batches = []
+        self.fail = fail
+
+    async def connect_batch(self, entries):
+        self.batches.append([e[0] for e in entries])
+        return [ValueError("full") if e[0] in self.fail else None for e in entries]
+
+
+@pytest.mark.asyncio
+async def test_burst_is_placed_in_batches():
+    hub = RecordingHub()
+    admission = AdmissionController(hub.connect_batch, rate=0, batch=10, window=0.01)
+    admission.start()
+    try:
+        sockets = [FakeWebSocket() for _ in range(25)]
+        await asyncio.gather(*(admission.admit(ws) for ws in sockets))
+    finally:
+        await admission.stop()
+
+    assert [len(b) for b in hub.batches] == [10, 10, 5]
+    assert [ws for b in hub.batches for ws in b] == sockets  # first come, first placed
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_spreads_a_storm_and_reports_queue_positions():
+    hub = RecordingHub()
+    admission = AdmissionController(hub.connect_batch, rate=100, batch=5, window=0, feedback_interval=0)
+    admission.start()
+    try:
+        sockets = [FakeWebSocket() for _ in range(20)]
+        start = time.monotonic()
+        await asyncio.gather(*(admission.admit(ws) for ws in sockets))
+        elapsed = time.monotonic() - start
+    finally:
+        await admission.stop()
+
+    # a burst of 5, then 15 more at 100/s
+    assert elapsed >= 0.12
+    assert all(len(b) <= 5 for b in hub.batches)
+    last = sockets[-1].sent
+    assert last[0] == {"type": "queue", "position": 20, "waiting": 20}
+    positions = [m["position"] for m in last]
+    assert positions == sorted(positions, reverse=True) and positions[-1] < 20
+    assert sockets[0].sent == []  # placed in the first batch, never told to wait
+
+
+@pytest.mark.asyncio
+async def test_lone_connect_spends_one_token_not_the_whole_burst():
+    hub = RecordingHub()
+    admission = AdmissionController(hub.connect_batch, rate=5, batch=5, window=0)
+    admission.start()
+    try:
+        await admission.admit(FakeWebSocket())
+        start = time.monotonic()
+        await asyncio.gather(*(admission.admit(FakeWebSocket()) for _ in range(4)))
+        elapsed = time.monotonic() - start
+    finally:
+        await admission.stop()
+
+    # the four left in the bucket cover the storm; no refill at 5/s is needed
+    assert elapsed < 0.1
+    assert [len(b) for b in hub.batches] == [1, 4]
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_only_their_own_socket():
+    bad = FakeWebSocket()
+    hub = RecordingHub(fail={bad})
+    admission = AdmissionController(hub.connect_batch, rate=0, batch=10, window=0.01)
+    admission.start()
+    try:
+        good = FakeWebSocket()
+        results = await asyncio.gather(admission.admit(good), admission.admit(bad), return_exceptions=True)
+    finally:
+        await admission.stop()
+
+    assert results[0] is None
+    assert isinstance(results[1], ValueError)
@@ -0,0 +1,88 @@
+import random
+
+from services.game.bench import loadtest as lt
+
+
+def test_percentiles_use_nearest_rank_in_ms():
+    samples = [i / 1000 for i in range(1, 101)]  # 1..100 ms
+    out = lt.percentiles(samples)
+    assert out["count"] == 100
+    assert (out["p50"], out["p90"], out["p99"], out["max"]) == (50.0, 90.0, 99.0, 100.0)
+    assert lt.percentiles([]) == {"count": 0}
+
+
+def test_replay_scripts_fold_sleep_tokens_into_delays():
+    history = {
+        "p1": {"chunks": {
+            "0,0": {"actions": [1, 7, 7, 4, 8, 5, 6], "last_ts": 0},
+            "1,0": {"actions": [3], "last_ts": 0},
+        }},
+        "idle": {"chunks": {"0,0": {"actions": [7, 9], "last_ts": 0}}},
+    }
+    scripts = lt.replay_scripts(history, max_gap=1.0, speed=2.0)
+    # DM tokens are skipped, a one minute pause is capped at max_gap, idle players are dropped
+    assert scripts == [[(0.0, "right"), (1.0, "down"), (1.0, "c"), (0.0, "up")]]
+
+
+def test_random_walk_is_reproducible_per_seed():
+    a = lt.random_walk(random.Random(7), rate=5.0)
+    b = lt.random_walk(random.Random(7), rate=5.0)
+    assert [next(a) for _ in range(20)] == [next(b) for _ in range(20)]
+
+
+def test_compare_flags_throughput_and_latency_regressions():
+    baseline = {"moves_per_sec": 100.0, "latency_ms": {"p50": 5.0, "p99": 20.0}}
+    assert lt.compare({"moves_per_sec": 95.0, "latency_ms": {"p50": 5.2, "p99": 21.0}}, baseline, 0.1) == []
+    problems = lt.compare({"moves_per_sec": 80.0, "latency_ms": {"p50": 5.0, "p99": 30.0}}, baseline, 0.1)
+    assert len(problems) == 2
+
+
+def test_micro_cases_cover_each_hot_path_family():
+    from services.game.bench import micro
+    families = {name.split(".")[0] for name in micro.CASES}
+    assert families == {"bits", "chunkdb", "history", "messages", "chat"}
+
+
+def test_micro_measure_and_baseline_compare(tmp_path):
+    from services.game.bench import micro
+    fn = micro.CASES["bits.make_color"](random.Random("1:bits.make_color"), tmp_path)
+    result = micro.measure(fn, repeat=2, min_time=0.001)
+    assert result["best_us"] > 0 and result["loops"] >= 1
+
+    now = {"a": {"best_us": 12.0}, "b": {"best_us": 10.0}, "new": {"best_us": 1.0}}
+    baseline = {"a": {"best_us": 10.0}, "b": {"best_us": 10.0}}
+    assert micro.compare(now, baseline, tolerance=0.15) == [("a", 1.2)]
+
+
+def test_micro_cases_leave_repository_data_and_globals_alone(tmp_path):
+    import sys
+    from pathlib import Path
+    from services.game import db, db_history
+    from services.game.bench import micro
+    chats = Path(micro.REPO_ROOT) / "services" / "chat" / "data" / "chats.json"
+    before = chats.stat().st_mtime_ns
+    paths = (db_history.HISTORIES_JSON_PATH, db.MESSAGES_JSON_PATH)
+    chat = sys.modules.get("services.chat.main")
+
+    names = ["history.append_player_action[10 players]", "messages.save_message[100]",
+             "chat.history_between[10000 messages]"]
+    results = micro.run_cases(names, seed=1, repeat=1, min_time=0.001)
+    assert set(results) == set(names)
+
+    # a chat module the run imported into its (now deleted) scratch dir is gone again
+    assert sys.modules.get("services.chat.main") is chat
+    if chat is not None:
+        assert len(chat.chats_data["chats"][0]["messages"]) != 10_000
+    assert (db_history.HISTORIES_JSON_PATH, db.MESSAGES_JSON_PATH) == paths
+    assert chats.stat().st_mtime_ns == before
+
+
+def test_memory_run_restores_the_hub_storage_functions():
+    import asyncio
+    from services.game import hub as hub_module
+    from services.game.bench import memory
+    names = ("load_chunk", "save_chunk", "get_player_position", "save_player_position")
+    before = [getattr(hub_module, name) for name in names]
+    result = asyncio.run(memory._measure(20))
+    assert result["players"] == 20
+    assert [getattr(hub_module, name) for name in names] == before
@@ -0,0 +1,133 @@
+import asyncio
+import pytest
+
+from services.game import bus as bs
+from services.game.ids import key_from_coords as key
+
+pytest_plugins = "pytest_asyncio"
+
+
+class Inbox:
+    def __init__(self):
+        self.frames = []
+        self.arrived = asyncio.Event()
+
+    async def __call__(self, key, frame):
+        self.frames.append((key, frame))
+        self.arrived.set()
+
+
+@pytest.mark.asyncio
+async def test_in_process_bus_delivers_only_to_chunk_subscribers():
+    bus = bs.InProcessBus()
+    a, b = Inbox(), Inbox()
+    bus.subscribe(key(0, 0), a)
+    bus.subscribe(key(0, 0), a)  # idempotent
+    bus.subscribe(key(1, 0), b)
+    assert bus.wants(key(0, 0)) and not bus.wants(key(2, 2))
+
+    await bus.publish(key(0, 0), "x")
+    assert a.frames == [(key(0, 0), "x")] and b.frames == []
+
+    bus.unsubscribe(key(0, 0), a)
+    await bus.publish(key(0, 0), "y")
+    assert a.frames == [(key(0, 0), "x")]
+    assert not bus.wants(key(0, 0))
+
+
+def test_parse_address():
+    assert bs.parse_address("127.0.0.1:7199") == ("127.0.0.1", 7199)
+    assert bs.parse_address("/tmp/voxel.sock") == "/tmp/voxel.sock"
+
+
+@pytest.mark.asyncio
+async def test_local_socket_bus_relays_between_processes_through_broker():
+    broker = bs.BusBroker(("127.0.0.1", 0), b"k")
+    broker.start()
+    publisher = bs.LocalSocketBus(broker.address, b"k")
+    viewer = bs.LocalSocketBus(broker.address, b"k")
+    inbox, own = Inbox(), Inbox()
+    viewer.subscribe(key(3, 4), inbox)  # before start: replayed to the broker on connect
+    try:
+        await publisher.start()
+        await viewer.start()
+        publisher.subscribe(key(3, 4), own)
+        await asyncio.sleep(0.05)
+
+        for i in range(3):
+            await publisher.publish(key(3, 4), f"frame-{i}")
+        await publisher.publish(key(9, 9), "nobody")
+        await asyncio.wait_for(inbox.arrived.wait(), 2)
+        while len(inbox.frames) < 3:
+            await asyncio.sleep(0.01)
+        # in order, exactly once, nothing for chunks the viewer does not watch
+        assert inbox.frames == [(key(3, 4), f"frame-{i}") for i in range(3)]
+        assert [f for _, f in own.frames] == ["frame-0", "frame-1", "frame-2"]
+    finally:
+        await publisher.close()
+        await viewer.close()
+        broker.close()
+
+
+@pytest.mark.asyncio
+async def test_local_socket_bus_waits_for_a_broker_that_starts_late():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        address = s.getsockname()
+    brokers = []
+
+    async def start_broker_later():
+        await asyncio.sleep(0.2)
+        brokers.append(bs.BusBroker(address, b"k"))
+        brokers[0].start()
+
+    bus = bs.LocalSocketBus(address, b"k", connect_timeout=5)
+    late = asyncio.create_task(start_broker_later())
+    try:
+        await bus.start()
+        assert brokers
+    finally:
+        await late
+        await bus.close()
+        for broker in brokers:
+            broker.close()
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        nobody = s.getsockname()
+    gone = bs.LocalSocketBus(nobody, b"k", connect_timeout=0.1)
+    with pytest.raises(ConnectionError):
+        await gone.start()
+
+
+@pytest.mark.asyncio
+async def test_publish_does_not_wait_for_a_slow_broker():
+    import threading
+    import time
+    broker = bs.BusBroker(("127.0.0.1", 0), b"k")
+    broker.start()
+    bus = bs.LocalSocketBus(broker.address, b"k", max_pending=4)
+    try:
+        await bus.start()
+        stalled = threading.Event()
+        sent = []
+
+        def backed_up(data):
+            stalled.wait(2)
+            sent.append(data)
+        bus._conn.send_bytes = backed_up
+
+        await bus.publish(key(1, 1), "frame-0")
+        await asyncio.sleep(0.05)  # the writer takes it and stalls
+        start = time.monotonic()
+        for i in range(1, 10):
+            await bus.publish(key(1, 1), f"frame-{i}")
+        assert time.monotonic() - start < 0.5  # nothing waited for the broker
+        stalled.set()
+        await bus.close()
+        # the writer had one frame in hand and queued four more; the rest were dropped
+        assert [bs._decode(d)[2] for d in sent] == [f"frame-{i}" for i in range(5)]
+    finally:
+        await bus.close()
+        broker.close()
@@ -0,0 +1,31 @@
+import pytest
+import torch
+
+from services.game import checkpoint as cp
+
+
+def test_checkpoint_roundtrip_is_copy_on_write(tmp_path):
+    path = tmp_path / "checkpoint.bin"
+    boards = {7: torch.arange(16, dtype=torch.uint8).view(4, 4), 2**61 + 3: torch.full((4, 4), 9, dtype=torch.uint8)}
+    sessions = [cp.SessionRecord("00000101", 7, 1, 2, 0b1010_1100, 0b10), cp.SessionRecord("אבג", 7, 3, 3, 4, 0)]
+    cp.write_checkpoint(path, 4, 4, boards, sessions)
+
+    chunks, restored = cp.read_checkpoint(path, 4, 4)
+    assert restored == sessions
+    assert set(chunks) == set(boards)
+    assert all(torch.equal(chunks[k], boards[k]) for k in boards)
+
+    # writes land in private pages, not in the file
+    chunks[7][0, 0] = 200
+    again, _ = cp.read_checkpoint(path, 4, 4)
+    assert int(again[7][0, 0]) == 0
+
+
+def test_checkpoint_rejects_other_geometry_and_garbage(tmp_path):
+    path = tmp_path / "checkpoint.bin"
+    cp.write_checkpoint(path, 4, 4, {1: torch.zeros((4, 4), dtype=torch.uint8)}, [])
+    with pytest.raises(ValueError):
+        cp.read_checkpoint(path, 64, 64)
+    path.write_bytes(b"VXCP" + bytes(3))
+    with pytest.raises(ValueError):
+        cp.read_checkpoint(path, 4, 4)
@@ -0,0 +1,80 @@
+import sqlite3
+
+import torch
+
+from services.game.db import ChunkDB
+from services.game.ids import coords_from_key, key_from_coords
+
+
+def _world(tmp_path, span=range(-5, 6)):
+    db = ChunkDB(tmp_path / "world.db")
+    for x in span:
+        for y in span:
+            db.save_chunk(key_from_coords(x, y), torch.full((64, 64), (x * 11 + y) % 255 + 1, dtype=torch.uint8))
+    return db
+
+
+def test_rect_query_returns_only_chunks_inside(tmp_path):
+    db = _world(tmp_path)
+    found = {coords_from_key(k): board for k, board in db.iter_chunks_in_rect(-1, 2, 1, 7)}
+    assert set(found) == {(x, y) for x in (-1, 0, 1) for y in (2, 3, 4, 5)}
+    assert int(found[(1, 3)][0, 0]) == 15
+    assert {coords_from_key(k) for k in db.iter_keys_in_rect(9, 9, 20, 20)} == set()
+
+
+def test_radius_query_is_a_disk(tmp_path):
+    db = _world(tmp_path)
+    found = {coords_from_key(k) for k, _ in db.iter_chunks_in_radius(0, 0, 2)}
+    assert found == {(x, y) for x in range(-2, 3) for y in range(-2, 3) if x * x + y * y <= 4}
+
+
+def test_range_query_uses_coordinate_index(tmp_path):
+    db = _world(tmp_path, range(2))
+    plan = db.conn.execute("EXPLAIN QUERY PLAN SELECT id FROM chunks WHERE cx BETWEEN 0 AND 1 AND cy BETWEEN 0 AND 1")
+    assert "chunks_by_coords" in " ".join(str(r[-1]) for r in plan)
+
+
+def test_range_query_is_lazy(tmp_path):
+    db = _world(tmp_path)
+    rows = db.iter_chunks_in_rect(-5, -5, 5, 5)
+    assert next(rows)[1].shape == (64, 64)
+    rows.close()
+
+
+def test_coordinate_columns_are_backfilled(tmp_path):
+    path = tmp_path / "world.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, w INTEGER NOT NULL, h INTEGER NOT NULL,"
+                 " data BLOB NOT NULL, last_used INTEGER)")
+    conn.execute("INSERT INTO chunks VALUES (?, 64, 64, ?, 0)", (key_from_coords(-3, 5), bytes(64 * 64)))
+    conn.commit()
+    conn.close()
+
+    db = ChunkDB(path)
+    assert list(db.iter_keys_in_rect(-3, 5, -3, 5)) == [key_from_coords(-3, 5)]
+
+
+def test_empty_boards_are_not_stored(tmp_path):
+    db = ChunkDB(tmp_path / "world.db")
+    key = key_from_coords(2, 2)
+    db.save_chunk(key, torch.zeros((64, 64), dtype=torch.uint8))
+    assert db.load_chunk(key) is None
+
+    board = torch.zeros((64, 64), dtype=torch.uint8)
+    board[3, 3] = 1  # a player
+    db.save_chunk(key, board)
+    assert db.list_chunk_keys() == [key]
+    db.save_chunk(key, torch.zeros((64, 64), dtype=torch.uint8))
+    assert db.list_chunk_keys() == []
+
+
+def test_compact_drops_stored_zero_boards(tmp_path):
+    from services.game import compact
+    path = tmp_path / "world.db"
+    db = _world(tmp_path, range(2))
+    # rows written before empty chunks became implicit
+    db.conn.executemany("INSERT INTO chunks (id, cx, cy, w, h, data) VALUES (?, ?, ?, 64, 64, ?)",
+                        [(key_from_coords(9, y), 9, y, bytes(64 * 64)) for y in range(10)])
+    db.conn.close()
+    assert compact.main(["--db", str(path)]) == 0
+    assert len(ChunkDB(path).list_chunk_keys()) == 4
@@ -37,6 +37,11 @@ class FakeWebSocket:
     def __repr__(self):
         return f"<FakeWS id={id(self)}>"
 
+
+async def settle():
+    """Lets the per-client pacers send what the hub queued."""
+    await asyncio.sleep(0.01)
+
 @pytest.fixture(autouse=True)
 def configure_hub(monkeypatch):
     """
@@ -61,9 +66,10 @@ def configure_hub(monkeypatch):
 
 
 def test_chunk_id_and_coords_roundtrip():
-    assert hd.chunk_id_from_coords(3, -2) == "3,-2"
-    assert hd.coords_from_chunk_id("10,5") == (10, 5)
-    assert hd.coords_from_chunk_id(hd.chunk_id_from_coords(0, 0)) == (0, 0)
+    from services.game.ids import chunk_id_from_coords, coords_from_chunk_id
+    assert chunk_id_from_coords(3, -2) == "3,-2"
+    assert coords_from_chunk_id("10,5") == (10, 5)
+    assert coords_from_chunk_id(chunk_id_from_coords(0, 0)) == (0, 0)
 
 
 def test_neighbor_cid():
@@ -87,19 +93,42 @@ def test_neighbor_cid():
 
 
 @pytest.mark.asyncio
-async def test_ensure_chunk_creates_and_saves(monkeypatch):
+async def test_empty_chunk_is_virtual_until_written(monkeypatch, tmp_path):
     """
-    אם אין chunk קיים - _ensure_chunk צריכה ליצור מטריצה של אפסים ולשמור אותה באמצעות save_chunk.
-    מכיוון שה־save_chunk הוחלף ב־FakeDB, נוכל בוודאות שהמטען נשמר.
+    A chunk with no stored row is served from the hub's shared zero board and is not
+    written to the DB; _ensure_chunk hands out a private copy for the first mutation.
     """
-    # נשתמש בהופעה של Hub שתשתמש ב־FakeDB
+    from game import db as chunk_db
+    monkeypatch.setattr(chunk_db, "W", hd.W)
+    monkeypatch.setattr(chunk_db, "H", hd.H)
+    db = chunk_db.ChunkDB(tmp_path / "world.db")  # a real ChunkDB (it drops all-zero rows), but a throwaway one
+    monkeypatch.setattr(hd, "load_chunk", db.load_chunk)
+    monkeypatch.setattr(hd, "save_chunk", db.save_chunk)
     hub = hd.Hub()
-    cid = hub.root_cid
-    # אחרי יצירה, צריך להיות קיים cid במאגר ה־FakeDB (load_chunk מאפשר גישה דרך hd.load_chunk)
-    loaded = hd.load_chunk(cid)
-    assert loaded is not None
-    assert isinstance(loaded, torch.Tensor)
-    assert loaded.shape == (hd.W, hd.H)
+    key = hub._root_chunk_key
+    assert hd.load_chunk(key) is None
+    assert hub._chunk(key) is hub._empty
+    assert hub.loaded_chunk_count() == 0
+    # nor does it get a free-cell index of its own
+    other = hd.key_from_coords(5, 5)
+    hub._chunk(other)
+    assert hub._free[key] is hub._free[other] is hub._all_free
+
+    board = hub._ensure_chunk(key)
+    assert board is not hub._empty and torch.equal(board, hub._empty)
+    assert isinstance(hub._free[key], hd.FreeCells) and len(hub._free[key]) == hd.H * hd.W
+    board[0, 0] = 5
+    hub._save(key, board, [(0, 0)])
+    assert hub._empty.sum() == 0
+    loaded = hd.load_chunk(key)
+    assert isinstance(loaded, torch.Tensor) and loaded.shape == (hd.H, hd.W)
+
+    # back to all-zero: the hub shares the zero board again
+    board[0, 0] = 0
+    hub._save(key, board, [(0, 0)])
+    assert hub._chunk(key) is hub._empty
+    assert hub._free[key] is hub._all_free
+    assert db.load_chunk(key) is None
 
 
 @pytest.mark.asyncio
@@ -179,12 +208,438 @@ async def test_move_within_bounds_moves_and_broadcasts(monkeypatch):
 
 @pytest.mark.asyncio
 async def test_color_plus_plus_updates_and_broadcasts(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "append_player_action", lambda *a, **k: None)
     hub = hd.Hub()
     ws = FakeWebSocket()
     await hub.connect(ws)
 
     # נקרא ל color_plus_plus
     await hub.color_plus_plus(ws)
+    await settle()
 
     # וודא שנשלחה הודעה לשידור
     assert len(ws.sent) >= 1
+
+
+@pytest.mark.asyncio
+async def test_connect_spawns_in_neighbor_chunk_when_root_is_full(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    root = hub._root_chunk_key
+    hub._ensure_chunk(root)  # an empty chunk shares the read-only AllFree index until then
+    for r in range(hd.H):
+        for c in range(hd.W):
+            hub._free[root].occupy(r, c)
+
+    ws = FakeWebSocket()
+    await hub.connect(ws)
+
+    session = hub._sessions[ws]
+    assert session.chunk_key != root
+    assert not hub._free[session.chunk_key].is_free(session.row, session.col)
+
+
+@pytest.mark.asyncio
+async def test_view_radius_subscribes_to_surrounding_chunks(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    ws = FakeWebSocket()
+    await hub.connect(ws)
+    root = hub._root_chunk_key
+
+    await hub.set_view_radius(ws, 1)
+    frames = [json.loads(t) for t in ws.sent]
+    viewport = next(f for f in frames if f["type"] == "viewport")
+    assert viewport["center"] == "0,0"
+    assert len(viewport["subscribed"]) == 8 and viewport["unsubscribed"] == []
+    assert {f["chunk_id"] for f in frames if f["type"] == "matrix"} >= set(viewport["subscribed"])
+    assert len(hub._sessions[ws].subs) == 9
+
+    # an update in a neighbouring chunk reaches the viewer, exactly once
+    await settle()
+    ws.sent.clear()
+    await hub._broadcast_chunk(hd.key_from_coords(1, 1))
+    await settle()
+    assert [json.loads(t)["chunk_id"] for t in ws.sent] == ["1,1"]
+
+    # re-centering one chunk to the right swaps a column of three chunks
+    added, removed = hub._resubscribe(hub._sessions[ws], hd.key_from_coords(1, 0))
+    assert sorted(map(hd.id_from_key, added)) == ["2,-1", "2,0", "2,1"]
+    assert sorted(map(hd.id_from_key, removed)) == ["-1,-1", "-1,0", "-1,1"]
+    assert hub._sessions[ws] not in hub._chunk_watchers.get(hd.key_from_coords(-1, 0), set())
+
+
+@pytest.mark.asyncio
+async def test_view_radius_is_clamped(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "MAX_VIEW_RADIUS", 1)
+    hub = hd.Hub()
+    ws = FakeWebSocket()
+    await hub.connect(ws)
+    await hub.set_view_radius(ws, 50)
+    assert hub._sessions[ws].view_radius == 1
+    await hub.set_view_radius(ws, 0)
+    assert hub._sessions[ws].subs == (hub._root_chunk_key,)
+
+
+@pytest.mark.asyncio
+async def test_move_into_foreign_shard_hands_off_with_ticket(monkeypatch):
+    from game.sharding import ShardMap, read_handoff
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: ("0,0", 1, hd.W - 1))
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "append_player_action", lambda *a, **k: None)
+    shards = ShardMap(2, region=1)
+    assert shards.shard_for(hd.key_from_coords(0, 0)) == 0 and shards.shard_for(hd.key_from_coords(1, 0)) == 1
+
+    west = hd.Hub(shards, 0)
+    ws = FakeWebSocket()
+    await west.connect(ws, Claims("00000101", {}))
+    color = west._sessions[ws].color
+    ws.sent.clear()
+
+    await west.move(ws, 0, 1)
+    frame = json.loads(ws.sent[-1])
+    assert frame["type"] == "handoff" and frame["shard"] == 1
+    assert ws not in west._sessions
+    assert west._free[hd.key_from_coords(0, 0)].is_free(1, hd.W - 1)
+
+    ticket = read_handoff(frame["ticket"])
+    assert (ticket.user_id, ticket.chunk_id, ticket.row, ticket.col) == ("00000101", "1,0", 1, 0)
+
+    # the owning shard places the player exactly where the ticket says, keeping the colour
+    east = hd.Hub(shards, 1)
+    ws2 = FakeWebSocket()
+    await east.connect(ws2, Claims("00000101", {}), ticket)
+    session = east._sessions[ws2]
+    assert (session.chunk_key, session.row, session.col) == (hd.key_from_coords(1, 0), 1, 0)
+    assert session.color == color
+
+
+@pytest.mark.asyncio
+async def test_connect_of_a_foreign_player_hands_off_and_fails(monkeypatch):
+    from game.sharding import ShardMap
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: ("1,0", 2, 3))
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    west = hd.Hub(ShardMap(2, region=1), 0)
+    ws = FakeWebSocket()
+
+    with pytest.raises(hd.HandedOff):
+        await west.connect(ws, Claims("00000101", {}))
+    assert json.loads(ws.sent[-1])["type"] == "handoff"
+    assert ws not in west._sessions and west.socket_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_viewport_reaches_chunks_of_another_hub_over_shared_bus(monkeypatch):
+    from game.bus import InProcessBus
+    from game.sharding import ShardMap
+    from game.tokens import Claims
+    positions = {"west": ("0,0", 1, 1), "east": ("1,0", 1, 1)}
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: positions[user_id])
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "append_player_action", lambda *a, **k: None)
+
+    class SharedBus(InProcessBus):
+        shared = True
+
+    bus, shards = SharedBus(), ShardMap(2, region=1)
+    west, east = hd.Hub(shards, 0, bus), hd.Hub(shards, 1, bus)
+    ws_west, ws_east = FakeWebSocket(), FakeWebSocket()
+    await west.connect(ws_west, Claims("west", {}))
+    await east.connect(ws_east, Claims("east", {}))
+    await east.set_view_radius(ws_east, 1)
+    assert hd.key_from_coords(0, 0) in east._sessions[ws_east].subs
+    assert hd.key_from_coords(0, 0) not in east._chunks  # watched, not simulated
+
+    await settle()
+    ws_east.sent.clear()
+    await west.move(ws_west, 0, 1)
+    await settle()
+    frames = [json.loads(t) for t in ws_east.sent]
+    assert [f["chunk_id"] for f in frames] == ["0,0"]
+    assert frames[0]["data"][1 * hd.W + 1] == 0 and frames[0]["data"][1 * hd.W + 2] != 0
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_parks_sessions_across_restart(monkeypatch, tmp_path):
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    path = tmp_path / "checkpoint.bin"
+
+    old = hd.Hub()
+    ws = FakeWebSocket()
+    await old.connect(ws, Claims("00000101", {}))
+    before = old._sessions[ws]
+    assert await old.save_checkpoint(path) == 1
+    assert ws not in old._sessions
+
+    new = hd.Hub()
+    assert new.restore_checkpoint(path) and not path.exists()
+    key, row, col = before.chunk_key, before.row, before.col
+    assert not new._free[key].is_free(row, col)  # nobody else can spawn on the parked player
+
+    ws2 = FakeWebSocket()
+    await new.connect(ws2, Claims("00000101", {}))
+    session = new._sessions[ws2]
+    assert (session.chunk_key, session.row, session.col, session.color) == (key, row, col, before.color)
+    assert not new._parked
+
+
+@pytest.mark.asyncio
+async def test_parked_session_expires(monkeypatch):
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    ws = FakeWebSocket()
+    await hub.connect(ws, Claims("00000101", {}))
+    session = hub._sessions[ws]
+    await hub.park(ws)
+    await hub.disconnect(ws)  # the endpoint still calls it; must not free the cell
+    assert not hub._free[session.chunk_key].is_free(session.row, session.col)
+
+    assert await hub.expire_parked(now=0) == 0
+    assert await hub.expire_parked(now=float("inf")) == 1
+    assert hub._free[session.chunk_key].is_free(session.row, session.col)
+    assert int(hub._chunk(session.chunk_key)[session.row, session.col]) == session.underlying
+
+
+@pytest.mark.asyncio
+async def test_resume_after_drop_sends_only_missed_cells(monkeypatch):
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "append_player_action", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "W", 16)
+    monkeypatch.setattr(hd, "H", 16)
+    hub = hd.Hub()
+    flaky, other = FakeWebSocket(), FakeWebSocket()
+    await hub.connect(flaky, Claims("00000001", {}))
+    await hub.connect(other, Claims("00000010", {}))
+    await settle()
+    token = next(json.loads(t)["resume"] for t in flaky.sent if json.loads(t)["type"] == "session")
+    seen = [json.loads(t) for t in flaky.sent if json.loads(t)["type"] == "matrix"][-1]
+    before = hub._sessions[flaky]
+
+    await hub.park(flaky, 20)
+    await hub.disconnect(flaky)
+    start = (hub._sessions[other].row, hub._sessions[other].col)
+    await hub.move(other, 0, 1 if start[1] < 8 else -1)
+    moved = (hub._sessions[other].row, hub._sessions[other].col)
+
+    back = FakeWebSocket()
+    await hub.connect(back, Claims("00000001", {}), resume=hd.ResumeRequest(token, "0,0", seen["version"]))
+    frames = [json.loads(t) for t in back.sent]
+    assert [f["type"] for f in frames] == ["session", "delta"]
+    assert frames[0]["resume"] != token
+    delta = frames[1]
+    assert delta["since"] == seen["version"] and delta["version"] == seen["version"] + 1
+    assert {i for i, _ in delta["cells"]} == {start[0] * 16 + start[1], moved[0] * 16 + moved[1]}
+    assert (hub._sessions[back].row, hub._sessions[back].col) == (before.row, before.col)
+
+
+@pytest.mark.asyncio
+async def test_resume_with_stale_token_gets_full_matrix(monkeypatch):
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    ws = FakeWebSocket()
+    await hub.connect(ws, Claims("00000001", {}))
+    await hub.park(ws, 20)
+
+    back = FakeWebSocket()
+    await hub.connect(back, Claims("00000001", {}), resume=hd.ResumeRequest("forged", "0,0", 1))
+    assert [json.loads(t)["type"] for t in back.sent] == ["session", "matrix"]
+
+
+@pytest.mark.asyncio
+async def test_connect_batch_saves_and_broadcasts_each_chunk_once(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    saved, broadcast = [], []
+    fake_save = hd.save_chunk  # the FakeDB one from configure_hub
+    monkeypatch.setattr(hd, "save_chunk", lambda key, board: (saved.append(key), fake_save(key, board)))
+    real_broadcast = hub._broadcast_chunk
+
+    async def counting_broadcast(key):
+        broadcast.append(key)
+        await real_broadcast(key)
+    monkeypatch.setattr(hub, "_broadcast_chunk", counting_broadcast)
+
+    sockets = [FakeWebSocket() for _ in range(6)]
+    errors = await hub.connect_batch([(ws, None, None, None) for ws in sockets])
+
+    assert errors == [None] * 6
+    assert all(hub._sessions[ws].chunk_key is not None for ws in sockets)
+    touched = {hub._sessions[ws].chunk_key for ws in sockets}
+    assert sorted(saved) == sorted(touched)
+    assert sorted(broadcast) == sorted(touched)
+
+
+@pytest.mark.asyncio
+async def test_lone_connects_and_batches_hold_the_lock_under_their_own_site(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    held = lambda site: hd.LOCK_HOLD_SECONDS.labels(site).count
+    lone, batched = held("connect"), held("connect_batch")
+
+    await hub.connect(FakeWebSocket())
+    assert (held("connect"), held("connect_batch")) == (lone + 1, batched)
+    await hub.connect_batch([(FakeWebSocket(), None, None, None) for _ in range(2)])
+    assert (held("connect"), held("connect_batch")) == (lone + 1, batched + 1)
+
+
+@pytest.mark.asyncio
+async def test_session_registry_is_the_only_per_socket_state(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    ws = FakeWebSocket()
+    await hub.connect(ws)
+    await hub.set_view_radius(ws, 1)
+    session = hub._sessions[ws]
+    assert not hasattr(session, "__dict__")
+    assert all(isinstance(v, int) for v in (session.row, session.col, session.visible, session.underlying, session.color))
+    assert all(session in hub._chunk_watchers[key] for key in session.subs)
+
+    await hub.disconnect(ws)
+    assert hub.socket_count() == 0 and not hub._chunk_watchers
+
+
+@pytest.mark.asyncio
+async def test_watcher_counts_label_only_the_busiest_chunks(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    hub = hd.Hub()
+    wide, narrow = FakeWebSocket(), FakeWebSocket()
+    await hub.connect(wide)
+    await hub.connect(narrow)
+    await hub.set_view_radius(wide, 1)
+
+    assert hub.watched_chunk_count() == len(hub._chunk_watchers) > 1
+    assert hub.watch_count() == sum(len(w) for w in hub._chunk_watchers.values())
+    assert hub.watcher_counts(1) == {"0,0": 2}
+    assert len(hub.watcher_counts(3)) == 3
+
+    await hub.disconnect(wide)
+    await hub.disconnect(narrow)
+    assert hub.watch_count() == 0 and hub.watcher_counts(3) == {}
+
+
+@pytest.mark.asyncio
+async def test_idle_socket_hibernates_and_wakes_with_snapshot(monkeypatch):
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "append_player_action", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "IDLE_HIBERNATE_SECONDS", 60)
+    hub = hd.Hub()
+    afk, active = FakeWebSocket(), FakeWebSocket()
+    await hub.connect(afk)
+    await hub.connect(active)
+
+    assert await hub.hibernate_idle() == 0
+    hub._sessions[afk].last_input -= 61
+    assert await hub.hibernate_idle() == 1
+    assert json.loads(afk.sent[-1]) == {"type": "hibernate"}
+    assert hub._sessions[afk] not in hub._chunk_watchers[hub._root_chunk_key]
+    assert hub.hibernating_count() == 1
+
+    # updates skip the hibernating socket; a summary is all it hears
+    afk.sent.clear()
+    await hub.color_plus_plus(active)
+    assert afk.sent == []
+    assert await hub.send_summaries() == 1
+    summary = json.loads(afk.sent[-1])
+    assert summary["type"] == "summary" and summary["chunk_id"] == "0,0" and summary["total_players"] == 2
+
+    # next input: back in the fan-out, with the current board
+    afk.sent.clear()
+    await hub.touch(afk)
+    frame = json.loads(afk.sent[-1])
+    assert frame["type"] == "matrix" and frame["version"] == hub._versions[hub._root_chunk_key]
+    assert hub._sessions[afk] in hub._chunk_watchers[hub._root_chunk_key]
+    assert hub.hibernating_count() == 0
+
+    # a hibernating socket that leaves takes its dormant membership with it
+    await hub.hibernate_idle(now=float("inf"))
+    await hub.disconnect(afk)
+    await hub.disconnect(active)
+    assert not hub._chunk_watchers and not hub._dormant
+
+
+@pytest.mark.asyncio
+async def test_spectator_sees_moves_without_being_a_player(monkeypatch):
+    from game.spectate import Spectators
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "append_player_action", lambda *a, **k: None)
+    hub = hd.Hub()
+    spectators = Spectators(hub._bus, hub.snapshot, hd.Hub._send)
+    watcher = FakeWebSocket()
+    spectators.add(watcher, [hub._root_chunk_key])
+    free_before = len(hub._free[hub._root_chunk_key])
+    await settle()
+
+    player = FakeWebSocket()
+    await hub.connect(player)
+    await hub.color_plus_plus(player)
+    await settle()
+
+    assert hub.socket_count() == 1
+    assert len(hub._free[hub._root_chunk_key]) == free_before - 1  # only the player took a cell
+    versions = [json.loads(t)["version"] for t in watcher.sent]
+    assert versions[0] == 0 and versions[-1] == hub._versions[hub._root_chunk_key]
+
+
+def test_snapshot_of_unheld_chunks_is_not_cached():
+    hub = hd.Hub()
+    held = set(hub._chunks), set(hub._free)
+    for col in range(1, 50):
+        frame = json.loads(hub.snapshot(hd.key_from_coords(0, col)))
+        assert frame["chunk_id"] == f"0,{col}" and frame["data"] == [0] * 16
+    assert (set(hub._chunks), set(hub._free)) == held
+
+
+@pytest.mark.asyncio
+async def test_two_tabs_of_one_user_park_and_expire_separately(monkeypatch, tmp_path):
+    from game.tokens import Claims
+    monkeypatch.setattr(hd, "get_player_position", lambda user_id: None)
+    monkeypatch.setattr(hd, "save_player_position", lambda *a, **k: None)
+    monkeypatch.setattr(hd, "W", 16)
+    monkeypatch.setattr(hd, "H", 16)
+    hub = hd.Hub()
+    tabs = [FakeWebSocket(), FakeWebSocket()]
+    for ws in tabs:
+        await hub.connect(ws, Claims("00000101", {}))
+    cells = [(hub._sessions[ws].chunk_key, hub._sessions[ws].row, hub._sessions[ws].col) for ws in tabs]
+    for ws in tabs:
+        await hub.park(ws)
+    assert hub.parked_count() == 2
+
+    # both tabs' players survive a restart and both can be claimed back
+    path = tmp_path / "checkpoint.bin"
+    assert await hub.save_checkpoint(path) == 2
+    new = hd.Hub()
+    assert new.restore_checkpoint(path) and new.parked_count() == 2
+    back = FakeWebSocket()
+    await new.connect(back, Claims("00000101", {}))
+    assert new.parked_count() == 1
+
+    assert await new.expire_parked(now=float("inf")) == 1
+    assert new.parked_count() == 0
+    left = [c for c in cells if c != (new._sessions[back].chunk_key, new._sessions[back].row, new._sessions[back].col)]
+    assert len(left) == 1
+    key, row, col = left[0]
+    assert new._free[key].is_free(row, col)
+    assert not hd.has_bit_int(int(new._chunk(key)[row, col]), hd.BIT_IS_PLAYER)
@@ -0,0 +1,44 @@
+import sqlite3
+
+import torch
+
+from services.game import ids
+from services.game.db import ChunkDB
+
+
+def test_key_roundtrip_and_string_boundary():
+    for cx, cy in [(0, 0), (3, -2), (-1, -1), (2**30 - 1, -2**30), (-12345, 678)]:
+        key = ids.key_from_coords(cx, cy)
+        assert ids.coords_from_key(key) == (cx, cy)
+        assert ids.key_from_id(ids.chunk_id_from_coords(cx, cy)) == key
+        assert ids.id_from_key(key) == f"{cx},{cy}"
+
+
+def test_neighbor_key_steps_without_decoding():
+    for cx, cy in [(0, 0), (-1, 0), (0, -1), (7, 8), (-8, 7), (2**20, -2**20)]:
+        key = ids.key_from_coords(cx, cy)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                assert ids.neighbor_key(key, dx, dy) == ids.key_from_coords(cx + dx, cy + dy)
+
+
+def test_keys_of_a_block_are_contiguous():
+    # an aligned 4x4 block of chunks occupies 16 consecutive keys
+    keys = sorted(ids.key_from_coords(x, y) for x in range(4, 8) for y in range(-4, 0))
+    assert keys == list(range(keys[0], keys[0] + 16))
+
+
+def test_chunk_db_migrates_text_ids(tmp_path):
+    path = tmp_path / "world.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE chunks (id TEXT PRIMARY KEY, w INTEGER NOT NULL, h INTEGER NOT NULL,"
+                 " data BLOB NOT NULL, last_used INTEGER)")
+    board = torch.arange(64 * 64, dtype=torch.int64).remainder(256).to(torch.uint8).reshape(64, 64)
+    conn.execute("INSERT INTO chunks VALUES (?, 64, 64, ?, 0)", ("-3,5", board.numpy().tobytes()))
+    conn.commit()
+    conn.close()
+
+    db = ChunkDB(path)
+    assert db.list_chunk_ids() == ["-3,5"]
+    assert torch.equal(db.load_chunk(ids.key_from_coords(-3, 5)), board)
+    assert ChunkDB(path).list_chunk_keys() == [ids.key_from_coords(-3, 5)]  # second open is a no-op
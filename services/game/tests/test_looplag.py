@@ -0,0 +1,36 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from services.game.looplag import LoopLagMonitor
+
+pytest_plugins = "pytest_asyncio"
+
+
+def append_everything_to_json():
+    time.sleep(0.3)  # stands in for blocking file I/O on the loop
+
+
+@pytest.mark.asyncio
+async def test_blocked_loop_is_reported_with_offending_task_and_frame(caplog):
+    monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+    monitor.start()
+    try:
+        async def handle_move():
+            append_everything_to_json()
+
+        with caplog.at_level(logging.WARNING, logger="voxel-looplag"):
+            await asyncio.sleep(0.05)
+            await asyncio.create_task(handle_move(), name="ws-client-7")
+            await asyncio.sleep(0.1)
+    finally:
+        monitor.stop()
+
+    assert monitor.stalls == 1
+    blocked = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Event loop blocked")]
+    assert len(blocked) == 1
+    assert "ws-client-7" in blocked[0] and "handle_move" in blocked[0]
+    assert "test_looplag.py:append_everything_to_json" in blocked[0]
+    assert any("unblocked" in r.getMessage() for r in caplog.records)
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+
+from services.game import metrics as mt
+
+pytest_plugins = "pytest_asyncio"
+
+
+def test_histogram_buckets_are_cumulative_in_render():
+    hist = mt.Histogram("t_seconds", "test", buckets=(0.001, 0.01))
+    for value in (0.0005, 0.002, 0.002, 5.0):
+        hist.observe(value)
+    lines = hist.render()
+    assert 't_seconds_bucket{le="0.001"} 1' in lines
+    assert 't_seconds_bucket{le="0.01"} 3' in lines
+    assert 't_seconds_bucket{le="+Inf"} 4' in lines
+    assert "t_seconds_count 4" in lines
+
+
+@pytest.mark.asyncio
+async def test_timed_wraps_sync_and_async_functions():
+    hist = mt.Histogram("t2_seconds", "test")
+
+    @hist.timed
+    def add(a, b):
+        return a + b
+
+    @hist.timed
+    async def later(x):
+        await asyncio.sleep(0)
+        return x
+
+    assert add(1, 2) == 3
+    assert await later("x") == "x"
+    assert hist.count == 2
+
+
+@pytest.mark.asyncio
+async def test_instrumented_lock_records_wait_and_hold_per_call_site():
+    wait = mt.HistogramFamily("t3_wait_seconds", "test", "site")
+    hold = mt.HistogramFamily("t3_hold_seconds", "test", "site")
+    lock = mt.InstrumentedLock(wait, hold)
+
+    async def move():
+        async with lock:
+            await asyncio.sleep(0.02)
+
+    async def connect():
+        async with lock:
+            pass
+
+    task = asyncio.create_task(move())
+    await asyncio.sleep(0)
+    await connect()
+    await task
+    assert wait.labels("connect").sum >= 0.015
+    assert hold.labels("move").sum >= 0.015 and hold.labels("connect").count == 1
+    assert 't3_hold_seconds_count{site="move"} 1' in hold.render()
+
+
+def test_render_includes_labelled_gauges(monkeypatch):
+    # a copy of the registry, so the test gauge does not show up in later /metrics output
+    monkeypatch.setattr(mt, "_registry", dict(mt._registry))
+    mt.gauge("t_watchers", "test", lambda: {"0,0": 2, "1,0": 1}, label="chunk_id")
+    text = mt.render()
+    assert "# TYPE t_watchers gauge" in text
+    assert 't_watchers{chunk_id="0,0"} 2' in text
+    assert "# TYPE voxel_hub_move_seconds histogram" in text
+
+
+@pytest.mark.asyncio
+async def test_instrumented_lock_knows_which_function_holds_it():
+    lock = mt.InstrumentedLock(mt.HistogramFamily("t4w", "test", "site"), mt.HistogramFamily("t4h", "test", "site"))
+    seen = []
+
+    async def color_plus_plus():
+        async with lock:
+            seen.append(lock.holder)
+
+    await color_plus_plus()
+    assert seen == ["color_plus_plus"] and lock.holder is None
+
+
+@pytest.mark.asyncio
+async def test_instrumented_lock_records_under_an_explicit_site():
+    lock = mt.InstrumentedLock(mt.HistogramFamily("t5w", "test", "site"), mt.HistogramFamily("t5h", "test", "site"))
+    seen = []
+
+    async def connect_batch(site):
+        async with lock.at(site):
+            seen.append(lock.holder)
+
+    await connect_batch("connect")
+    await connect_batch("connect_batch")
+    assert seen == ["connect", "connect_batch"] and lock.holder is None
+    assert lock._hold.labels("connect").count == 1 and lock._hold.labels("connect_batch").count == 1
@@ -0,0 +1,62 @@
+import random
+import pytest
+import torch
+
+from services.game.occupancy import AllFree, FreeCells
+
+
+def test_from_board_skips_player_cells():
+    board = torch.zeros((2, 3), dtype=torch.uint8)
+    board[0, 1] = 1  # player bit 0
+    board[1, 2] = 1
+    free = FreeCells.from_board(board, player_bit=0)
+    assert len(free) == 4
+    assert not free.is_free(0, 1)
+    assert not free.is_free(1, 2)
+    assert free.is_free(0, 0)
+
+
+def test_occupy_and_release_keep_index_consistent():
+    free = FreeCells(range(16), 4, 4)
+    free.occupy(1, 1)
+    free.occupy(1, 1)  # idempotent
+    assert len(free) == 15
+    assert not free.is_free(1, 1)
+    free.release(1, 1)
+    free.release(1, 1)
+    assert len(free) == 16
+    assert free.is_free(1, 1)
+
+
+def test_pick_is_deterministic_and_only_returns_free_cells():
+    def picks(seed):
+        free = FreeCells(range(64), 8, 8)
+        rng = random.Random(seed)
+        out = []
+        while len(free):
+            r, c = free.pick(rng)
+            assert free.is_free(r, c)
+            free.occupy(r, c)
+            out.append((r, c))
+        return out
+
+    first = picks(42)
+    assert first == picks(42)
+    assert len(set(first)) == 64
+
+
+def test_all_free_picks_like_a_full_index():
+    full, shared = FreeCells(range(12), 3, 4), AllFree(3, 4)
+    a, b = random.Random(7), random.Random(7)
+    assert len(shared) == 12 and shared.is_free(2, 3)
+    assert [full.pick(a) for _ in range(20)] == [shared.pick(b) for _ in range(20)]
+    with pytest.raises(TypeError):
+        shared.occupy(0, 0)
+
+
+def test_index_is_unboxed_and_small():
+    free = FreeCells.from_board(torch.zeros((64, 64), dtype=torch.uint8), player_bit=7)
+    assert free._cells.typecode == free._slot.typecode == "H"
+    assert free._cells.itemsize * len(free._cells) + free._slot.itemsize * len(free._slot) == 4 * 64 * 64
+    free.occupy(63, 63)
+    assert not free.is_free(63, 63) and free.is_free(0, 0)
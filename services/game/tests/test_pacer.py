@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+import pytest
+
+from services.game.pacer import ClientPacer
+
+pytest_plugins = "pytest_asyncio"
+
+
+class Socket:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.sent = []
+        self.delay = delay
+        self.fail = fail
+
+    async def send_text(self, text: str):
+        if self.fail:
+            raise ConnectionError("gone")
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+
+async def send(ws, text):
+    await ws.send_text(text)
+
+
+@pytest.mark.asyncio
+async def test_fast_client_gets_every_frame():
+    ws = Socket()
+    pacer = ClientPacer(ws, send, lambda ws: None)
+    for i in range(20):
+        pacer.offer("0,0", f"m{i}")
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.01)
+    assert ws.sent == [f"m{i}" for i in range(20)]
+    assert pacer.interval() < 0.005
+
+
+@pytest.mark.asyncio
+async def test_slow_client_gets_fewer_fresher_frames():
+    ws = Socket(delay=0.03)
+    pacer = ClientPacer(ws, send, lambda ws: None)
+    for i in range(40):
+        pacer.offer("0,0", f"a{i}")
+        pacer.offer("1,0", f"b{i}")
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.5)
+    pacer.close()
+
+    # no backlog: far fewer frames than produced, and each chunk ends on its latest frame
+    assert len(ws.sent) < 20
+    assert [t for t in ws.sent if t.startswith("a")][-1] == "a39"
+    assert [t for t in ws.sent if t.startswith("b")][-1] == "b39"
+    assert pacer.interval() >= 0.06
+
+
+@pytest.mark.asyncio
+async def test_pushed_frames_are_never_dropped():
+    ws = Socket(delay=0.01)
+    pacer = ClientPacer(ws, send, lambda ws: None)
+    pacer.offer("0,0", "m1")
+    pacer.push("note1")
+    pacer.offer("0,0", "m2")
+    pacer.push("note2")
+    await asyncio.sleep(0.1)
+    # m2 takes the queued m1's place; the notes stay in the order they were pushed
+    assert ws.sent == ["m2", "note1", "note2"]
+
+
+@pytest.mark.asyncio
+async def test_round_trip_sets_the_pace():
+    ws = Socket()
+    pacer = ClientPacer(ws, send, lambda ws: None, max_interval=1.0)
+    pacer.ping()
+    await asyncio.sleep(0.2)
+    ping = json.loads(ws.sent[-1])
+    assert ping["type"] == "ping"
+    pacer.pong(ping["t"] + 1)  # not ours
+    assert pacer.rtt is None
+    pacer.pong(ping["t"])
+    assert pacer.rtt >= 0.2 and pacer.interval() >= 0.1
+    pacer.pong(ping["t"])  # answered twice: counted once
+    assert pacer.rtt < 0.3
+
+
+@pytest.mark.asyncio
+async def test_send_failure_reports_the_socket():
+    ws = Socket(fail=True)
+    dropped = []
+    pacer = ClientPacer(ws, send, dropped.append)
+    pacer.offer("0,0", "m")
+    await asyncio.sleep(0.01)
+    assert dropped == [ws]
+
+
+@pytest.mark.asyncio
+async def test_direct_frame_is_never_overtaken_by_an_older_one():
+    ws = Socket(delay=0.05)
+    pacer = ClientPacer(ws, send, lambda ws: None)
+    pacer.offer("0,0", "m1")
+    pacer.offer("1,0", "other")
+    await asyncio.sleep(0.01)  # the send task is mid-way through m1, with "other" taken as well
+    ws.delay = 0.0
+    await pacer.send_now("0,0", "m2")
+    await pacer.send_now("1,0", "other2")
+    await asyncio.sleep(0.05)
+    # m1 was already on the wire, so m2 follows it; the taken "other" is superseded unsent
+    assert ws.sent == ["m1", "m2", "other2"]
@@ -0,0 +1,27 @@
+from services.game import players_db as pdb
+
+
+def test_buffer_keeps_only_latest_position(tmp_path):
+    db = pdb.PlayerDB(tmp_path / "players.db")
+    buf = pdb.PositionBuffer(db, flush_interval=60)
+
+    for col in range(10):
+        buf.stage("p1", "0,0", 5, col)
+    buf.stage("p2", "1,0", 0, 0)
+
+    # nothing hits SQLite until the flush
+    assert db.get_player_position("p1") is None
+    assert buf.get("p1") == ("0,0", 5, 9)
+
+    assert buf.flush() == 2
+    assert db.get_player_position("p1") == ("0,0", 5, 9)
+    assert db.get_player_position("p2") == ("1,0", 0, 0)
+    assert buf.get("p1") is None
+
+
+def test_buffer_is_due_after_interval(tmp_path):
+    db = pdb.PlayerDB(tmp_path / "players.db")
+    buf = pdb.PositionBuffer(db, flush_interval=0)
+    assert not buf.due()  # nothing staged
+    buf.stage("p1", "0,0", 1, 1)
+    assert buf.due()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from services.game import main
+from services.game.profiler import SamplingProfiler
+
+
+def busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_collects_collapsed_stacks_with_lock_holder():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="worker")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.002, holder=lambda: "move")
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stop.set()
+    worker.join()
+
+    lines = profiler.collapsed().splitlines()
+    assert profiler.samples > 10
+    assert any(l.startswith("worker;[lock: move];") and "test_profiler.py:busy_loop" in l for l in lines)
+    assert all(l.rsplit(" ", 1)[1].isdigit() for l in lines)
+    assert profiler.summary()["lock_holders"] == {"move": profiler.samples}
+
+
+def test_profile_endpoint_requires_admin_token(monkeypatch):
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.post("/admin/profile?seconds=0").status_code == 404
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    assert client.post("/admin/profile?seconds=0", headers={"X-Admin-Token": "nope"}).status_code == 403
+
+    res = client.post("/admin/profile?seconds=0.1&interval_ms=2&format=json",
+                      headers={"Authorization": "Bearer s3cret"})
+    assert res.status_code == 200
+    body = res.json()
+    assert body["samples"] > 0 and "free" in body["lock_holders"]
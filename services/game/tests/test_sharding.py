@@ -0,0 +1,96 @@
+import os
+import pytest
+from jose import jwt, JWTError
+
+from services.game import sharding as sh
+from services.game.ids import key_from_coords as key
+from services.game.settings import JWT_SECRET, JWT_ALG
+
+
+def test_shard_map_groups_chunks_into_region_blocks():
+    shards = sh.ShardMap(4, region=4)
+    assert {shards.shard_for(key(x, y)) for x in range(4) for y in range(4)} == {shards.shard_for(key(0, 0))}
+    assert all(0 <= shards.shard_for(key(x, y)) < 4 for x in range(-20, 20) for y in range(-20, 20))
+    # negative coordinates use floor division: -1 and -4 share block -1
+    assert shards.shard_for(key(-1, 0)) == shards.shard_for(key(-4, 3))
+
+
+def test_single_shard_owns_everything():
+    shards = sh.ShardMap(1)
+    assert {shards.shard_for(key(x, -x)) for x in range(50)} == {0}
+
+
+def test_handoff_ticket_roundtrip():
+    ticket = sh.HandoffTicket("00000101", "3,-2", 5, 7, 42)
+    assert sh.read_handoff(sh.issue_handoff(ticket)) == ticket
+
+
+def test_handoff_ticket_is_not_a_login_token():
+    from services.game import main
+    ticket = sh.issue_handoff(sh.HandoffTicket("00000101", "3,-2", 5, 7, 42))
+    claims, reason = main._verify_token_or_reason(ticket)
+    assert claims is None and "handoff" in reason
+    login = jwt.encode({"sub": "00000101"}, JWT_SECRET, algorithm=JWT_ALG)
+    assert main._verify_token_or_reason(login)[0].user_id == "00000101"
+
+
+def test_handoff_rejects_login_tokens_and_forgeries():
+    login = jwt.encode({"sub": "00000101"}, JWT_SECRET, algorithm=JWT_ALG)
+    with pytest.raises(ValueError):
+        sh.read_handoff(login)
+    forged = jwt.encode({"typ": "handoff", "sub": "1", "chunk": "0,0", "row": 0, "col": 0, "color": 0},
+                        "not-the-secret", algorithm=JWT_ALG)
+    with pytest.raises(JWTError):
+        sh.read_handoff(forged)
+
+
+def test_message_and_history_files_are_split_per_shard_and_folded_back(monkeypatch, tmp_path):
+    import json
+    from services.game import db, db_history
+    from services.game.ids import key_from_id
+    monkeypatch.setattr(db, "BASE_MESSAGES_JSON_PATH", tmp_path / "message.json")
+    monkeypatch.setattr(db_history, "BASE_HISTORIES_JSON_PATH", tmp_path / "history.json")
+    shards = sh.ShardMap(2, region=1)
+    chunk_ids = [f"{x},0" for x in range(8)]
+    owner = {cid: shards.shard_for(key_from_id(cid)) for cid in chunk_ids}
+    assert set(owner.values()) == {0, 1}
+    (tmp_path / "message.json").write_text(json.dumps(
+        {f"{cid}_1_1": {"chunk_id": cid, "content": cid} for cid in chunk_ids}), encoding="utf-8")
+
+    db.split_messages_by_shard(2, shards.shard_for)
+    for shard_id in (0, 1):
+        part = json.loads((tmp_path / f"message.shard-{shard_id}.json").read_text(encoding="utf-8"))
+        assert sorted(m["chunk_id"] for m in part.values()) == sorted(c for c in chunk_ids if owner[c] == shard_id)
+
+    # each worker writes only its own files; a player crossing shards shows up in both histories
+    first = next(c for c in chunk_ids if owner[c] == 0)
+    part = json.loads((tmp_path / "message.shard-0.json").read_text(encoding="utf-8"))
+    part[f"{first}_2_2"] = {"chunk_id": first, "content": "new"}
+    (tmp_path / "message.shard-0.json").write_text(json.dumps(part), encoding="utf-8")
+    (tmp_path / "history.shard-0.json").write_text(json.dumps(
+        {"p": {"chunks": {"0,0": {"actions": [1, 1], "last_ts": 10}}}}), encoding="utf-8")
+    (tmp_path / "history.shard-1.json").write_text(json.dumps(
+        {"p": {"chunks": {"0,0": {"actions": [2], "last_ts": 20}}}, "q": {"chunks": {}}}), encoding="utf-8")
+
+    assert db.fold_shard_messages() == 2
+    assert db_history.fold_shard_histories() == 2
+    assert not list(tmp_path.glob("*.shard-*.json"))
+    messages = json.loads((tmp_path / "message.json").read_text(encoding="utf-8"))
+    assert messages[f"{first}_2_2"]["content"] == "new"
+    assert len(messages) == len(chunk_ids) + 1
+    history = json.loads((tmp_path / "history.json").read_text(encoding="utf-8"))
+    assert history["p"]["chunks"]["0,0"] == {"actions": [1, 1, 2], "last_ts": 20}
+    assert "q" in history
+    assert db.fold_shard_messages() == 0
+
+
+def test_sharded_worker_uses_its_own_data_files(tmp_path):
+    import subprocess
+    import sys
+    env = {**os.environ, "GAME_DATA_DIR": str(tmp_path), "GAME_SHARDS": "3", "GAME_SHARD_ID": "2"}
+    out = subprocess.run(
+        [sys.executable, "-c", "from services.game import db, db_history;"
+                               "print(db.MESSAGES_JSON_PATH.name, db_history.HISTORIES_JSON_PATH.name)"],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    assert out == ["message.shard-2.json", "history.shard-2.json"]
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import pytest
+
+from services.game.bus import InProcessBus
+from services.game.ids import key_from_coords as key
+from services.game.spectate import Spectators
+
+pytest_plugins = "pytest_asyncio"
+
+
+class Socket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+
+async def send(ws, text):
+    await ws.send_text(text)
+
+
+def matrix(cid: str, version: int) -> str:
+    return json.dumps({"type": "matrix", "chunk_id": cid, "version": version})
+
+
+@pytest.mark.asyncio
+async def test_spectators_share_the_published_frames():
+    bus = InProcessBus()
+    encoded = []
+
+    def snapshot(k):
+        encoded.append(k)
+        return matrix("0,0", 0)
+
+    spectators = Spectators(bus, snapshot, send)
+    a, b = Socket(), Socket()
+    spectators.add(a, [key(0, 0)])
+    spectators.add(b, [key(0, 0)])
+    assert encoded == [key(0, 0)]  # the second spectator starts from the kept frame
+    assert bus.wants(key(0, 0))
+    await asyncio.sleep(0.01)
+
+    frame = matrix("0,0", 1)
+    await bus.publish(key(0, 0), frame)
+    await bus.publish(key(1, 0), matrix("1,0", 1))  # not spectated
+    await asyncio.sleep(0.01)
+    assert [json.loads(t)["version"] for t in a.sent] == [0, 1]
+    assert b.sent[-1] is frame  # the very string the hub encoded
+
+    c = Socket()
+    spectators.add(c, [key(0, 0)])
+    await asyncio.sleep(0.01)
+    assert c.sent == [frame] and len(encoded) == 1
+
+
+@pytest.mark.asyncio
+async def test_last_spectator_leaving_unsubscribes():
+    bus = InProcessBus()
+    spectators = Spectators(bus, lambda k: matrix("0,0", 0), send)
+    a, b = Socket(), Socket()
+    spectators.add(a, [key(0, 0), key(1, 0)])
+    spectators.add(b, [key(0, 0)])
+    spectators.remove(a)
+    assert bus.wants(key(0, 0)) and not bus.wants(key(1, 0))
+    spectators.remove(b)
+    assert not bus.wants(key(0, 0)) and spectators.count() == 0
@@ -0,0 +1,61 @@
+import time
+import pytest
+from jose import jwt, JWTError
+
+from services.game import tokens as tk
+
+SECRET = "test-secret"
+
+
+def _token(sub: str, **extra) -> str:
+    return jwt.encode({"sub": sub, "iat": int(time.time()), **extra}, SECRET, algorithm="HS256")
+
+
+def test_verify_returns_claims_with_user_id():
+    verifier = tk.TokenVerifier(SECRET, ["HS256"])
+    claims = verifier.verify(_token("00000101"))
+    assert claims.user_id == "00000101"
+    assert claims.payload["sub"] == "00000101"
+
+
+def test_repeated_token_is_decoded_once(monkeypatch):
+    verifier = tk.TokenVerifier(SECRET, ["HS256"])
+    token = _token("00000001")
+    calls = []
+    real_decode = tk.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return real_decode(*args, **kwargs)
+
+    monkeypatch.setattr(tk.jwt, "decode", counting_decode)
+    first = verifier.verify(token)
+    second = verifier.verify(token)
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_cache_is_bounded_lru():
+    verifier = tk.TokenVerifier(SECRET, ["HS256"], max_size=2)
+    a, b, c = _token("a"), _token("b"), _token("c")
+    verifier.verify(a)
+    verifier.verify(b)
+    verifier.verify(a)  # a becomes most recent
+    verifier.verify(c)  # evicts b
+    assert set(verifier._cache) == {a, c}
+
+
+def test_invalid_token_raises_and_is_not_cached():
+    verifier = tk.TokenVerifier(SECRET, ["HS256"])
+    bad = jwt.encode({"sub": "x"}, "other-secret", algorithm="HS256")
+    with pytest.raises(JWTError):
+        verifier.verify(bad)
+    assert bad not in verifier._cache
+
+
+def test_entry_never_outlives_token_exp():
+    verifier = tk.TokenVerifier(SECRET, ["HS256"], ttl=300)
+    token = _token("a", exp=int(time.time()) + 1)
+    verifier.verify(token)
+    _, expires_at = verifier._cache[token]
+    assert expires_at <= time.monotonic() + 1.5